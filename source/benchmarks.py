@@ -0,0 +1,470 @@
+"""Micro-benchmarks for the ingestion path.
+
+Run against real PubChem payloads, either downloaded on the fly or read from a
+directory of saved PUG-View JSON files:
+
+    python benchmarks.py chunker --cids 2244 3672 1983
+    python benchmarks.py chunker --json-dir payloads/
+    python benchmarks.py chunker --store .cache/pubchem
+    python benchmarks.py loader --store .cache/pubchem --batch-sizes 100 1000 5000
+    python benchmarks.py preprocess --store .cache/pubchem --workers 1 2 4 8
+    python benchmarks.py parse --store .cache/pubchem
+    python benchmarks.py ttft --tokens 300 --first-token-ms 400 --token-ms 15
+    python benchmarks.py retriever --rows 200000 --nprobe 8 16 32
+    python benchmarks.py singleflight --sessions 50
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from pubchem_parser import extract_sections
+
+# Aspirin, ibuprofen, acetaminophen, caffeine, atorvastatin, metformin, warfarin, omeprazole
+DEFAULT_CIDS = [2244, 3672, 1983, 2519, 60823, 4091, 54678486, 4594]
+
+
+async def _download(cids: List[int]) -> List[Dict[str, Any]]:
+    from pubchem_downloader import PubChemDownloader
+
+    async with PubChemDownloader() as downloader:
+        return [data async for _, data in downloader.fetch_many(cids) if data]
+
+
+def load_payloads(args) -> List[Dict[str, Any]]:
+    if args.store:
+        from raw_store import RawResponseStore
+
+        store = RawResponseStore(args.store)
+        try:
+            return [payload for payload in map(store.load, store.drug_ids()) if payload]
+        finally:
+            store.close()
+    if args.json_dir:
+        payloads = []
+        for path in sorted(glob.glob(os.path.join(args.json_dir, "*.json"))):
+            with open(path, encoding="utf-8") as f:
+                payloads.append(json.load(f))
+        return payloads
+    return asyncio.run(_download(args.cids))
+
+
+def section_texts(payloads: List[Dict[str, Any]]) -> List[str]:
+    texts = []
+    for payload in payloads:
+        extracted = extract_sections(payload)
+        if extracted:
+            texts.extend(extracted[1].values())
+    return texts
+
+
+def _best_of(repeat: int, func, *args) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench_chunker(args) -> None:
+    """Compare TokenChunker against the per-call RecursiveCharacterTextSplitter it replaced."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from transformers import GPT2TokenizerFast
+
+    from chunker import TokenChunker
+
+    tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
+    texts = section_texts(load_payloads(args))
+    if not texts:
+        print("No sections to chunk.")
+        return
+
+    def legacy(text: str) -> List[str]:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=500,
+            chunk_overlap=50,
+            length_function=lambda piece: len(tokenizer.encode(piece)),
+            is_separator_regex=False,
+        )
+        return splitter.split_text(text)
+
+    chunker = TokenChunker(tokenizer, chunk_size=500, chunk_overlap=50)
+    mismatches = sum(1 for text in texts if legacy(text) != chunker.split_text(text))
+
+    legacy_seconds = _best_of(args.repeat, lambda: [legacy(text) for text in texts])
+    chunker_seconds = _best_of(args.repeat, lambda: [chunker.split_text(text) for text in texts])
+    total_tokens = sum(len(tokenizer.encode(text)) for text in texts)
+
+    print(f"{len(texts)} sections, {total_tokens} tokens, {mismatches} with different chunk boundaries")
+    print(f"RecursiveCharacterTextSplitter: {legacy_seconds * 1000:9.1f} ms")
+    print(f"TokenChunker:                   {chunker_seconds * 1000:9.1f} ms")
+    print(f"Speedup: {legacy_seconds / chunker_seconds:.1f}x")
+
+
+def bench_loader(args) -> None:
+    """Compare executemany against Parquet + COPY, loading into a local DuckDB stand-in for drug_data."""
+    import duckdb
+
+    from loaders import ChunkLoader, DuckDBTarget, content_hash
+
+    texts = section_texts(load_payloads(args))
+    if not texts:
+        print("No sections to load.")
+        return
+    # Roughly chunk-sized pieces of real text; tokenization is not what is being measured here
+    pieces = [text[i:i + 2000] for text in texts for i in range(0, len(text), 2000)]
+    loader = ChunkLoader(DuckDBTarget())
+
+    print(f"{'rows':>8}{'executemany rows/s':>22}{'staged rows/s':>18}")
+    for batch_size in args.batch_sizes:
+        rows = [(f"Compound {i}", "Drug and Medication Information", pieces[i % len(pieces)], "Analgesic")
+                for i in range(batch_size)]
+        rows = [row + (content_hash(*row[:3]),) for row in rows]
+        rates = []
+        for load in (loader.load_executemany, loader.load_staged):
+            connection = duckdb.connect()
+            connection.execute("CREATE TABLE drug_data (record_title VARCHAR, heading VARCHAR, chunk VARCHAR, "
+                               "category VARCHAR, content_hash VARCHAR)")
+            seconds = _best_of(args.repeat, load, connection, rows, "drug_data")
+            rates.append(batch_size / seconds)
+            connection.close()
+        print(f"{batch_size:>8}{rates[0]:>22.0f}{rates[1]:>18.0f}")
+
+
+def bench_preprocess(args) -> None:
+    """Parse + chunk throughput in-process and with ProcessPoolExecutor workers of increasing count."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    import preprocess_worker
+
+    payloads = load_payloads(args)
+    if not payloads:
+        print("No payloads to preprocess.")
+        return
+    # Workers receive raw response bodies, exactly as the pipeline hands them over
+    bodies = [json.dumps(payload).encode("utf-8") for payload in payloads]
+    items = [(i, bodies[i % len(bodies)]) for i in range(max(args.records, len(bodies)))]
+
+    preprocess_worker.init_worker()
+    serial_seconds = _best_of(args.repeat, lambda: [preprocess_worker.preprocess_record(item) for item in items])
+    print(f"{len(items)} records ({len(payloads)} distinct), "
+          f"{sum(len(body) for body in bodies) / len(bodies) / 1024:.0f} KiB average body")
+    print(f"{'workers':>8}{'records/s':>12}{'speedup':>10}")
+    print(f"{'serial':>8}{len(items) / serial_seconds:>12.1f}{1.0:>10.2f}")
+
+    for workers in args.workers:
+        with ProcessPoolExecutor(max_workers=workers, initializer=preprocess_worker.init_worker) as pool:
+            # Warm-up: start every process and load its tokenizer before timing
+            list(pool.map(preprocess_worker.preprocess_record, items[:workers * 2]))
+            seconds = _best_of(args.repeat, lambda: list(pool.map(preprocess_worker.preprocess_record, items,
+                                                                  chunksize=4)))
+        print(f"{workers:>8}{len(items) / seconds:>12.1f}{serial_seconds / seconds:>10.2f}")
+
+
+def _peak_rss_kib() -> int:
+    # ru_maxrss survives fork + exec on Linux and would report the parent's peak; VmHWM starts afresh
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _parse_child(mode: str, directory: str) -> None:
+    """Runs in a fresh interpreter so the peak RSS reflects one parse path only."""
+    from pubchem_parser import parse_drug
+    from streaming_parser import parse_file
+
+    paths = sorted(glob.glob(os.path.join(directory, "*.json")))
+    drugs = 0
+    started = time.perf_counter()
+    for path in paths:
+        with open(path, "rb") as f:
+            if mode == "tree":
+                drug = parse_drug(json.load(f))
+            elif mode == "stream":
+                drug = parse_file(f)
+            else:  # baseline: read the bytes, parse nothing
+                f.read()
+                drug = None
+        drugs += drug is not None
+    seconds = time.perf_counter() - started
+    print(json.dumps({"seconds": seconds, "max_rss_kib": _peak_rss_kib(),
+                      "drugs": drugs}))
+
+
+def bench_parse(args) -> None:
+    """Peak RSS and parse time of json.loads + extract_sections vs. the streaming section parser."""
+    payloads = load_payloads(args)
+    if not payloads:
+        print("No payloads to parse.")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i, payload in enumerate(payloads):
+            with open(os.path.join(tmp_dir, f"{i:06d}.json"), "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+        sizes = [os.path.getsize(path) for path in glob.glob(os.path.join(tmp_dir, "*.json"))]
+        print(f"{len(sizes)} records, {sum(sizes) / 2 ** 20:.1f} MiB total, {max(sizes) / 2 ** 20:.1f} MiB largest")
+
+        here = os.path.dirname(os.path.abspath(__file__))
+        results = {}
+        for mode in ("baseline", "tree", "stream"):
+            runs = []
+            for _ in range(args.repeat):
+                child = subprocess.run(
+                    [sys.executable, "-c", f"import benchmarks; benchmarks._parse_child({mode!r}, {tmp_dir!r})"],
+                    cwd=here, capture_output=True, text=True, check=True,
+                )
+                runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+            results[mode] = min(runs, key=lambda run: run["seconds"])
+
+    baseline = results["baseline"]["max_rss_kib"]
+    print(f"{'parser':>8}{'time ms':>10}{'peak RSS MiB':>14}{'over baseline':>15}{'drugs':>7}")
+    for mode in ("tree", "stream"):
+        run = results[mode]
+        print(f"{mode:>8}{run['seconds'] * 1000:>10.1f}{run['max_rss_kib'] / 1024:>14.1f}"
+              f"{(run['max_rss_kib'] - baseline) / 1024:>15.1f}{run['drugs']:>7}")
+
+
+def start_fake_cortex(first_token_seconds: float, token_seconds: float, tokens: int):
+    """Local stand-in for the Cortex REST complete endpoint that streams a canned answer as SSE."""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from cortex_stream import COMPLETE_PATH
+
+    class Handler(BaseHTTPRequestHandler):
+        # Chunked HTTP/1.1, like the real endpoint, so each event is readable as soon as it is sent
+        protocol_version = "HTTP/1.1"
+
+        def _send_chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_POST(self):
+            if self.path != COMPLETE_PATH:
+                self.send_error(404)
+                return
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with server.lock:
+                server.requests += 1
+            time.sleep(first_token_seconds)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(tokens):
+                event = {"choices": [{"delta": {"content": f"token{i} "}}]}
+                self._send_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                time.sleep(token_seconds)
+            self._send_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_ttft(args) -> None:
+    """Time to first token and total time: streamed REST completion vs. waiting for the whole answer."""
+    import statistics
+
+    from cortex_stream import CortexRestClient
+
+    server = start_fake_cortex(args.first_token_ms / 1000, args.token_ms / 1000, args.tokens)
+    client = CortexRestClient(f"http://127.0.0.1:{server.server_address[1]}", "Bearer fake")
+    try:
+        streamed, blocking = [], []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            first = None
+            pieces = 0
+            for _ in client.stream("mistral-large2", "question"):
+                if first is None:
+                    first = time.perf_counter() - started
+                pieces += 1
+            streamed.append((first, time.perf_counter() - started))
+
+            # What the SQL COMPLETE path shows: nothing until the full answer is back
+            started = time.perf_counter()
+            client.complete("mistral-large2", "question")
+            total = time.perf_counter() - started
+            blocking.append((total, total))
+    finally:
+        server.shutdown()
+
+    print(f"{pieces} streamed pieces, median of {args.repeat} runs")
+    print(f"{'path':>10}{'TTFT ms':>10}{'total ms':>10}")
+    for name, runs in (("streamed", streamed), ("blocking", blocking)):
+        print(f"{name:>10}{statistics.median(r[0] for r in runs) * 1000:>10.0f}"
+              f"{statistics.median(r[1] for r in runs) * 1000:>10.0f}")
+
+
+def bench_retriever(args) -> None:
+    """Local IVF search latency and recall@k against an exact scan, on synthetic clustered embeddings."""
+    import numpy as np
+
+    from local_retriever import LocalRetriever, write_index
+
+    rng = np.random.default_rng(0)
+    topics = rng.standard_normal((args.topics, args.dim)).astype(np.float32)
+    # Sentence embeddings have a low intrinsic dimension: spread each topic over a small random subspace
+    basis = rng.standard_normal((32, args.dim)).astype(np.float32) / np.sqrt(32)
+    vectors = topics[rng.integers(args.topics, size=args.rows)] + 0.6 * rng.standard_normal(
+        (args.rows, 32), dtype=np.float32) @ basis
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    categories = [f"category-{i}" for i in rng.integers(args.categories, size=args.rows)]
+    rows = [{"record_title": f"drug-{i}", "chunk": "", "category": category} for i, category in enumerate(categories)]
+    queries = vectors[rng.choice(args.rows, args.queries, replace=False)] + 0.05 * rng.standard_normal(
+        (args.queries, args.dim), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_dir = os.path.join(directory, "index")
+        started = time.perf_counter()
+        write_index(index_dir, vectors, rows, "synthetic")
+        print(f"{args.rows} x {args.dim} vectors indexed in {time.perf_counter() - started:.1f}s")
+
+        exact = LocalRetriever(index_dir, nprobe=1 << 30, embedder=object())
+        truth = [{exact.document(row)["record_title"] for row, _ in exact.search_vector(q, args.k)} for q in queries]
+        print(f"{'nprobe':>8}{'p50 ms':>10}{'p99 ms':>10}{'recall@' + str(args.k):>12}")
+        for nprobe in args.nprobe:
+            retriever = LocalRetriever(index_dir, nprobe=nprobe, embedder=object())
+            latencies, found = [], 0
+            for query, expected in zip(queries, truth):
+                started = time.perf_counter()
+                hits = retriever.search_vector(query, args.k)
+                latencies.append(time.perf_counter() - started)
+                found += len(expected & {retriever.document(row)["record_title"] for row, _ in hits})
+            latencies = np.array(latencies) * 1000
+            print(f"{nprobe:>8}{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}"
+                  f"{found / (args.k * len(queries)):>12.3f}")
+
+        retriever = LocalRetriever(index_dir, nprobe=args.nprobe[0], embedder=object())
+        latencies = []
+        for i, query in enumerate(queries):
+            started = time.perf_counter()
+            retriever.search_vector(query, args.k, f"category-{i % args.categories}")
+            latencies.append(time.perf_counter() - started)
+        print(f"category-filtered, nprobe {args.nprobe[0]}: p50 {np.percentile(latencies, 50) * 1000:.3f} ms")
+
+
+def bench_singleflight(args) -> None:
+    """Concurrent identical questions against the fake Cortex server: backend calls with and without SingleFlight."""
+    import threading
+
+    from cortex_stream import CortexRestClient
+    from single_flight import SingleFlight
+
+    server = start_fake_cortex(args.first_token_ms / 1000, args.token_ms / 1000, args.tokens)
+    client = CortexRestClient(f"http://127.0.0.1:{server.server_address[1]}", "Bearer fake")
+    prompt = "What are the side effects of aspirin?"
+
+    def run(ask) -> tuple:
+        answers = []
+        barrier = threading.Barrier(args.sessions)
+
+        def session(i: int) -> None:
+            barrier.wait()
+            # Same question, typed slightly differently by each session
+            answers.append("".join(ask(prompt.upper() if i % 2 else f"  {prompt} ")))
+
+        before = server.requests
+        started = time.perf_counter()
+        threads = [threading.Thread(target=session, args=(i,)) for i in range(args.sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return server.requests - before, time.perf_counter() - started, len(set(answers))
+
+    single_flight = SingleFlight()
+    try:
+        results = [
+            ("direct", run(lambda p: client.stream("mistral-large2", p))),
+            ("coalesced", run(lambda p: single_flight.stream("mistral-large2", p, client.stream, cacheable=True))),
+            ("cached", run(lambda p: single_flight.stream("mistral-large2", p, client.stream, cacheable=True))),
+        ]
+    finally:
+        server.shutdown()
+
+    print(f"{args.sessions} concurrent sessions asking the same question")
+    print(f"{'path':>10}{'backend calls':>15}{'wall ms':>10}{'distinct answers':>18}")
+    for name, (calls, seconds, distinct) in results:
+        print(f"{name:>10}{calls:>15}{seconds * 1000:>10.0f}{distinct:>18}")
+    print(f"SingleFlight: {single_flight.stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    chunker_parser = subparsers.add_parser("chunker", help="single-pass chunker vs. langchain splitter")
+    chunker_parser.set_defaults(func=bench_chunker)
+
+    loader_parser = subparsers.add_parser("loader", help="executemany vs. staged Parquet loads")
+    loader_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    loader_parser.set_defaults(func=bench_loader)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="parse + chunk throughput vs. worker processes")
+    preprocess_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    preprocess_parser.add_argument("--records", type=int, default=200, help="records per run, payloads are reused")
+    preprocess_parser.set_defaults(func=bench_preprocess)
+
+    parse_parser = subparsers.add_parser("parse", help="peak RSS and time: full JSON tree vs. streaming parser")
+    parse_parser.set_defaults(func=bench_parse)
+
+    ttft_parser = subparsers.add_parser("ttft", help="time to first token against a local fake Cortex SSE server")
+    ttft_parser.add_argument("--tokens", type=int, default=200)
+    ttft_parser.add_argument("--first-token-ms", type=float, default=400)
+    ttft_parser.add_argument("--token-ms", type=float, default=10)
+    ttft_parser.set_defaults(func=bench_ttft)
+
+    retriever_parser = subparsers.add_parser("retriever", help="local IVF retriever latency and recall")
+    retriever_parser.add_argument("--rows", type=int, default=100000)
+    retriever_parser.add_argument("--dim", type=int, default=384)
+    retriever_parser.add_argument("--topics", type=int, default=2000, help="clusters in the synthetic data")
+    retriever_parser.add_argument("--categories", type=int, default=40)
+    retriever_parser.add_argument("--queries", type=int, default=500)
+    retriever_parser.add_argument("--k", type=int, default=3)
+    retriever_parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    retriever_parser.set_defaults(func=bench_retriever)
+
+    singleflight_parser = subparsers.add_parser("singleflight", help="identical concurrent completions coalesced")
+    singleflight_parser.add_argument("--sessions", type=int, default=20)
+    singleflight_parser.add_argument("--tokens", type=int, default=100)
+    singleflight_parser.add_argument("--first-token-ms", type=float, default=400)
+    singleflight_parser.add_argument("--token-ms", type=float, default=5)
+    singleflight_parser.set_defaults(func=bench_singleflight)
+
+    for sub in subparsers.choices.values():
+        sub.add_argument("--cids", type=int, nargs="+", default=DEFAULT_CIDS, help="PubChem CIDs to download")
+        sub.add_argument("--json-dir", help="read saved PUG-View JSON payloads instead of downloading")
+        sub.add_argument("--store", help="read every payload in a raw response store instead of downloading")
+        sub.add_argument("--repeat", type=int, default=3)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
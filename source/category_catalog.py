@@ -0,0 +1,105 @@
+import threading
+import time
+from typing import Callable, List, Optional
+
+CATEGORY_SUMMARY_TABLE = "drug_category_summary"
+
+CREATE_CATEGORY_SUMMARY_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {CATEGORY_SUMMARY_TABLE} (
+        category VARCHAR(100),
+        chunk_count NUMBER,
+        record_count NUMBER,
+        refreshed_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+    )
+"""
+
+# One aggregate over drug_data per ingestion run, so readers never have to scan it
+_REFRESH_CATEGORY_SUMMARY_SQL = [
+    "BEGIN",
+    f"DELETE FROM {CATEGORY_SUMMARY_TABLE}",
+    f"""
+    INSERT INTO {CATEGORY_SUMMARY_TABLE} (category, chunk_count, record_count)
+    SELECT category, COUNT(*), COUNT(DISTINCT record_title)
+    FROM drug_data
+    WHERE category IS NOT NULL
+    GROUP BY category
+    """,
+    "COMMIT",
+]
+
+
+def refresh_category_summary(connection) -> None:
+    """Rebuild drug_category_summary from drug_data in one transaction."""
+    cursor = connection.cursor()
+    try:
+        for sql in _REFRESH_CATEGORY_SUMMARY_SQL:
+            cursor.execute(sql)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def load_categories(session) -> List[str]:
+    """Category names from the summary table, or a scan of drug_data if it is missing or empty."""
+    try:
+        rows = session.sql(f"SELECT category FROM {CATEGORY_SUMMARY_TABLE} ORDER BY category").collect()
+        if rows:
+            return [row.CATEGORY for row in rows]
+    except Exception as e:
+        print(f"Category summary unavailable, scanning drug_data instead: {e}")
+    rows = session.sql("SELECT DISTINCT category FROM drug_data ORDER BY category").collect()
+    return [row.CATEGORY for row in rows]
+
+
+class CategoryCatalog:
+    """Category list cached for ttl_seconds and refreshed in the background.
+
+    Only the very first get() waits for the query. Once the list is older than
+    the TTL, get() keeps returning it while a single background thread reloads
+    it, so no request ever blocks on a refresh; a failed refresh keeps the old
+    list and is retried on the next get().
+    """
+
+    def __init__(self, fetch: Callable[[], List[str]], ttl_seconds: float = 600):
+        self._fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self._categories: Optional[List[str]] = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self) -> List[str]:
+        with self._lock:
+            categories = self._categories
+            stale = time.monotonic() - self._loaded_at > self.ttl_seconds
+            start_refresh = categories is not None and stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+        if categories is None:
+            return self._load()
+        if start_refresh:
+            threading.Thread(target=self._refresh, name="category-catalog-refresh", daemon=True).start()
+        return categories
+
+    def _load(self) -> List[str]:
+        categories = self._fetch()
+        with self._lock:
+            self._categories = categories
+            self._loaded_at = time.monotonic()
+        return categories
+
+    def _refresh(self) -> None:
+        try:
+            self._load()
+        except Exception as e:
+            print(f"Category refresh failed, keeping the cached list: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def invalidate(self) -> None:
+        """Make the next get() start a refresh."""
+        with self._lock:
+            self._loaded_at = 0.0
@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, TypeVar
+
+import streamlit as st
+from snowflake.core import Root
+from snowflake.snowpark import Session
+
+from initiate_cortex import CORTEX_SEARCH_SERVICE
+from snowflake_pool import ResourcePool, session_is_healthy
+
+T = TypeVar("T")
+
+
+@dataclass
+class ChatResources:
+    """A Snowpark session with the Root and Cortex Search handle bound to it."""
+
+    session: Session
+    root: Root
+    svc: Any
+
+
+def snowflake_secrets() -> Dict[str, str]:
+    return {
+        "user": st.secrets["SNOWFLAKE_USER"],
+        "password": st.secrets["SNOWFLAKE_PASSWORD"],
+        "account": st.secrets["SNOWFLAKE_ACCOUNT"],
+        "warehouse": st.secrets["SNOWFLAKE_WAREHOUSE"],
+        "database": st.secrets["SNOWFLAKE_DATABASE"],
+        "schema": st.secrets["SNOWFLAKE_SCHEMA"],
+    }
+
+
+def create_chat_resources() -> ChatResources:
+    config = snowflake_secrets()
+    try:
+        session = Session.builder.configs(config).create()
+    except Exception as e:
+        st.error(f"Failed to create Snowpark session: {e}")
+        raise
+    root = Root(session)
+    svc = root.databases[config["database"]].schemas[config["schema"]].cortex_search_services[CORTEX_SEARCH_SERVICE]
+    return ChatResources(session=session, root=root, svc=svc)
+
+
+@st.cache_resource
+def get_chat_pool() -> ResourcePool:
+    """Process-wide pool shared by every browser session, created on first use and kept across reruns.
+
+    Streamlit serves each user session from its own thread; each borrower gets a
+    session to itself, so concurrent turns never interleave on one connection.
+    """
+    return ResourcePool(
+        create_chat_resources,
+        health_check=lambda resources: session_is_healthy(resources.session),
+        close=lambda resources: resources.session.close(),
+        max_size=8,
+    )
+
+
+def with_chat_resources(func: Callable[[ChatResources], T]) -> T:
+    """Run func against pooled resources, reconnecting once if the session expired underneath it."""
+    return get_chat_pool().call(func, retries=1)
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, Iterator, Optional
+
+DEFAULT_CHECKPOINT_PATH = os.getenv("CRAWL_CHECKPOINT_PATH", os.path.join(".cache", "crawl_checkpoint.json"))
+
+# Per-compound crawl states, in pipeline order
+FETCHED = "fetched"
+NO_DRUG_SECTION = "no_drug_section"
+CLASSIFIED = "classified"
+SKIPPED = "skipped"  # classified as 'None' / 'N/A', nothing to insert
+INSERTED = "inserted"
+FAILED = "failed"
+NOT_FOUND = "not_found"  # PubChem answered with a permanent 4xx, e.g. 404 for a CID that is not live
+
+# A resumed crawl does not revisit compounds in these states
+COMPLETED = {NO_DRUG_SECTION, SKIPPED, INSERTED, NOT_FOUND}
+
+
+class CrawlCheckpoint:
+    """Durable per-compound status manifest for resumable crawls.
+
+    Status changes are kept in memory and written out by flush(), which the
+    pipeline calls once per inserted batch. A flush appends only the IDs that
+    changed since the previous one, as one fsynced JSON line, to a journal next
+    to the manifest. Once the journal holds as many entries as the manifest has
+    IDs (and at least compact_after), it is compacted: the full manifest is
+    written to a temporary file, fsynced and atomically renamed over the old one,
+    and the journal is emptied. Loading reads the manifest and replays the
+    journal on top of it; a line torn by a crash mid-append is ignored.
+    """
+
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_PATH, resume: bool = True, compact_after: int = 10000):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.compact_after = compact_after
+        self._statuses: Dict[int, str] = {}
+        self._dirty: Dict[int, str] = {}
+        self._journal_entries = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # A fresh crawl must not replay an old journal, nor keep the old manifest once it writes
+        self._compact_pending = not resume
+        if resume:
+            self._load()
+
+    def _load(self) -> None:
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._statuses = {int(drug_id): status for drug_id, status in manifest.get("statuses", {}).items()}
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        changes = json.loads(line)
+                    except ValueError:
+                        # Torn by a crash; compact before appending after it
+                        self._compact_pending = True
+                        break
+                    self._statuses.update((int(drug_id), status) for drug_id, status in changes.items())
+                    self._journal_entries += len(changes)
+
+    def mark(self, drug_id: int, status: str) -> None:
+        with self._lock:
+            if self._statuses.get(drug_id) != status:
+                self._statuses[drug_id] = status
+                self._dirty[drug_id] = status
+
+    def status(self, drug_id: int) -> Optional[str]:
+        return self._statuses.get(drug_id)
+
+    def is_complete(self, drug_id: int) -> bool:
+        return self._statuses.get(drug_id) in COMPLETED
+
+    def pending(self, drug_ids: Iterable[int]) -> Iterator[int]:
+        """Yield the IDs that still need work: never seen, failed, or interrupted mid-pipeline."""
+        for drug_id in drug_ids:
+            if not self.is_complete(drug_id):
+                yield drug_id
+
+    def counts(self) -> Counter:
+        with self._lock:
+            return Counter(self._statuses.values())
+
+    def flush(self) -> None:
+        """Write the status changes since the last flush: a journal append, or a compaction when it is due."""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty and not self._compact_pending:
+                    return
+                changes = {str(drug_id): status for drug_id, status in self._dirty.items()}
+                self._dirty = {}
+                compact = self._compact_pending or (
+                    self._journal_entries + len(changes) >= max(self.compact_after, len(self._statuses))
+                )
+                if compact:
+                    manifest = {
+                        "version": 1,
+                        "updated_at": time.time(),
+                        "statuses": {str(drug_id): status for drug_id, status in self._statuses.items()},
+                    }
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            if compact:
+                self._compact(manifest)
+            else:
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(changes, separators=(",", ":")) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal_entries += len(changes)
+
+    def _compact(self, manifest: Dict) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # The manifest already holds every journalled change, so a crash before this point only replays them again
+        with open(self.journal_path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_entries = 0
+        self._compact_pending = False
@@ -0,0 +1,116 @@
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+# (start, end, token_count) of a piece of the text being split
+Piece = Tuple[int, int, int]
+
+
+class _Document:
+    """The text of one split_text() call and its token offsets; kept per call so calls can overlap."""
+
+    def __init__(self, text: str, offsets: List[Tuple[int, int]]):
+        self.text = text
+        self.starts = [start for start, _ in offsets]
+        self.ends = [end for _, end in offsets]
+
+
+class TokenChunker:
+    """Token-aware recursive text splitter that tokenizes each text only once.
+
+    Reproduces langchain's RecursiveCharacterTextSplitter with a token-count
+    length_function (keep_separator=True, strip_whitespace=True), but measures
+    pieces by counting tokens in the offset mapping of a single encode() call
+    instead of re-encoding every candidate piece. A piece whose edge cuts
+    through a token (e.g. a run of several spaces) is re-encoded on its own so
+    the counts stay identical to the per-piece encoding the splitter uses.
+    """
+
+    def __init__(self, tokenizer, chunk_size: int = 500, chunk_overlap: int = 50,
+                 separators: Optional[List[str]] = None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must not exceed chunk_size ({chunk_size}).")
+        self.tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or DEFAULT_SEPARATORS
+
+    def split_text(self, text: str) -> List[str]:
+        encoding = self.tokenizer(text, return_offsets_mapping=True, add_special_tokens=False)
+        doc = _Document(text, encoding["offset_mapping"])
+        return self._split(doc, 0, len(text), self.separators)
+
+    def _token_count(self, doc: _Document, start: int, end: int) -> int:
+        first = bisect_left(doc.starts, start)
+        last = bisect_left(doc.starts, end)
+        if (first > 0 and doc.ends[first - 1] > start) or (last > 0 and doc.ends[last - 1] > end):
+            return len(self.tokenizer.encode(doc.text[start:end]))
+        return last - first
+
+    def _piece_spans(self, doc: _Document, start: int, end: int, separator: str) -> List[Tuple[int, int]]:
+        if not separator:
+            return [(i, i + 1) for i in range(start, end)]
+        cuts = []
+        position = doc.text.find(separator, start, end)
+        while position != -1:
+            cuts.append(position)
+            position = doc.text.find(separator, position + len(separator), end)
+        bounds = [start] + cuts + [end]
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+    def _split(self, doc: _Document, start: int, end: int, separators: List[str]) -> List[str]:
+        final_chunks = []
+        separator = separators[-1]
+        new_separators = []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if doc.text.find(candidate, start, end) != -1:
+                separator = candidate
+                new_separators = separators[i + 1:]
+                break
+
+        good_pieces: List[Piece] = []
+        for a, b in self._piece_spans(doc, start, end, separator):
+            length = self._token_count(doc, a, b)
+            if length < self.chunk_size:
+                good_pieces.append((a, b, length))
+                continue
+            if good_pieces:
+                final_chunks.extend(self._merge(doc, good_pieces))
+                good_pieces = []
+            if not new_separators:
+                final_chunks.append(doc.text[a:b])
+            else:
+                final_chunks.extend(self._split(doc, a, b, new_separators))
+        if good_pieces:
+            final_chunks.extend(self._merge(doc, good_pieces))
+        return final_chunks
+
+    def _join(self, doc: _Document, pieces: List[Piece]) -> Optional[str]:
+        # Pieces at one level are contiguous, so joining them is a single slice
+        text = doc.text[pieces[0][0]:pieces[-1][1]].strip()
+        return text or None
+
+    def _merge(self, doc: _Document, pieces: List[Piece]) -> List[str]:
+        docs = []
+        current: List[Piece] = []
+        total = 0
+        for piece in pieces:
+            length = piece[2]
+            if total + length > self.chunk_size and current:
+                joined = self._join(doc, current)
+                if joined is not None:
+                    docs.append(joined)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= current[0][2]
+                    current = current[1:]
+            current.append(piece)
+            total += length
+        if current:
+            joined = self._join(doc, current)
+            if joined is not None:
+                docs.append(joined)
+        return docs
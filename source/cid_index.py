@@ -0,0 +1,337 @@
+"""Index of the compound IDs that carry drug information, built without downloading records.
+
+PubChem's PUG-View annotations endpoint lists, page by page, every annotation
+filed under a heading together with the CIDs it is linked to. Walking the
+subheadings of "Drug and Medication Information" yields the set of compounds
+whose record has that section, at a few hundred requests instead of one full
+record download per CID. The set is cached on disk and refreshed when stale.
+
+    python cid_index.py build
+    python cid_index.py build --record-dir fixtures/annotations   # also save raw pages
+    python cid_index.py build --fixtures fixtures/annotations     # rebuild offline from saved pages
+    python cid_index.py check --store .cache/pubchem               # compare with downloaded records
+
+SECTION_SUBHEADINGS is maintained by hand. `check` lists the stored records
+that have the section but are missing from the index, and the subheadings
+they file it under, so the list can be kept in step with PubChem.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import aiohttp
+
+from pubchem_downloader import PUBCHEM_REQUESTS_PER_SECOND, TokenBucket
+from pubchem_parser import DRUG_SECTION, TOC_HEADINGS
+from raw_store import DEFAULT_STORE_PATH, RawResponseStore
+
+ANNOTATIONS_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/annotations/heading/JSON"
+
+DEFAULT_INDEX_PATH = os.getenv("CID_INDEX_PATH", os.path.join(".cache", "cid_index.json"))
+
+# Annotations are filed under leaf headings, so a section is found through its subheadings.
+# Deliberately broad: a heading that does not exist (any more) just yields no CIDs.
+SECTION_SUBHEADINGS: Dict[str, List[str]] = {
+    DRUG_SECTION: [
+        "Drug Indication",
+        "Drug Classes",
+        "Therapeutic Uses",
+        "LiverTox Summary",
+        "FDA Approved Drugs",
+        "FDA Orange Book",
+        "FDA National Drug Code Directory",
+        "Drug Labels",
+        "Drug Labels for Ingredients",
+        "Drug Label Information",
+        "Label Information",
+        "Clinical Trials",
+        "Drug Warnings",
+        "Drug Idiosyncrasies",
+        "Drug Tolerance",
+        "Reported Fatal Dose",
+        "Maximum Drug Dose",
+        "Medication Ingredient",
+        "WHO Essential Medicines",
+        "Emergency Drug Information",
+        "Drug-Drug Interactions",
+        "Drug-Food Interactions",
+        "Veterinary Drug and Treatment",
+    ],
+}
+
+
+def index_headings(toc_headings: Iterable[str] = TOC_HEADINGS) -> List[str]:
+    """Annotation headings that identify records with the given sections.
+
+    Sections without an entry in SECTION_SUBHEADINGS ("Names and Identifiers")
+    are present on every compound and do not narrow the index.
+    """
+    headings = []
+    for section in toc_headings:
+        for heading in SECTION_SUBHEADINGS.get(section, []):
+            if heading not in headings:
+                headings.append(heading)
+    return headings
+
+
+def _fixture_name(heading: str, page: int) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", heading.lower()).strip("_")
+    return f"{slug}_page{page}.json"
+
+
+def linked_cids(page: Dict[str, Any]) -> Set[int]:
+    cids = set()
+    for annotation in page.get("Annotations", {}).get("Annotation", []):
+        cids.update(int(cid) for cid in annotation.get("LinkedRecords", {}).get("CID", []))
+    return cids
+
+
+def total_pages(page: Dict[str, Any]) -> int:
+    return int(page.get("Annotations", {}).get("TotalPages", 1))
+
+
+def record_subheadings(data: Dict[str, Any], section: str) -> List[str]:
+    """TOC headings filed under one top-level section of a PUG-View record; empty if it lacks the section."""
+    for top in data.get("Record", {}).get("Section", []):
+        if top.get("TOCHeading") == section:
+            return [sub.get("TOCHeading") for sub in top.get("Section", []) if sub.get("TOCHeading")]
+    return []
+
+
+class AnnotationFetcher:
+    """Fetch annotation pages from PubChem, staying under its request rate.
+
+    With record_dir set, every page is also written out in the layout
+    FixtureFetcher reads, so a live build can be replayed later.
+    """
+
+    def __init__(self, url: str = ANNOTATIONS_URL, requests_per_second: float = PUBCHEM_REQUESTS_PER_SECOND,
+                 max_retries: int = 3, base_delay: float = 2, timeout: float = 30, record_dir: Optional[str] = None):
+        self.url = url
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.timeout = timeout
+        self.record_dir = record_dir
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "AnnotationFetcher":
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __call__(self, heading: str, page: int) -> Optional[Dict[str, Any]]:
+        params = {"heading": heading, "heading_type": "Compound", "page": str(page)}
+        for attempt in range(self.max_retries):
+            await self.rate_limiter.acquire()
+            try:
+                async with self._session.get(self.url, params=params) as response:
+                    if response.status == 404:
+                        # PUGVIEW.NotFound: no annotations are filed under this heading
+                        return None
+                    response.raise_for_status()
+                    body = await response.read()
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                delay = self.base_delay * (attempt + 1)
+                if attempt < self.max_retries - 1:
+                    print(f"Attempt {attempt + 1} failed for heading '{heading}' page {page}: {e}. "
+                          f"Retrying in {delay} seconds...")
+                    await asyncio.sleep(delay)
+                else:
+                    raise
+        if self.record_dir:
+            os.makedirs(self.record_dir, exist_ok=True)
+            with open(os.path.join(self.record_dir, _fixture_name(heading, page)), "wb") as f:
+                f.write(body)
+        return json.loads(body)
+
+
+class FixtureFetcher:
+    """Serve annotation pages recorded by AnnotationFetcher(record_dir=...); a missing page reads as 404."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    async def __aenter__(self) -> "FixtureFetcher":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        pass
+
+    async def __call__(self, heading: str, page: int) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.directory, _fixture_name(heading, page))
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+class CidIndex:
+    """Sorted set of compound IDs known to have the indexed sections, persisted as JSON."""
+
+    def __init__(self, cids: Iterable[int], headings: List[str], built_at: Optional[float] = None):
+        self.cids = sorted(set(cids))
+        self._cid_set = set(self.cids)
+        self.headings = headings
+        self.built_at = built_at if built_at is not None else time.time()
+
+    def __len__(self) -> int:
+        return len(self.cids)
+
+    def __contains__(self, drug_id: int) -> bool:
+        return drug_id in self._cid_set
+
+    def count_between(self, start_id: int, end_id: int) -> int:
+        """Number of indexed IDs in [start_id, end_id]."""
+        return bisect.bisect_right(self.cids, end_id) - bisect.bisect_left(self.cids, start_id)
+
+    def filter(self, drug_ids: Iterable[int]) -> Iterator[int]:
+        """Keep only the IDs in the index, preserving their order."""
+        for drug_id in drug_ids:
+            if drug_id in self._cid_set:
+                yield drug_id
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "built_at": self.built_at, "headings": self.headings, "cids": self.cids},
+                      f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["CidIndex"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["cids"], data["headings"], data["built_at"])
+
+    @classmethod
+    async def build(cls, fetcher, headings: List[str], concurrency: int = 5) -> "CidIndex":
+        """Walk every page of every heading through fetcher(heading, page) -> page JSON or None."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(heading: str, page: int) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                return await fetcher(heading, page)
+
+        async def heading_cids(heading: str) -> Set[int]:
+            first = await fetch(heading, 1)
+            if first is None:
+                print(f"No annotations under heading '{heading}'.")
+                return set()
+            cids = linked_cids(first)
+            rest = await asyncio.gather(*(fetch(heading, page) for page in range(2, total_pages(first) + 1)))
+            for page in rest:
+                if page is not None:
+                    cids |= linked_cids(page)
+            print(f"Heading '{heading}': {total_pages(first)} pages, {len(cids)} compounds.")
+            return cids
+
+        cids: Set[int] = set()
+        async with fetcher:
+            for found in await asyncio.gather(*(heading_cids(heading) for heading in headings)):
+                cids |= found
+        return cls(cids, headings)
+
+    @classmethod
+    def load_or_build(cls, path: str = DEFAULT_INDEX_PATH, toc_headings: Iterable[str] = TOC_HEADINGS,
+                      fetcher=None, max_age: Optional[float] = 30 * 24 * 3600, refresh: bool = False,
+                      offline: bool = False) -> Optional["CidIndex"]:
+        """Return the cached index unless it is missing, stale or built for other headings.
+
+        offline=True never goes to the network: the cached index is used whatever
+        its age, and None is returned when there is none for these headings.
+        """
+        headings = index_headings(toc_headings)
+        if offline:
+            index = cls.load(path)
+            if index is None or index.headings != headings:
+                return None
+            return index
+        index = None if refresh else cls.load(path)
+        if index is not None and index.headings == headings and (
+                max_age is None or time.time() - index.built_at < max_age):
+            return index
+
+        index = asyncio.run(cls.build(fetcher or AnnotationFetcher(), headings))
+        index.save(path)
+        return index
+
+
+def check_against_store(index: CidIndex, store: RawResponseStore,
+                        sections: Iterable[str] = (DRUG_SECTION,)) -> Dict[str, Any]:
+    """Compare the index with the records in the raw store.
+
+    missed lists the stored CIDs that have one of the sections but are not in the
+    index; unlisted_subheadings counts, over those records, the subheadings that
+    SECTION_SUBHEADINGS does not know about (the likely reason they were missed).
+    """
+    listed = {heading for section in sections for heading in SECTION_SUBHEADINGS.get(section, [])}
+    missed: List[int] = []
+    unlisted: Counter = Counter()
+    with_section = 0
+    for drug_id in store.drug_ids():
+        body = store.load_bytes(drug_id)
+        if body is None:
+            continue
+        try:
+            data = json.loads(body)
+        except ValueError:
+            continue
+        subheadings = [heading for section in sections for heading in record_subheadings(data, section)]
+        if not subheadings:
+            continue
+        with_section += 1
+        if drug_id not in index:
+            missed.append(drug_id)
+            unlisted.update(heading for heading in subheadings if heading not in listed)
+    return {"with_section": with_section, "missed": missed, "unlisted_subheadings": dict(unlisted.most_common())}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "show", "check"])
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="path of the cached index")
+    parser.add_argument("--record-dir", help="also save every fetched page here, as fixtures")
+    parser.add_argument("--fixtures", help="build from recorded pages instead of PubChem")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="raw PubChem response store to check against")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        fetcher = FixtureFetcher(args.fixtures) if args.fixtures else AnnotationFetcher(record_dir=args.record_dir)
+        index = CidIndex.load_or_build(args.index, fetcher=fetcher, refresh=True)
+    else:
+        index = CidIndex.load(args.index)
+        if index is None:
+            parser.error(f"No index at {args.index}; run 'build' first.")
+        if args.command == "check":
+            store = RawResponseStore(args.store)
+            try:
+                report = check_against_store(index, store)
+            finally:
+                store.close()
+            print(f"{report['with_section']} stored records have drug information; "
+                  f"{len(report['missed'])} of them are missing from the index.")
+            if report["missed"]:
+                print(f"Missing CIDs: {report['missed'][:50]}{' ...' if len(report['missed']) > 50 else ''}")
+            for heading, count in report["unlisted_subheadings"].items():
+                print(f"  subheading not in SECTION_SUBHEADINGS: '{heading}' ({count} records)")
+    print(f"{len(index)} compounds with drug information "
+          f"(built {time.strftime('%Y-%m-%d %H:%M', time.localtime(index.built_at))}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from ttl_cache import TTLCache
+
+DEFAULT_CACHE_PATH = os.getenv("CLASSIFICATION_CACHE_PATH", os.path.join(".cache", "classifications.sqlite"))
+
+# LLM answers that mean the call itself went wrong; these are retried rather than cached.
+UNCACHEABLE_CATEGORIES = {"Unknown", "Category not found"}
+
+
+def normalize_medicine_name(medicine_name: str) -> str:
+    return " ".join(medicine_name.lower().split())
+
+
+class ClassificationCache:
+    """Persistent cache of medicine -> category answers.
+
+    Entries are keyed on the normalized medicine name, the model and the prompt
+    version, so changing either of the latter naturally invalidates old answers.
+    Lookups go through an in-memory LRU tier first and fall back to SQLite.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        prompt_version: str,
+        path: str = DEFAULT_CACHE_PATH,
+        ttl_seconds: Optional[float] = 90 * 24 * 3600,
+        max_entries: int = 200_000,
+        memory_entries: int = 10_000,
+    ):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory = TTLCache(max_entries=memory_entries, ttl_seconds=ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS classifications (
+                cache_key TEXT PRIMARY KEY,
+                medicine TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                category TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS classifications_accessed ON classifications (accessed_at)")
+        self._db.commit()
+
+    def cache_key(self, medicine_name: str) -> str:
+        raw = f"{self.model}\x1f{self.prompt_version}\x1f{normalize_medicine_name(medicine_name)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, medicine_name: str) -> Optional[str]:
+        key = self.cache_key(medicine_name)
+        category = self.memory.get(key)
+        if category is not None:
+            with self._lock:
+                self.hits += 1
+            return category
+
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT category, created_at FROM classifications WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl_seconds is not None and row[1] + self.ttl_seconds < now:
+                self._db.execute("DELETE FROM classifications WHERE cache_key = ?", (key,))
+                self._db.commit()
+                row = None
+            if row:
+                self._db.execute("UPDATE classifications SET accessed_at = ? WHERE cache_key = ?", (now, key))
+                self._db.commit()
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if row is None:
+            return None
+        self.memory.set(key, row[0])
+        return row[0]
+
+    def put(self, medicine_name: str, category: str) -> None:
+        if category in UNCACHEABLE_CATEGORIES:
+            return
+        key = self.cache_key(medicine_name)
+        now = time.time()
+        self.memory.set(key, category)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_medicine_name(medicine_name), self.model, self.prompt_version, category, now, now),
+            )
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._evict()
+            self._db.commit()
+
+    def get_or_classify(self, medicine_name: str, classify: Callable[[str], str]) -> str:
+        """Return the cached category, calling classify(medicine_name) only on a miss."""
+        category = self.get(medicine_name)
+        if category is None:
+            category = classify(medicine_name)
+            self.put(medicine_name, category)
+        return category
+
+    def get_or_classify_many(self, medicine_names: List[str],
+                             classify_many: Callable[[List[str]], Dict[str, str]]) -> Dict[str, str]:
+        """Resolve many names at once, sending only the distinct cache misses to classify_many.
+
+        Spellings that normalize to the same name share one cache key, so only the
+        first of them is sent; its answer is returned for every spelling.
+        """
+        categories = {}
+        misses: Dict[str, List[str]] = {}  # normalized name -> spellings, the first one is classified
+        for name in medicine_names:
+            if name in categories:
+                continue
+            spellings = misses.get(normalize_medicine_name(name))
+            if spellings is not None:
+                if name not in spellings:
+                    spellings.append(name)
+                continue
+            category = self.get(name)
+            if category is None:
+                misses[normalize_medicine_name(name)] = [name]
+            else:
+                categories[name] = category
+
+        if misses:
+            classified = classify_many([spellings[0] for spellings in misses.values()])
+            for spellings in misses.values():
+                category = classified.get(spellings[0], "Unknown")
+                self.put(spellings[0], category)
+                for name in spellings:
+                    categories[name] = category
+        return categories
+
+    def _evict(self) -> None:
+        (count,) = self._db.execute("SELECT COUNT(*) FROM classifications").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM classifications WHERE cache_key IN "
+                "(SELECT cache_key FROM classifications ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory": self.memory.stats(),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
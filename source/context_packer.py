@@ -0,0 +1,152 @@
+"""Assemble the CONTEXT and CHAT HISTORY parts of the answer prompt within a token budget.
+
+The search response used to go into the prompt as raw JSON, punctuation,
+repeated keys and all, and neighbouring chunks of a record repeat the 50-token
+overlap the splitter leaves between them. The packer merges overlapping and
+duplicate chunk text, groups what is left by record, renders it as plain text
+and cuts context and history to the budget of the selected model, counting
+with the same tokenizer as ingestion.
+"""
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from token_counter import count_tokens, truncate_tokens
+
+# Tokens for CONTEXT + CHAT HISTORY per model; the instructions, question and answer need the rest of the window
+CONTEXT_TOKEN_BUDGETS = {
+    "mixtral-8x7b": 6000,
+    "snowflake-arctic": 2500,
+    "mistral-large2": 8000,
+    "mistral-7b": 4000,
+    "mistral-large": 6000,
+}
+DEFAULT_CONTEXT_TOKEN_BUDGET = 3000
+# History never takes more than this share of the budget; context gets the remainder
+HISTORY_SHARE = 0.3
+# Shorter common stretches between chunks are a coincidence, not the splitter's overlap
+MIN_OVERLAP_CHARS = 40
+
+
+@dataclass
+class PackedContext:
+    context: str
+    history: str
+    context_tokens: int
+    history_tokens: int
+    budget: int
+    chunks_in: int = 0
+    chunks_merged: int = 0  # duplicates and overlapping neighbours folded into another chunk
+    chunks_dropped: int = 0  # did not fit in the budget, fully or in part
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "budget": self.budget,
+            "context_tokens": self.context_tokens,
+            "history_tokens": self.history_tokens,
+            "chunks_in": self.chunks_in,
+            "chunks_merged": self.chunks_merged,
+            "chunks_dropped": self.chunks_dropped,
+        }
+
+
+def token_budget(model_name: str) -> int:
+    return CONTEXT_TOKEN_BUDGETS.get(model_name, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of left that is a prefix of right, if at least MIN_OVERLAP_CHARS."""
+    start = max(0, len(left) - len(right))
+    while True:
+        # Candidate overlaps begin where right's first MIN_OVERLAP_CHARS characters occur in left
+        position = left.find(right[:MIN_OVERLAP_CHARS], start)
+        if position == -1:
+            return 0
+        if right.startswith(left[position:]):
+            return len(left) - position
+        start = position + 1
+
+
+def merge_texts(texts: List[str]) -> Tuple[List[str], int]:
+    """Fold duplicate, contained and overlapping texts together; returns (texts, number folded away)."""
+    merged: List[str] = []
+    folded = 0
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        for i, kept in enumerate(merged):
+            if text in kept:
+                break
+            if kept in text:
+                merged[i] = text
+                break
+            if len(text) >= MIN_OVERLAP_CHARS and len(kept) >= MIN_OVERLAP_CHARS:
+                overlap = _overlap(kept, text)
+                if overlap:
+                    merged[i] = kept + text[overlap:]
+                    break
+                overlap = _overlap(text, kept)
+                if overlap:
+                    merged[i] = text + kept[overlap:]
+                    break
+        else:
+            merged.append(text)
+            continue
+        folded += 1
+    return merged, folded
+
+
+def parse_results(context: str) -> Optional[List[Dict[str, Any]]]:
+    """The results list of a search response, or None when context is not one (e.g. the no-results message)."""
+    try:
+        results = json.loads(context).get("results")
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return results if isinstance(results, list) else None
+
+
+def pack_context(context: str, history: str, budget: int, history_share: float = HISTORY_SHARE) -> PackedContext:
+    """Deduplicated, grouped context and the newest part of history, together within budget tokens."""
+    history = truncate_tokens(history, int(budget * history_share), keep_end=True)
+    history_tokens = count_tokens(history)
+    remaining = budget - history_tokens
+
+    results = parse_results(context)
+    if results is None:
+        text = truncate_tokens(context, remaining)
+        return PackedContext(text, history, count_tokens(text), history_tokens, budget)
+
+    # Group by record in order of first appearance, i.e. of relevance
+    groups: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        title = result.get("record_title") or "Unknown"
+        group = groups.setdefault(title, {"category": result.get("category"), "texts": []})
+        group["texts"].append(result.get("chunk") or "")
+
+    packed = PackedContext("", history, 0, history_tokens, budget, chunks_in=len(results))
+    sections = []
+    for title, group in groups.items():
+        texts, folded = merge_texts(group["texts"])
+        packed.chunks_merged += folded
+        header = f"## {title}" + (f" ({group['category']})" if group["category"] else "")
+        remaining -= count_tokens(header) + 1
+        if remaining <= 0:
+            packed.chunks_dropped += len(texts)
+            continue
+        kept = [header]
+        for text in texts:
+            tokens = count_tokens(text) + 1
+            if tokens > remaining:
+                text = truncate_tokens(text, remaining - 1)
+                packed.chunks_dropped += 1
+                if not text:
+                    continue
+                tokens = remaining
+            kept.append(text)
+            remaining -= tokens
+        if len(kept) > 1:
+            sections.append("\n".join(kept))
+    packed.context = "\n\n".join(sections)
+    packed.context_tokens = count_tokens(packed.context)
+    return packed
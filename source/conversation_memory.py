@@ -0,0 +1,207 @@
+"""Incremental conversation memory for the chatbot.
+
+Instead of sending the last few raw messages to the LLM on every turn to
+rewrite the question, the memory keeps a rolling summary of everything older
+plus the exchanges not yet folded into it. A question that reads as
+self-contained is searched as is, without any LLM call. Otherwise a single
+COMPLETE both folds the pending exchanges into the summary and rewrites the
+question as a standalone query. History is capped by tokens, not messages.
+"""
+import json
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+from token_counter import count_tokens
+
+# Words that only make sense with earlier turns in view
+_REFERRING = re.compile(
+    r"\b(it|its|it's|they|them|their|theirs|this|that|these|those|he|she|his|her|him|same|above|previous|"
+    r"former|latter|one|ones|also|too|else|instead|another|other|more)\b",
+    re.IGNORECASE,
+)
+_FOLLOW_UP_START = re.compile(r"^\s*(and|but|so|then|or|what about|how about)\b", re.IGNORECASE)
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+REWRITE_PROMPT = """
+You keep a running summary of a conversation between a user and a drug information assistant.
+
+<summary>
+{summary}
+</summary>
+<new_messages>
+{messages}
+</new_messages>
+<question>
+{question}
+</question>
+
+1. Update the summary with the new messages. Keep the drugs, conditions and facts that were
+   discussed, in at most {summary_words} words.
+2. Rewrite the question as a standalone search query in natural language, resolving any
+   reference to earlier messages.
+
+Answer with only a JSON object: {{"summary": "...", "query": "..."}}
+"""
+
+
+def is_self_contained(question: str) -> bool:
+    """Cheap local check: True when the question does not lean on earlier turns."""
+    words = re.findall(r"[\w'-]+", question)
+    if len(words) < 3:
+        return False
+    return not (_FOLLOW_UP_START.search(question) or _REFERRING.search(question))
+
+
+def format_messages(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+
+
+def parse_rewrite(text: str) -> Optional[Dict[str, str]]:
+    match = _JSON_OBJECT.search(text or "")
+    if match is None:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("query"), str):
+        return None
+    return data
+
+
+class ConversationMemory:
+    """Rolling summary + pending exchanges, kept in st.session_state for one chat."""
+
+    def __init__(self, history_token_budget: int = 1500, pending_token_budget: int = 1500,
+                 summary_words: int = 150):
+        self.history_token_budget = history_token_budget
+        self.pending_token_budget = pending_token_budget
+        self.summary_words = summary_words
+        self.summary = ""
+        self.messages: List[Dict[str, str]] = []
+        self._folded = 0  # messages before this index are covered by the summary
+        self.llm_calls = 0
+        self.skipped_calls = 0
+        # A rewrite may finish on a retrieval worker thread after its turn timed out
+        self._lock = threading.Lock()
+
+    def add_exchange(self, question: str, answer: str) -> None:
+        with self._lock:
+            self.messages.append({"role": "user", "content": question})
+            self.messages.append({"role": "assistant", "content": answer})
+
+    @property
+    def pending(self) -> List[Dict[str, str]]:
+        return self.messages[self._folded:]
+
+    def _tail(self, messages: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+        """The newest messages that fit in budget tokens, in conversation order."""
+        kept, used = [], 0
+        for message in reversed(messages):
+            tokens = count_tokens(message["content"])
+            if kept and used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        return kept[::-1]
+
+    def _head(self, messages: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+        """The oldest messages that fit in budget tokens; at least one, so a fold always makes progress."""
+        kept, used = [], 0
+        for message in messages:
+            tokens = count_tokens(message["content"])
+            if kept and used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        return kept
+
+    def needs_rewrite(self, question: str) -> bool:
+        with self._lock:
+            if not self.summary and not self.messages:
+                return False
+            pending_tokens = sum(count_tokens(message["content"]) for message in self.pending)
+        if pending_tokens > self.pending_token_budget:
+            # Fold now, while the pending exchanges still fit in one call
+            return True
+        if is_self_contained(question):
+            self.skipped_calls += 1
+            return False
+        return True
+
+    def rewrite(self, question: str, complete: Callable[[str], str]) -> str:
+        """Fold the pending exchanges into the summary and return a standalone query, usually in one LLM call.
+
+        Pending exchanges beyond pending_token_budget are folded first, oldest first, one
+        budget's worth per call; only messages that were actually sent are marked folded.
+        """
+        with self._lock:
+            summary = self.summary
+            start = self._folded
+            pending = self.messages[start:]
+        while len(self._head(pending, self.pending_token_budget)) < len(pending):
+            batch = self._head(pending, self.pending_token_budget)
+            rewrite = self._fold(summary, batch, question, start, complete)
+            if rewrite is None:
+                break
+            summary = self.summary
+            start += len(batch)
+            pending = pending[len(batch):]
+
+        batch = self._head(pending, self.pending_token_budget)
+        answer = complete(self._prompt(summary, batch, question))
+        self.llm_calls += 1
+        rewrite = parse_rewrite(answer)
+        if rewrite is None:
+            # Not JSON: use the text as the query and keep the exchanges pending for the next fold
+            return (answer or "").strip() or question
+        self._update_summary(rewrite, start + len(batch))
+        return rewrite["query"].strip() or question
+
+    def _prompt(self, summary: str, messages: List[Dict[str, str]], question: str) -> str:
+        return REWRITE_PROMPT.format(
+            summary=summary or "(empty)",
+            messages=format_messages(messages) or "(none)",
+            question=question,
+            summary_words=self.summary_words,
+        )
+
+    def _fold(self, summary: str, messages: List[Dict[str, str]], question: str, start: int,
+              complete: Callable[[str], str]) -> Optional[Dict[str, str]]:
+        """Fold one batch of older messages into the summary; None if the answer could not be used."""
+        self.llm_calls += 1
+        rewrite = parse_rewrite(complete(self._prompt(summary, messages, question)))
+        if rewrite is None or not self._update_summary(rewrite, start + len(messages)):
+            return None
+        return rewrite
+
+    def _update_summary(self, rewrite: Dict[str, str], folded_to: int) -> bool:
+        if not isinstance(rewrite.get("summary"), str) or not rewrite["summary"].strip():
+            return False
+        with self._lock:
+            self.summary = rewrite["summary"].strip()
+            self._folded = max(self._folded, folded_to)
+        return True
+
+    def history(self) -> str:
+        """Summary plus the newest raw messages, within history_token_budget tokens."""
+        with self._lock:
+            parts = []
+            budget = self.history_token_budget
+            if self.summary:
+                parts.append(f"Summary of the earlier conversation: {self.summary}")
+                budget -= count_tokens(self.summary)
+            recent = self._tail(self.messages, max(budget, 0)) if budget > 0 else []
+            if recent:
+                parts.append(format_messages(recent))
+            return "\n".join(parts)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "summary": self.summary,
+            "messages": len(self.messages),
+            "pending": len(self.pending),
+            "llm_calls": self.llm_calls,
+            "skipped_calls": self.skipped_calls,
+        }
@@ -0,0 +1,103 @@
+"""Completion clients for the chatbot: streamed over the Cortex REST API or blocking over SQL.
+
+SELECT SNOWFLAKE.CORTEX.COMPLETE(...) returns only once the whole answer is
+generated. The REST endpoint /api/v2/cortex/inference:complete can stream it
+instead as server-sent events, one delta per event, so the first words can be
+shown while the rest is still being generated.
+"""
+import json
+from typing import Callable, Dict, Iterator, Optional
+
+import requests
+
+COMPLETE_PATH = "/api/v2/cortex/inference:complete"
+
+
+class CompletionClient:
+    """Interface of a completion backend: stream() yields pieces of the answer as they arrive."""
+
+    def stream(self, model: str, prompt: str) -> Iterator[str]:
+        raise NotImplementedError
+
+    def complete(self, model: str, prompt: str) -> str:
+        return "".join(self.stream(model, prompt))
+
+
+def parse_sse_content(lines: Iterator[str]) -> Iterator[str]:
+    """Yield the text deltas of a Cortex completion event stream."""
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        for choice in event.get("choices", []):
+            delta = choice.get("delta") or {}
+            text = delta.get("content") or delta.get("text") or ""
+            if text:
+                yield text
+
+
+class CortexRestClient(CompletionClient):
+    """Streams completions from the Cortex REST API over server-sent events."""
+
+    def __init__(self, base_url: str, authorization: str, token_type: Optional[str] = None,
+                 timeout: float = 120, http: Optional[requests.Session] = None):
+        self.url = base_url.rstrip("/") + COMPLETE_PATH
+        self.headers: Dict[str, str] = {
+            "Authorization": authorization,
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+        }
+        if token_type:
+            self.headers["X-Snowflake-Authorization-Token-Type"] = token_type
+        self.timeout = timeout
+        self.http = http or requests.Session()
+
+    @classmethod
+    def from_session(cls, session, **kwargs) -> "CortexRestClient":
+        """Authenticate with the token of an open Snowpark session, no extra credentials needed."""
+        connection = session.connection
+        return cls(f"https://{connection.host}", f'Snowflake Token="{connection.rest.token}"', **kwargs)
+
+    def stream(self, model: str, prompt: str) -> Iterator[str]:
+        body = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": True}
+        with self.http.post(self.url, json=body, headers=self.headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            yield from parse_sse_content(response.iter_lines(chunk_size=None, decode_unicode=True))
+
+
+class SqlCompletionClient(CompletionClient):
+    """Blocking SNOWFLAKE.CORTEX.COMPLETE through SQL; the whole answer arrives as one piece."""
+
+    def __init__(self, run_sql: Callable[[str, list], list]):
+        # run_sql(sql, params) -> rows, e.g. executed on a pooled Snowpark session
+        self.run_sql = run_sql
+
+    def stream(self, model: str, prompt: str) -> Iterator[str]:
+        rows = self.run_sql("SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?) AS response", [model, prompt])
+        yield rows[0].RESPONSE
+
+
+class FallbackCompletionClient(CompletionClient):
+    """Use primary, switching to fallback if primary fails before producing any text."""
+
+    def __init__(self, primary: CompletionClient, fallback: CompletionClient):
+        self.primary = primary
+        self.fallback = fallback
+
+    def stream(self, model: str, prompt: str) -> Iterator[str]:
+        started = False
+        try:
+            for text in self.primary.stream(model, prompt):
+                started = True
+                yield text
+        except Exception as e:
+            if started:
+                raise
+            print(f"Streaming completion failed, falling back: {e}")
+            yield from self.fallback.stream(model, prompt)
@@ -1,265 +1,404 @@
+import argparse
+import asyncio
 import time
-import requests
-import os
 import pdb
-import concurrent.futures
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
 
-from drug_classifier import connect_to_snowflake, classify_medicine
+from drug_classifier import classify_medicines, CLASSIFIER_MODEL, PROMPT_VERSION
+from classification_cache import ClassificationCache, UNCACHEABLE_CATEGORIES
+from pubchem_downloader import PubChemDownloader, RecordNotFound, PUBCHEM_BASE_URL, PUBCHEM_REQUESTS_PER_SECOND
+from metrics import REGISTRY
+from pipeline import Pipeline, Stage, format_stats
+from raw_store import DEFAULT_STORE_PATH, RawResponseStore
+from loaders import ChunkLoader, content_hash
+from checkpoint import (
+    CrawlCheckpoint, DEFAULT_CHECKPOINT_PATH, CLASSIFIED, FAILED, FETCHED, INSERTED, NO_DRUG_SECTION, NOT_FOUND,
+    SKIPPED,
+)
+from snowflake_pool import get_connection_pool, get_session_pool
+from category_catalog import CREATE_CATEGORY_SUMMARY_SQL, refresh_category_summary
+from drug_name_index import CREATE_DRUG_SYNONYMS_SQL, replace_synonyms
+from cid_index import CidIndex, DEFAULT_INDEX_PATH
+from shard_coordinator import ShardCoordinator, SnowflakeLeaseStore, SQLiteLeaseStore
+from chunker import TokenChunker
+from pubchem_parser import TOC_HEADINGS, DrugDetails, chunk_drug, parse_drug
+from preprocess_worker import init_worker, preprocess_record
 
 from transformers import GPT2TokenizerFast
 
-from dataclasses import dataclass
 from dotenv import load_dotenv
-from snowflake.connector import connect
 from snowflake.connector.errors import ProgrammingError
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 
 load_dotenv()
 
-@dataclass
-class DrugDetails:
-    record_title: str
-    details: Dict[str, str]
-
 class DataCollection:
-    def __init__(self):
-        self.connection = self.connect_to_snowflake()
-        self.session = requests.Session()  # Reuse HTTP connection
-        self.toc_heading = ["Names and Identifiers", "Drug and Medication Information"]
+    def __init__(self, pubchem_url: str = PUBCHEM_BASE_URL, requests_per_second: float = PUBCHEM_REQUESTS_PER_SECOND,
+                 store_path: Optional[str] = DEFAULT_STORE_PATH, replay: bool = False,
+                 checkpoint_path: str = DEFAULT_CHECKPOINT_PATH, preprocess_workers: int = 0,
+                 cid_index_path: Optional[str] = None, streaming: bool = False):
+        self.connection_pool = get_connection_pool()
+        self.session_pool = get_session_pool()
+        # Raw responses are kept on disk so re-processing runs can replay them without PubChem
+        self.raw_store = RawResponseStore(store_path) if store_path else None
+        self.downloader = PubChemDownloader(
+            base_url=pubchem_url,
+            requests_per_second=requests_per_second,
+            store=self.raw_store,
+            offline=replay,
+        )
+        self.batch_size = 100
+        self.loader = ChunkLoader()
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint: Optional[CrawlCheckpoint] = None
+        # Opt-in: only compounds listed in the index are downloaded; None crawls every ID in the range
+        self.cid_index_path = cid_index_path
+        self.cid_index: Optional[CidIndex] = None
+        self.classification_cache = ClassificationCache(CLASSIFIER_MODEL, PROMPT_VERSION)
+        self.toc_heading = TOC_HEADINGS
         self.create_table()
         self.tokenizer = GPT2TokenizerFast.from_pretrained("gpt2")
+        self.chunker = TokenChunker(self.tokenizer, chunk_size=500, chunk_overlap=50)
+        # Streaming parses records while they download and never builds the full JSON tree
+        self.streaming = streaming
+        if streaming and preprocess_workers > 0:
+            raise ValueError("Streaming parsing and worker processes are alternative parse paths; pick one.")
+        # With workers, parsing and chunking run in separate processes that each load their own tokenizer
+        self.preprocess_workers = preprocess_workers
+        self.preprocess_pool: Optional[ProcessPoolExecutor] = None
+        if preprocess_workers > 0:
+            self.preprocess_pool = ProcessPoolExecutor(
+                max_workers=preprocess_workers,
+                initializer=init_worker,
+                initargs=("gpt2", 500, 50, self.toc_heading),
+            )
 
-
-    def token_length(self, text):
-        return len(self.tokenizer.encode(text))
-
-    def connect_to_snowflake(self):
-        """Establish a connection to Snowflake with retry logic."""
-        max_retries = 3
-        retry_delay = 5  
-
-        for attempt in range(max_retries):
+    def create_table(self):
+        """Create the drug_data table if it doesn't exist."""
+        with self.connection_pool.acquire() as connection:
+            cursor = connection.cursor()
             try:
-                conn = connect(
-                    user=os.getenv('SNOWFLAKE_USER'),
-                    password=os.getenv('SNOWFLAKE_PASSWORD'),
-                    account=os.getenv('SNOWFLAKE_ACCOUNT'),
-                    warehouse=os.getenv('SNOWFLAKE_WAREHOUSE'),
-                    database=os.getenv('SNOWFLAKE_DATABASE'),
-                    schema=os.getenv('SNOWFLAKE_SCHEMA')
+                create_table_sql = """
+                CREATE TABLE IF NOT EXISTS drug_data (
+                    id NUMBER AUTOINCREMENT,
+                    record_title VARCHAR(500),
+                    heading VARCHAR(100),
+                    chunk VARCHAR(16777216),
+                    category VARCHAR(100),
+                    content_hash VARCHAR(64),
+                    created_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
+                    PRIMARY KEY (id)
                 )
-                print("Connected to Snowflake successfully.")
-                return conn
+                """
+                cursor.execute(create_table_sql)
+                # Tables created before chunks were content-hashed
+                cursor.execute("ALTER TABLE drug_data ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
+                cursor.execute(CREATE_CATEGORY_SUMMARY_SQL)
+                cursor.execute(CREATE_DRUG_SYNONYMS_SQL)
+                print("Table creation verified.")
+            except ProgrammingError as e:
+                print(f"Error creating table: {e}")
+                raise
+            finally:
+                cursor.close()
+
+    def bulk_insert_into_snowflake(self, chunked_details: List[List[Dict[str, Any]]]) -> bool:
+        """Bulk upsert chunked details into Snowflake, skipping chunks that are already stored unchanged."""
+        values = []
+        for detail in chunked_details:
+            for mapp in detail:
+                if isinstance(mapp, dict):
+                    record_title = mapp.get('title')  # Use actual record title if available
+                    heading = mapp.get('heading')
+                    chunk = mapp.get('chunk')
+                    category = mapp.get('category')
+
+                    if heading and chunk and record_title and category:
+                        values.append((record_title, heading, chunk, category,
+                                       content_hash(record_title, heading, chunk)))
+
+        with self.connection_pool.acquire() as connection:
+            try:
+                method = self.loader.upsert(connection, values)
+                connection.commit()
+                print(f"Upserted {len(values)} records into Snowflake ({method}).")
+                return True
             except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"Connection attempt {attempt + 1} failed: {e}. Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                else:
-                    raise Exception(f"Failed to connect to Snowflake after {max_retries} attempts: {e}")
-
-    def create_table(self):
-        """Create the drug_data table if it doesn't exist."""
-        cursor = self.connection.cursor()
-        try:
-            create_table_sql = """
-            CREATE TABLE IF NOT EXISTS drug_data (
-                id NUMBER AUTOINCREMENT,
-                record_title VARCHAR(500),
-                heading VARCHAR(100),
-                chunk VARCHAR(16777216),
-                category VARCHAR(100),
-                created_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(),
-                PRIMARY KEY (id)
-            )
-            """
-            cursor.execute(create_table_sql)
-            print("Table creation verified.")
-        except ProgrammingError as e:
-            print(f"Error creating table: {e}")
-            raise
-        finally:
-            cursor.close()
-
-    def bulk_insert_into_snowflake(self, chunked_details: List[Dict[str, Any]]) -> None:
-        print(f"chunked_details: {chunked_details}")
+                print(f"Failed to insert data into Snowflake: {e}")
+                connection.rollback()
+                return False
 
-        """Bulk insert chunked details into Snowflake."""
-        if not self.connection:
-            raise ConnectionError("Snowflake connection not established.")
-
-        cursor = self.connection.cursor()
-        try:
-            values = []
-            for detail in chunked_details:
-                for mapp in detail:
-                    if isinstance(mapp, dict):
-                        record_title = mapp.get('title')  # Use actual record title if available
-                        heading = mapp.get('heading')
-                        chunk = mapp.get('chunk')
-                        category = mapp.get('category')
-
-                        if heading and chunk and record_title and category:
-                            values.append((record_title, heading, chunk, category))
-
-            # Insert the data into Snowflake
-            sql = """
-            INSERT INTO drug_data (record_title, heading, chunk, category)
-            VALUES (%s, %s, %s, %s)
-            """
-            cursor.executemany(sql, values)
-            self.connection.commit()
-            print(f"Bulk inserted {len(values)} records into Snowflake.")
-        except Exception as e:
-            print(f"Failed to insert data into Snowflake: {e}")
-            self.connection.rollback()
-        finally:
-            cursor.close()
 
+    def store_synonyms(self, drugs: List[DrugDetails]) -> None:
+        """Replace the stored synonyms of these drugs; the chatbot matches drug names in questions against them."""
+        with self.connection_pool.acquire() as connection:
+            try:
+                replace_synonyms(connection, {drug.record_title: drug.synonyms for drug in drugs})
+                connection.commit()
+            except Exception as e:
+                print(f"Failed to store drug synonyms: {e}")
+                connection.rollback()
 
-    def drug_download(self, drug_id: int) -> Optional[Dict[str, Any]]:
-        """Fetch drug information from the PubChem API with retry logic."""
-        max_retries = 3
-        base_delay = 2  # seconds
-
-        for attempt in range(max_retries):
+    def update_category_summary(self) -> None:
+        """Refresh the per-category chunk counts the chatbot sidebar reads."""
+        with self.connection_pool.acquire() as connection:
             try:
-                url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound/{drug_id}/JSON/"
-                response = self.session.get(url, timeout=10)
-                response.raise_for_status()
-                return response.json()
-            except requests.exceptions.RequestException as e:
-                delay = base_delay * (attempt + 1)
-                if attempt < max_retries - 1:
-                    print(f"Attempt {attempt + 1} failed for drug ID {drug_id}: {e}. Retrying in {delay} seconds...")
-                    time.sleep(delay)
-                else:
-                    print(f"Failed to fetch drug ID {drug_id} after {max_retries} attempts: {e}")
-                    return None
-            except ValueError as e:
-                print(f"Invalid JSON response for drug ID {drug_id}: {e}")
-                return None
-
-    def data_preprocessing(self, data: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
-        """Process raw API data into structured format and apply chunking."""
-        if 'Record' not in data:
-            return None
+                refresh_category_summary(connection)
+                print("Category summary refreshed.")
+            except Exception as e:
+                print(f"Failed to refresh category summary: {e}")
 
-        record = data['Record']
-        record_title = record.get('RecordTitle', "Unknown Title")
+    async def drug_download(self, drug_id: int) -> Optional[Dict[str, Any]]:
+        """Fetch drug information from the PubChem API with retry logic; raises RecordNotFound for dead CIDs."""
+        return await self.downloader.fetch(drug_id)
 
-        if record_title == "Unknown Title":
-            return None
-        
-        sections = record.get('Section', [])
-        details = {}
-
-        for section in sections:
-            heading = section.get("TOCHeading")
-            if heading in self.toc_heading:
-                extracted_info = self._extract_information(section)
-                if extracted_info:
-                    details[heading] = [record_title, extracted_info]
-        
-        if "Drug and Medication Information" in details:
-            # Apply chunking to the details text here
-            #pdb.set_trace()
-            chunked_details = self.apply_chunking(details)
-            return chunked_details
-        return None
+    def data_preprocessing(self, data: Dict[str, Any]) -> Optional[DrugDetails]:
+        """Process raw API data into structured format."""
+        return parse_drug(data, self.toc_heading)
     
-    def apply_chunking(self, details: Dict[str, str]) -> List[Dict[str, Any]]:
+    def apply_chunking(self, drug: DrugDetails) -> DrugDetails:
         """Apply chunking to the extracted details."""
-        chunked_data = []
-        session = connect_to_snowflake()
-        for heading, text in details.items():
-            # Apply the text_chunker (chunking function)
-            chunks = self.split_text(text[1])  
+        return chunk_drug(drug, self.split_text)
+
+    def _classify_uncached(self, medicine_names: List[str]) -> Dict[str, str]:
+        with self.session_pool.acquire() as session:
+            return classify_medicines(session, medicine_names)
 
-            category = classify_medicine(session, text[0])
+    def classify_drugs(self, drugs: List[DrugDetails]) -> List[DrugDetails]:
+        """Classify a batch of drugs in one Cortex call and tag every chunk with its category."""
+        categories = self.classification_cache.get_or_classify_many(
+            [drug.record_title for drug in drugs], self._classify_uncached
+        )
+        classified = []
+        for drug in drugs:
+            category = categories[drug.record_title]
+            if category in UNCACHEABLE_CATEGORIES:
+                # The model skipped it; leave it pending (FETCHED) so a resumed run classifies it again
+                print(f"No category for drug ID {drug.drug_id} ({drug.record_title}); leaving it for a later run.")
+                continue
             if category == 'None' or category == 'N/A':
+                self.checkpoint.mark(drug.drug_id, SKIPPED)
                 continue
-            else:
-                for chunk in chunks:
-                    chunked_data.append({
-                        "title": text[0],
-                        "heading": heading,
-                        "chunk": chunk,
-                        "category": category
-                    })
-
-        session.close()
-        return chunked_data
-    
+            drug.category = category
+            for chunk in drug.chunks:
+                chunk["category"] = category
+            self.checkpoint.mark(drug.drug_id, CLASSIFIED)
+            classified.append(drug)
+        return classified
+
     def split_text(self, text: str) -> List[str]:
-        """Split text using the Langchain chunking logic."""
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500, 
-            chunk_overlap=50,
-            length_function=self.token_length,
-            is_separator_regex=False
-        )
-        chunks = text_splitter.split_text(text)
-        return chunks
-
-    def _extract_information(self, section: Dict[str, Any]) -> str:
-        """Extract and clean information from section."""
-        details_list = []
-        for sub_section in section.get('Section', []):
-            for info in sub_section.get('Information', []):
-                if "Value" in info and "StringWithMarkup" in info["Value"]:
-                    for detail in info["Value"]["StringWithMarkup"]:
-                        text = detail.get('String', '').strip()
-                        if text:
-                            details_list.append(text)
-        return " ".join(details_list)
-
-    def start_process(self, drug_id_start: int, drug_id_limit: int) -> None:
-        """Process drug IDs in batches with progress tracking."""
-        start_time = time.perf_counter()
-        drug_ids = range(drug_id_start, drug_id_limit + 1)
-        
-        batch_size = 100
-        batches = [drug_ids[i:i + batch_size] for i in range(0, len(drug_ids), batch_size)]
-        total_batches = len(batches)
+        """Split text into 500-token chunks with 50-token overlap, tokenizing it once."""
+        return self.chunker.split_text(text)
 
+    async def _download_stage(self, drug_id: int) -> Optional[Tuple[int, Any]]:
+        if self.streaming:
+            return await self._stream_stage(drug_id)
         try:
-            for batch_num, batch in enumerate(batches, start=1):
-                print(f"\nProcessing batch {batch_num}/{total_batches}...")
-                processed_drugs = []
-
-                with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                    future_to_id = {executor.submit(self.drug_download, drug_id): drug_id for drug_id in batch}
-                    
-                    for future in concurrent.futures.as_completed(future_to_id):
-                        drug_id = future_to_id[future]
-                        try:
-                            drug_data = future.result()
-                            if drug_data:
-                                drug_details = self.data_preprocessing(drug_data)
-                                if drug_details:
-                                    processed_drugs.append(drug_details)
-                        except Exception as e:
-                            print(f"Error processing drug ID {drug_id}: {e}")
-
-                if processed_drugs:
-                    self.bulk_insert_into_snowflake(processed_drugs)
-
-                if batch_num < total_batches:
-                    print(f"Batch {batch_num} completed. Pausing for 5 sec...")
-                    time.sleep(5)
+            if self.preprocess_pool is not None:
+                # Workers decode the JSON themselves; shipping the raw body avoids pickling the parsed tree
+                data = await self.downloader.fetch_bytes(drug_id)
+            else:
+                data = await self.drug_download(drug_id)
+        except RecordNotFound:
+            self.checkpoint.mark(drug_id, NOT_FOUND)
+            return None
+        if not data:
+            self.checkpoint.mark(drug_id, FAILED)
+            return None
+        self.checkpoint.mark(drug_id, FETCHED)
+        return drug_id, data
 
+    async def _stream_stage(self, drug_id: int) -> Optional[DrugDetails]:
+        try:
+            fetched, drug = await self.downloader.fetch_streamed(drug_id, self.toc_heading)
+        except RecordNotFound:
+            self.checkpoint.mark(drug_id, NOT_FOUND)
+            return None
+        if not fetched:
+            self.checkpoint.mark(drug_id, FAILED)
+            return None
+        self.checkpoint.mark(drug_id, FETCHED)
+        if drug is None:
+            self.checkpoint.mark(drug_id, NO_DRUG_SECTION)
+            return None
+        drug.drug_id = drug_id
+        return drug
+
+    def _parse_stage(self, item: Tuple[int, Dict[str, Any]]) -> Optional[DrugDetails]:
+        drug_id, data = item
+        drug = self.data_preprocessing(data)
+        if drug is None:
+            self.checkpoint.mark(drug_id, NO_DRUG_SECTION)
+            return None
+        drug.drug_id = drug_id
+        return drug
+
+    async def _preprocess_stage(self, item: Tuple[int, bytes]) -> Optional[DrugDetails]:
+        loop = asyncio.get_running_loop()
+        try:
+            drug_id, drug = await loop.run_in_executor(self.preprocess_pool, preprocess_record, item)
+        except ValueError as e:
+            print(f"Invalid JSON response for drug ID {item[0]}: {e}")
+            self.checkpoint.mark(item[0], FAILED)
+            return None
+        if drug is None:
+            self.checkpoint.mark(drug_id, NO_DRUG_SECTION)
+        return drug
+
+    def insert_batch(self, drugs: List[DrugDetails]) -> None:
+        if self.bulk_insert_into_snowflake([drug.chunks for drug in drugs]):
+            self.store_synonyms(drugs)
+            for drug in drugs:
+                self.checkpoint.mark(drug.drug_id, INSERTED)
+        # Terminal states from the earlier stages are persisted here too, once per batch
+        self.checkpoint.flush()
+
+    def build_pipeline(self) -> Pipeline:
+        """Wire the ingestion stages together; each stage gets its own concurrency."""
+        if self.streaming:
+            # Records come out of the download stage already parsed
+            preprocess = [Stage("chunk", self.apply_chunking, concurrency=2)]
+        elif self.preprocess_pool is not None:
+            # Two records in flight per worker keep every process busy while results are pickled back
+            preprocess = [Stage("preprocess", self._preprocess_stage, concurrency=self.preprocess_workers * 2)]
+        else:
+            preprocess = [
+                Stage("parse", self._parse_stage, concurrency=2),
+                Stage("chunk", self.apply_chunking, concurrency=2),
+            ]
+        return Pipeline([
+            Stage("download", self._download_stage, concurrency=self.downloader.max_in_flight),
+            *preprocess,
+            Stage("classify", self.classify_drugs, concurrency=2, batch_size=50, batch_timeout=10, flatten=True),
+            Stage("insert", self.insert_batch, batch_size=self.batch_size),
+        ], queue_size=self.batch_size)
+
+    async def _run_pipeline(self, drug_ids: Iterable[int]):
+        async with self.downloader:
+            return await self.build_pipeline().run(drug_ids)
+
+    def _wanted(self, drug_ids: Iterable[int]) -> Iterable[int]:
+        return self.cid_index.filter(drug_ids) if self.cid_index is not None else drug_ids
+
+    def _all_done(self, drug_ids: Iterable[int]) -> bool:
+        """True when the checkpoint has every wanted ID in a terminal state (none failed or left mid-pipeline).
+
+        CIDs PubChem answers with a permanent 4xx are NOT_FOUND, which is terminal, so they do not hold a shard back.
+        """
+        return next(self.checkpoint.pending(self._wanted(drug_ids)), None) is None
+
+    def _process_ids(self, drug_ids: range) -> None:
+        if self.cid_index is not None:
+            excluded = len(drug_ids) - self.cid_index.count_between(drug_ids.start, drug_ids.stop - 1)
+            REGISTRY.inc("cid_index_excluded_total", excluded)
+            print(f"CID index: {excluded} of {len(drug_ids)} IDs in {drug_ids.start}-{drug_ids.stop - 1} "
+                  f"have no indexed drug annotation and are not downloaded.")
+        stats = asyncio.run(self._run_pipeline(self.checkpoint.pending(self._wanted(drug_ids))))
+        print(format_stats(stats))
+        print(f"Classification cache: {self.classification_cache.stats()}")
+
+    def _process_shards(self, coordinator: ShardCoordinator) -> None:
+        """Claim shards until none is left, heartbeating each lease while its IDs go through the pipeline."""
+        while True:
+            shard = coordinator.claim()
+            if shard is None:
+                break
+            print(f"Worker {coordinator.worker_id} claimed shard {shard.shard_id} "
+                  f"({shard.start_id}-{shard.end_id}, attempt {shard.attempts}).")
+            with coordinator.hold(shard, finished=lambda: self._all_done(shard.drug_ids())):
+                self._process_ids(shard.drug_ids())
+        print(f"Shards: {coordinator.counts()}")
+
+    def start_process(self, drug_id_start: int, drug_id_limit: int, resume: bool = False,
+                      coordinator: Optional[ShardCoordinator] = None, shard_size: int = 1000,
+                      refresh_index: bool = False, metrics_path: Optional[str] = None) -> None:
+        """Stream drug IDs through the download/parse/chunk/classify/insert pipeline.
+
+        With resume=True, compounds the checkpoint already finished are skipped and
+        only new, failed or interrupted ones are processed again. When the crawl was
+        created with an index path, IDs missing from the drug CID index (built on
+        first use; a replay only uses a cached one) are counted and never downloaded;
+        `python cid_index.py check` compares the index with the stored records. With a coordinator,
+        the range is registered as shards in its lease table and this worker processes
+        whichever shards it manages to claim, so any number of workers can share a range.
+        Per-stage latency histograms are written to metrics_path at the end, as JSON
+        lines for a .jsonl path and Prometheus text otherwise.
+        """
+        start_time = time.perf_counter()
+        self.checkpoint = CrawlCheckpoint(self.checkpoint_path, resume=resume)
+
+        try:
+            if self.cid_index_path:
+                # A replay stays off the network, so it never builds or refreshes the index
+                self.cid_index = CidIndex.load_or_build(self.cid_index_path, self.toc_heading, refresh=refresh_index,
+                                                        offline=self.downloader.offline)
+                if self.cid_index is None:
+                    print("No cached CID index to replay with; every stored ID in the range is processed.")
+                else:
+                    print(f"CID index: {len(self.cid_index)} compounds with drug information.")
+            if coordinator is None:
+                self._process_ids(range(drug_id_start, drug_id_limit + 1))
+            else:
+                coordinator.create_shards(drug_id_start, drug_id_limit, shard_size)
+                self._process_shards(coordinator)
+            self.update_category_summary()
         except KeyboardInterrupt:
             print("\nProcess interrupted by user. Cleaning up...")
         finally:
-            self.connection.close()
-            self.session.close()
+            self.checkpoint.flush()
+            print(f"Checkpoint: {dict(self.checkpoint.counts())}")
+            if coordinator is not None:
+                coordinator.close()
+            self.connection_pool.close()
+            self.session_pool.close()
+            self.classification_cache.close()
+            if self.preprocess_pool is not None:
+                self.preprocess_pool.shutdown()
+            if self.raw_store is not None:
+                self.raw_store.close()
             end_time = time.perf_counter()
+            REGISTRY.observe("ingest_run_seconds", end_time - start_time)
+            if metrics_path:
+                REGISTRY.dump(metrics_path)
+                print(f"Metrics written to {metrics_path}.")
             print(f"\nTotal execution time: {end_time - start_time:.2f} seconds")
 
 
 if __name__ == "__main__":
-    obj = DataCollection()
-    obj.start_process(drug_id_start=501, drug_id_limit=10000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Crawl PubChem drug records into Snowflake.")
+    parser.add_argument("--start", type=int, default=501, help="first PubChem compound ID")
+    parser.add_argument("--limit", type=int, default=10000, help="last PubChem compound ID (inclusive)")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="directory of the raw PubChem response store")
+    parser.add_argument("--replay", action="store_true", help="feed records from the raw store only, without network")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH, help="path of the crawl checkpoint manifest")
+    parser.add_argument("--resume", action="store_true", help="skip compounds the checkpoint marks as done")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="parse and chunk in this many worker processes (0 keeps it in-process)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="parse records incrementally while they download, keeping only the wanted sections")
+    parser.add_argument("--index", nargs="?", const=DEFAULT_INDEX_PATH,
+                        help="download only IDs in the drug CID index cached at this path "
+                             f"(default {DEFAULT_INDEX_PATH}, built on first use); without it every ID is crawled")
+    parser.add_argument("--refresh-index", action="store_true", help="rebuild the CID index before crawling")
+    parser.add_argument("--coordinator",
+                        help="share the range with other workers through a lease table: "
+                             "'snowflake' for the warehouse, or the path of a local SQLite file")
+    parser.add_argument("--worker-id", help="name of this worker in the lease table (default: host-pid)")
+    parser.add_argument("--shard-size", type=int, default=1000, help="compound IDs per shard")
+    parser.add_argument("--lease-seconds", type=float, default=300, help="lease length, renewed by heartbeats")
+    parser.add_argument("--metrics", help="write stage latency metrics here: .jsonl for JSON lines, else Prometheus")
+    args = parser.parse_args()
+
+    obj = DataCollection(store_path=args.store, replay=args.replay, checkpoint_path=args.checkpoint,
+                         preprocess_workers=args.workers, cid_index_path=args.index,
+                         streaming=args.streaming)
+    coordinator = None
+    if args.coordinator:
+        store = (SnowflakeLeaseStore(obj.connection_pool) if args.coordinator == "snowflake"
+                 else SQLiteLeaseStore(args.coordinator))
+        coordinator = ShardCoordinator(store, worker_id=args.worker_id, lease_seconds=args.lease_seconds)
+    obj.start_process(drug_id_start=args.start, drug_id_limit=args.limit, resume=args.resume,
+                      coordinator=coordinator, shard_size=args.shard_size, refresh_index=args.refresh_index,
+                      metrics_path=args.metrics)
@@ -1,23 +1,19 @@
 import json
-import os
 import pdb
 import re
-from snowflake.snowpark import Session
+from typing import Dict, List
 from dotenv import load_dotenv
+from snowflake_pool import create_session
 
 load_dotenv()
 
+CLASSIFIER_MODEL = 'mistral-large2'
+# Bump whenever the classification prompts change so cached answers are not reused.
+PROMPT_VERSION = "2"
+
 def connect_to_snowflake():
-    connection_params = {
-        "account": os.getenv("SNOWFLAKE_ACCOUNT"),
-        "user": os.getenv("SNOWFLAKE_USER"),
-        "password": os.getenv("SNOWFLAKE_PASSWORD"),
-        "warehouse": os.getenv("SNOWFLAKE_WAREHOUSE"),
-        "database": os.getenv("SNOWFLAKE_DATABASE"),
-        "schema": os.getenv("SNOWFLAKE_SCHEMA"),
-    }
-    session = Session.builder.configs(connection_params).create()
-    return session
+    """Open a standalone Snowpark session; prefer snowflake_pool.get_session_pool() for repeated calls."""
+    return create_session()
 
 import re
 
@@ -96,7 +92,7 @@ Medicine:
 
     query = session.sql(f"""
         SELECT TRIM(SNOWFLAKE.CORTEX.COMPLETE(
-            'mistral-large2',
+            '{CLASSIFIER_MODEL}',
             $${prompt} {medicine_name}$$
         ), '\\n') AS category
     """)
@@ -115,3 +111,84 @@ Medicine:
     else:
         return "Unknown"
 
+
+
+CATEGORIES = [
+    "Analgesic", "Antibiotic", "Antihistamine", "Antipyretic", "Antiseptic", "Antidepressant",
+    "Anticonvulsant", "Antifungal", "Anesthetic", "Antiviral", "Anticancer", "Antidiabetic",
+    "Antihypertensive", "Antiplatelet", "Anticoagulant", "Antiemetic", "Anxiolytic", "Mood stabilizer",
+    "Immunosuppressant", "Steroid", "Vasodilator", "Neuroprotective", "Cognitive Enhancer", "Nootropic",
+    "Mood Regulator", "Cholinergic", "Nutritional Supplements", "Dermatology", "Antimicrobial",
+    "Expectorant", "Anti-inflammatory", "Diuretic", "Beta-blocker", "Probiotic", "Chemotherapy",
+    "Growth Hormone", "Blood Thinner", "Other",
+]
+
+# Cortex output grows with the batch, keep each call well inside the completion limit.
+MAX_BATCH_SIZE = 50
+
+BATCH_PROMPT = """
+You are a medical classification assistant. For each numbered chemical compound or drug below, pick the one category from this list that best describes its primary use and activity. If unsure, use 'Other'.
+
+Categories: {categories}
+
+Return only a JSON object mapping each number to its category, for example {{"1": "Analgesic", "2": "Other"}}.
+
+Medicines:
+{medicines}
+"""
+
+_CANONICAL_CATEGORIES = {category.lower(): category for category in CATEGORIES}
+
+
+def normalize_category(category: str) -> str:
+    """Map the model's spelling of a category onto the canonical name when it is one we know."""
+    category = category.strip().strip("'\"").strip()
+    return _CANONICAL_CATEGORIES.get(category.lower(), category)
+
+
+def extract_categories(input_string: str) -> Dict[int, str]:
+    """Parse a {"<number>": "<category>"} answer, tolerating code fences and chatter around the JSON."""
+    categories = {}
+    start, end = input_string.find("{"), input_string.rfind("}")
+    if start != -1 and end > start:
+        try:
+            parsed = json.loads(input_string[start:end + 1])
+            if isinstance(parsed, dict):
+                for key, value in parsed.items():
+                    if isinstance(value, dict):
+                        value = value.get("category")
+                    if str(key).strip().isdigit() and isinstance(value, str) and value.strip():
+                        categories[int(key)] = normalize_category(value)
+        except json.JSONDecodeError:
+            pass
+
+    if not categories:
+        # Truncated or otherwise malformed JSON: salvage every complete "n": "category" pair
+        for key, value in re.findall(r'"?(\d+)"?\s*:\s*"([^"]+)"', input_string):
+            categories[int(key)] = normalize_category(value)
+    return categories
+
+
+def classify_medicines(session, medicine_names: List[str]) -> Dict[str, str]:
+    """
+    Classifies several medicine names with a single Cortex COMPLETE call.
+    Returns a name -> category map; names the model skipped are left out.
+    """
+    results = {}
+    for start in range(0, len(medicine_names), MAX_BATCH_SIZE):
+        batch = medicine_names[start:start + MAX_BATCH_SIZE]
+        prompt = BATCH_PROMPT.format(
+            categories=", ".join(CATEGORIES),
+            medicines="\n".join(f"{number}. {name}" for number, name in enumerate(batch, start=1)),
+        )
+        result = session.sql(
+            "SELECT TRIM(SNOWFLAKE.CORTEX.COMPLETE(?, ?), '\\n') AS categories",
+            params=[CLASSIFIER_MODEL, prompt],
+        ).collect()
+        if not result:
+            continue
+
+        for number, category in extract_categories(result[0]["CATEGORIES"]).items():
+            if 1 <= number <= len(batch):
+                results[batch[number - 1]] = category
+    return results
@@ -0,0 +1,247 @@
+"""Exact drug-name lookup ahead of vector search.
+
+Most questions name one specific medicine. DrugNameIndex holds every record
+title in drug_data plus the synonyms captured at ingestion (drug_synonyms) in
+an Aho-Corasick automaton, so all names in a question are found in one pass
+over it, whatever the number of names. When a question names a known drug,
+NameMatchRetriever returns that drug's chunks by key, ranked against the rest
+of the question, and the semantic search is skipped; otherwise, or when the
+category filter excludes the drug, it defers to the wrapped retriever.
+"""
+import json
+import re
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from metrics import span
+from pubchem_parser import DRUG_SECTION
+from retrievers import Retriever
+from ttl_cache import TTLCache
+
+DRUG_SYNONYMS_TABLE = "drug_synonyms"
+
+CREATE_DRUG_SYNONYMS_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {DRUG_SYNONYMS_TABLE} (
+        record_title VARCHAR(500),
+        synonym VARCHAR(500)
+    )
+"""
+
+_LOAD_NAMES_SQL = f"""
+    SELECT DISTINCT record_title, record_title AS name FROM drug_data
+    UNION
+    SELECT s.record_title, s.synonym FROM {DRUG_SYNONYMS_TABLE} s
+    JOIN (SELECT DISTINCT record_title FROM drug_data) d ON d.record_title = s.record_title
+"""
+
+CHUNKS_BY_TITLE_SQL = "SELECT record_title, heading, chunk, category FROM drug_data WHERE record_title = ? ORDER BY id"
+
+_WORD = re.compile(r"[\w'-]+")
+_STOPWORDS = {
+    "a", "about", "an", "and", "are", "can", "do", "does", "for", "how", "i", "in", "is", "it", "me", "of", "on",
+    "or", "tell", "the", "to", "what", "when", "which", "who", "why", "with", "you",
+}
+
+
+def normalize_name(text: str) -> str:
+    """Lower-case with runs of anything but letters and digits turned into one space."""
+    return " ".join(re.findall(r"[^\W_]+", text.casefold()))
+
+
+def replace_synonyms(connection, synonyms: Dict[str, List[str]]) -> None:
+    """Store the synonyms of the given record titles, replacing what was there for them."""
+    if not synonyms:
+        return
+    titles = list(synonyms)
+    rows = [(title, synonym) for title, names in synonyms.items() for synonym in names]
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            f"DELETE FROM {DRUG_SYNONYMS_TABLE} WHERE record_title IN ({', '.join(['%s'] * len(titles))})", titles
+        )
+        if rows:
+            cursor.executemany(f"INSERT INTO {DRUG_SYNONYMS_TABLE} (record_title, synonym) VALUES (%s, %s)", rows)
+    finally:
+        cursor.close()
+
+
+def load_drug_names(session) -> List[Tuple[str, str]]:
+    """(record_title, name) for every drug in drug_data; titles only if drug_synonyms is missing."""
+    try:
+        rows = session.sql(_LOAD_NAMES_SQL).collect()
+    except Exception as e:
+        print(f"Drug synonyms unavailable, matching record titles only: {e}")
+        rows = session.sql("SELECT DISTINCT record_title, record_title AS name FROM drug_data").collect()
+    return [(row.RECORD_TITLE, row.NAME) for row in rows]
+
+
+def chunks_by_title(session, record_title: str) -> List[Dict[str, Any]]:
+    """The drug_data rows of one record, as dicts keyed like the search results."""
+    rows = session.sql(CHUNKS_BY_TITLE_SQL, params=[record_title]).collect()
+    return [{name.lower(): value for name, value in row.as_dict().items()} for row in rows]
+
+
+class DrugNameIndex:
+    """Aho-Corasick automaton over normalized drug names, matching whole words only."""
+
+    def __init__(self, names: Iterable[Tuple[str, str]], min_length: int = 3):
+        # Node i: outgoing transitions, failure link, and (name length, titles) when a name ends there
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, Tuple[str, ...]]]] = [[]]
+        titles_by_name: Dict[str, List[str]] = {}
+        for record_title, name in names:
+            key = normalize_name(name or "")
+            if len(key) < min_length:
+                continue
+            titles = titles_by_name.setdefault(key, [])
+            if record_title not in titles:
+                titles.append(record_title)
+        for key, titles in titles_by_name.items():
+            self._add(key, tuple(titles))
+        self._link()
+        self.names = len(titles_by_name)
+        self.titles = len({title for titles in titles_by_name.values() for title in titles})
+
+    def _add(self, key: str, titles: Tuple[str, ...]) -> None:
+        node = 0
+        for char in key:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((len(key), titles))
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                # Names that end at the failure node end here too
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text: str) -> List[Tuple[int, int, Tuple[str, ...]]]:
+        """(start, end, titles) of every whole-word name occurrence in the normalized text."""
+        text = normalize_name(text)
+        matches = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, titles in self._output[node]:
+                start, end = i + 1 - length, i + 1
+                if (start == 0 or text[start - 1] == " ") and (end == len(text) or text[end] == " "):
+                    matches.append((start, end, titles))
+        return matches
+
+    def match(self, text: str) -> Tuple[List[str], List[str]]:
+        """(record titles, matched names) for the longest non-overlapping names, in order of appearance."""
+        normalized = normalize_name(text)
+        chosen: List[Tuple[int, int, Tuple[str, ...]]] = []
+        # Longest first, so "vitamin b12" wins over "vitamin"
+        for start, end, titles in sorted(self.find(text), key=lambda m: (m[0] - m[1], m[0])):
+            if all(end <= s or start >= e for s, e, _ in chosen):
+                chosen.append((start, end, titles))
+        chosen.sort()
+        titles: List[str] = []
+        for _, _, match_titles in chosen:
+            titles.extend(title for title in match_titles if title not in titles)
+        return titles, [normalized[start:end] for start, end, _ in chosen]
+
+    def __len__(self) -> int:
+        return self.names
+
+
+def rank_chunks(chunks: List[Dict[str, Any]], question: str, matched_names: Iterable[str]) -> List[Dict[str, Any]]:
+    """Order one drug's chunks by how many of the question's other words they contain; drug section first on ties."""
+    name_words = {word for name in matched_names for word in name.split()}
+    terms = {word for word in _WORD.findall(question.casefold())
+             if word not in _STOPWORDS and word not in name_words and len(word) > 2}
+
+    def score(item: Tuple[int, Dict[str, Any]]) -> Tuple[int, int, int]:
+        position, chunk = item
+        text = (chunk.get("chunk") or "").casefold()
+        return (-sum(term in text for term in terms), chunk.get("heading") != DRUG_SECTION, position)
+
+    return [chunk for _, chunk in sorted(enumerate(chunks), key=score)]
+
+
+class NameMatchRetriever(Retriever):
+    """Chunks of the drugs named in the question, by key; the wrapped retriever for everything else.
+
+    chunks_for(record_title) returns that drug's drug_data rows as dicts; its
+    results are cached for chunk_ttl_seconds. With several drugs named, their
+    ranked chunks are interleaved so each one is represented.
+    """
+
+    def __init__(self, index: DrugNameIndex, chunks_for: Callable[[str], List[Dict[str, Any]]],
+                 fallback: Retriever, max_drugs: int = 3, chunk_ttl_seconds: Optional[float] = 3600):
+        self.index = index
+        self._chunks_for = chunks_for
+        self.fallback = fallback
+        self.max_drugs = max_drugs
+        self._chunks = TTLCache(max_entries=1024, ttl_seconds=chunk_ttl_seconds)
+        self.name_hits = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def _drug_chunks(self, record_title: str) -> List[Dict[str, Any]]:
+        chunks = self._chunks.get(record_title)
+        if chunks is None:
+            with span("chunk_lookup"):
+                chunks = self._chunks_for(record_title)
+            self._chunks.set(record_title, chunks)
+        return chunks
+
+    def _count(self, name_hit: bool) -> None:
+        with self._lock:
+            if name_hit:
+                self.name_hits += 1
+            else:
+                self.fallbacks += 1
+
+    def search(self, query: str, columns: List[str], limit: int, category: Optional[str] = None) -> str:
+        with span("name_match"):
+            titles, names = self.index.match(query)
+        if not titles or len(titles) > self.max_drugs:
+            # No name, or a name shared by too many records to be an exact answer
+            self._count(False)
+            return self.fallback.search(query, columns, limit, category)
+
+        ranked = []
+        for title in titles:
+            chunks = [chunk for chunk in self._drug_chunks(title)
+                      if category is None or chunk.get("category") == category]
+            if chunks:
+                ranked.append(rank_chunks(chunks, query, names))
+        if not ranked:
+            self._count(False)
+            return self.fallback.search(query, columns, limit, category)
+
+        results: List[Dict[str, Any]] = []
+        for position in range(max(len(chunks) for chunks in ranked)):
+            for chunks in ranked:
+                if position < len(chunks) and len(results) < limit:
+                    results.append({column: chunks[position].get(column) for column in columns})
+        self._count(True)
+        return json.dumps({"results": results})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "names": len(self.index),
+            "drugs": self.index.titles,
+            "name_hits": self.name_hits,
+            "fallbacks": self.fallbacks,
+            "chunk_cache": self._chunks.stats(),
+        }
@@ -1,23 +1,18 @@
-import snowflake.connector
-import os
-from dotenv import load_dotenv
+from snowflake_pool import get_connection_pool
 
-load_dotenv()
+CORTEX_SEARCH_SERVICE = "drug_data_search_service"
 
-SNOWFLAKE_USER = os.getenv('SNOWFLAKE_USER')
-SNOWFLAKE_PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
-SNOWFLAKE_ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
-SNOWFLAKE_DATABASE = os.getenv('SNOWFLAKE_DATABASE')
-SNOWFLAKE_SCHEMA = os.getenv('SNOWFLAKE_SCHEMA')
-WAREHOUSE = os.getenv("SNOWFLAKE_WAREHOUSE")  
+# How stale the search index may get; cached search results live no longer than this
+SEARCH_TARGET_LAG = "1 day"
+SEARCH_TARGET_LAG_SECONDS = 24 * 60 * 60
 
 # SQL command to create Cortex Search Service
-CREATE_CORTEX_SERVICE_SQL = """
-CREATE OR REPLACE CORTEX SEARCH SERVICE drug_data_search_service
+CREATE_CORTEX_SERVICE_SQL = f"""
+CREATE OR REPLACE CORTEX SEARCH SERVICE {CORTEX_SEARCH_SERVICE}
   ON chunk
   ATTRIBUTES category
   WAREHOUSE = COMPUTE_WH
-  TARGET_LAG = '1 day'
+  TARGET_LAG = '{SEARCH_TARGET_LAG}'
   EMBEDDING_MODEL = 'snowflake-arctic-embed-l-v2.0'
   AS (
     SELECT
@@ -30,29 +25,19 @@ CREATE OR REPLACE CORTEX SEARCH SERVICE drug_data_search_service
 
 """
 
-def connect_to_snowflake():
-    return snowflake.connector.connect(
-        user=SNOWFLAKE_USER,
-        password=SNOWFLAKE_PASSWORD,
-        account=SNOWFLAKE_ACCOUNT,
-        warehouse=WAREHOUSE,
-        database=SNOWFLAKE_DATABASE,
-        schema=SNOWFLAKE_SCHEMA,
-    )
-
 def create_cortex_service():
     try:
-        conn = connect_to_snowflake()
-        cursor = conn.cursor()
-        print("Connected to Snowflake.")
-        print("Creating Cortex Search Service...")
-        cursor.execute(CREATE_CORTEX_SERVICE_SQL)
-        print("Cortex Search Service created successfully.")
+        with get_connection_pool().acquire() as conn:
+            cursor = conn.cursor()
+            try:
+                print("Connected to Snowflake.")
+                print("Creating Cortex Search Service...")
+                cursor.execute(CREATE_CORTEX_SERVICE_SQL)
+                print("Cortex Search Service created successfully.")
+            finally:
+                cursor.close()
     except Exception as e:
         print(f"Error: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
 if __name__ == "__main__":
     create_cortex_service()
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from typing import List, Tuple
+
+import pandas as pd
+
+# (record_title, heading, chunk, category, content_hash)
+ChunkRow = Tuple[str, str, str, str, str]
+
+COLUMNS = ["record_title", "heading", "chunk", "category", "content_hash"]
+
+INCOMING_TABLE = "drug_data_incoming"
+
+
+def content_hash(record_title: str, heading: str, chunk: str) -> str:
+    """Identity of a chunk: re-crawling unchanged text yields the same hash."""
+    return hashlib.sha256("\x1f".join((record_title, heading, chunk)).encode("utf-8")).hexdigest()
+
+
+# Drop rows of the (record_title, heading) sections being reloaded whose text is no longer produced
+_DELETE_STALE_SQL = f"""
+    DELETE FROM {{table}}
+    WHERE EXISTS (
+        SELECT 1 FROM {INCOMING_TABLE} i
+        WHERE i.record_title = {{table}}.record_title AND i.heading = {{table}}.heading
+    )
+    AND ({{table}}.content_hash IS NULL
+         OR {{table}}.content_hash NOT IN (SELECT content_hash FROM {INCOMING_TABLE}))
+"""
+
+
+class SnowflakeTarget:
+    """Stages Parquet files in the user stage and merges them into drug_data."""
+
+    placeholder = "%s"
+
+    def __init__(self, table: str = "drug_data"):
+        self.table = table
+
+    def create_incoming(self, cursor) -> None:
+        cursor.execute(f"""
+            CREATE OR REPLACE TEMPORARY TABLE {INCOMING_TABLE} (
+                record_title VARCHAR(500),
+                heading VARCHAR(100),
+                chunk VARCHAR(16777216),
+                category VARCHAR(100),
+                content_hash VARCHAR(64)
+            )
+        """)
+
+    def copy_parquet(self, cursor, path: str, table: str) -> None:
+        file_name = os.path.basename(path)
+        stage = "@~/drug_data_ingest"
+        cursor.execute(f"PUT 'file://{path}' {stage} AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+        select_list = ", ".join(f"$1:{column}::VARCHAR" for column in COLUMNS)
+        cursor.execute(f"""
+            COPY INTO {table} ({", ".join(COLUMNS)})
+            FROM (SELECT {select_list} FROM {stage})
+            FILES = ('{file_name}')
+            FILE_FORMAT = (TYPE = PARQUET)
+            PURGE = TRUE
+        """)
+
+    def begin(self, cursor) -> None:
+        cursor.execute("BEGIN")
+
+    def merge_incoming(self, cursor) -> None:
+        cursor.execute(_DELETE_STALE_SQL.format(table=self.table))
+        cursor.execute(f"""
+            MERGE INTO {self.table} d
+            USING {INCOMING_TABLE} i
+            ON d.content_hash = i.content_hash
+            WHEN MATCHED AND d.category IS DISTINCT FROM i.category THEN
+                UPDATE SET category = i.category
+            WHEN NOT MATCHED THEN
+                INSERT ({", ".join(COLUMNS)})
+                VALUES ({", ".join(f"i.{column}" for column in COLUMNS)})
+        """)
+
+
+class DuckDBTarget:
+    """Local stand-in for Snowflake so the loaders can be benchmarked offline."""
+
+    placeholder = "?"
+
+    def __init__(self, table: str = "drug_data"):
+        self.table = table
+
+    def create_incoming(self, cursor) -> None:
+        # DuckDB cursors are separate connections, which would not see each other's temporary tables
+        cursor.execute(f"""
+            CREATE OR REPLACE TABLE {INCOMING_TABLE} (
+                record_title VARCHAR, heading VARCHAR, chunk VARCHAR, category VARCHAR, content_hash VARCHAR
+            )
+        """)
+
+    def copy_parquet(self, cursor, path: str, table: str) -> None:
+        cursor.execute(f"INSERT INTO {table} ({', '.join(COLUMNS)}) SELECT {', '.join(COLUMNS)} FROM read_parquet(?)", [path])
+
+    def begin(self, cursor) -> None:
+        # Each DuckDB cursor is its own autocommitting connection; atomicity is not needed for benchmarks
+        pass
+
+    def merge_incoming(self, cursor) -> None:
+        cursor.execute(_DELETE_STALE_SQL.format(table=self.table))
+        cursor.execute(f"""
+            UPDATE {self.table} SET category = i.category
+            FROM {INCOMING_TABLE} i
+            WHERE {self.table}.content_hash = i.content_hash AND {self.table}.category IS DISTINCT FROM i.category
+        """)
+        cursor.execute(f"""
+            INSERT INTO {self.table} ({", ".join(COLUMNS)})
+            SELECT {", ".join(COLUMNS)} FROM {INCOMING_TABLE}
+            WHERE content_hash NOT IN (SELECT content_hash FROM {self.table} WHERE content_hash IS NOT NULL)
+        """)
+
+
+class ChunkLoader:
+    """Upsert chunk rows into drug_data, picking the cheaper load path for the batch size.
+
+    Rows are first loaded into a temporary table: small batches with a plain
+    executemany INSERT, batches of at least staged_threshold rows as a compressed
+    Parquet file loaded with a single COPY, which avoids per-row bind overhead.
+    They are then merged on content_hash, so unchanged chunks are left alone,
+    changed ones replace the old text of their section and re-runs add no duplicates.
+    """
+
+    def __init__(self, target=None, staged_threshold: int = 500, compression: str = "zstd"):
+        self.target = target or SnowflakeTarget()
+        self.staged_threshold = staged_threshold
+        self.compression = compression
+
+    def upsert(self, connection, rows: List[ChunkRow]) -> str:
+        """Merge rows into the target table inside an open transaction; the caller commits."""
+        if not rows:
+            return "none"
+        rows = list({row[4]: row for row in rows}.values())
+
+        cursor = connection.cursor()
+        try:
+            self.target.create_incoming(cursor)
+        finally:
+            cursor.close()
+
+        if len(rows) >= self.staged_threshold:
+            self.load_staged(connection, rows, INCOMING_TABLE)
+            method = "staged"
+        else:
+            self.load_executemany(connection, rows, INCOMING_TABLE)
+            method = "executemany"
+
+        cursor = connection.cursor()
+        try:
+            self.target.begin(cursor)
+            self.target.merge_incoming(cursor)
+        finally:
+            cursor.close()
+        return method
+
+    def load_executemany(self, connection, rows: List[ChunkRow], table: str) -> None:
+        placeholders = ", ".join([self.target.placeholder] * len(COLUMNS))
+        sql = f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES ({placeholders})"
+        cursor = connection.cursor()
+        try:
+            cursor.executemany(sql, rows)
+        finally:
+            cursor.close()
+
+    def load_staged(self, connection, rows: List[ChunkRow], table: str) -> None:
+        frame = pd.DataFrame(rows, columns=COLUMNS)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, f"drug_data_{uuid.uuid4().hex}.parquet")
+            frame.to_parquet(path, engine="pyarrow", compression=self.compression, index=False)
+            cursor = connection.cursor()
+            try:
+                self.target.copy_parquet(cursor, path, table)
+            finally:
+                cursor.close()
@@ -0,0 +1,368 @@
+"""In-process retrieval over a local copy of drug_data, as an alternative to Cortex Search.
+
+The index is a directory of flat files, all opened memory-mapped:
+
+    vectors.f32          unit-length embeddings, float32, rows grouped by IVF list
+    centroids.npy        IVF list centroids (spherical k-means)
+    list_offsets.npy     row range of each list in vectors.f32
+    documents.bin        the chunk rows as JSON, one after another, same order
+    doc_offsets.npy      byte range of each row in documents.bin
+    category_bitmaps.npy one packed bitmap of rows per category
+    synonyms.json        drug_synonyms, for the drug-name lookup (optional)
+    meta.json            sizes, embedder and category names
+
+A query is embedded, compared with the centroids, and only the rows of the
+nprobe closest lists are scored; a category filter is a bit test against that
+category's bitmap. Small categories are scored exhaustively instead.
+
+    python local_retriever.py build --source snowflake
+    python local_retriever.py build --source drug_data.parquet --embedder hashing
+    python local_retriever.py search "ibuprofen side effects" --category Analgesic
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from retrievers import Retriever
+
+DEFAULT_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", os.path.join(".cache", "local_index"))
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EXPORT_COLUMNS = ["record_title", "heading", "chunk", "category"]
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model; cosine similarity via unit-length vectors."""
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        vectors = self.model.encode(list(texts), batch_size=batch_size, normalize_embeddings=True,
+                                    convert_to_numpy=True)
+        return vectors.astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words. Needs no model, so it suits load tests; relevance is lexical only."""
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def encode(self, texts: Sequence[str], batch_size: int = 0) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[i, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+def make_embedder(name: str, dim: Optional[int] = None):
+    if name == HashingEmbedder.name:
+        return HashingEmbedder(dim or 256)
+    return SentenceTransformerEmbedder(name)
+
+
+def export_drug_data(connection, batch_size: int = 10000) -> Iterator[Dict[str, Any]]:
+    """Stream the chunk rows out of drug_data."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM drug_data")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(EXPORT_COLUMNS, row))
+    finally:
+        cursor.close()
+
+
+def export_drug_synonyms(connection) -> Dict[str, List[str]]:
+    """drug_synonyms as {record_title: [synonym, ...]}."""
+    from drug_name_index import DRUG_SYNONYMS_TABLE
+
+    synonyms: Dict[str, List[str]] = {}
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SELECT record_title, synonym FROM {DRUG_SYNONYMS_TABLE}")
+        for record_title, synonym in cursor.fetchall():
+            synonyms.setdefault(record_title, []).append(synonym)
+    finally:
+        cursor.close()
+    return synonyms
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), batch_size):
+        assignments[start:start + batch_size] = np.argmax(data[start:start + batch_size] @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(data: np.ndarray, k: int, iterations: int = 15, seed: int = 0) -> np.ndarray:
+    """k-means on the unit sphere (cosine); empty lists are re-seeded from random rows."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(data, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=k)
+        sums = np.zeros_like(centroids)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[nonempty])[:-1]))
+        sums[nonempty] = np.add.reduceat(data[order], starts, axis=0)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = data[rng.choice(len(data), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+def write_index(out_dir: str, vectors: np.ndarray, rows: List[Dict[str, Any]], embedder_name: str,
+                nlist: Optional[int] = None, train_size: int = 100_000, seed: int = 0,
+                synonyms: Optional[Dict[str, List[str]]] = None) -> None:
+    """Cluster the vectors and write the index files; replaces out_dir only once everything is written."""
+    n, dim = vectors.shape
+    if n == 0:
+        raise ValueError("Nothing to index.")
+    nlist = min(n, nlist or max(1, int(4 * math.sqrt(n))))
+    rng = np.random.default_rng(seed)
+    train = vectors if n <= train_size else vectors[np.sort(rng.choice(n, train_size, replace=False))]
+    centroids = spherical_kmeans(np.asarray(train, dtype=np.float32), nlist, seed=seed)
+    assignments = _assign(vectors, centroids)
+    order = np.argsort(assignments, kind="stable")
+    list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=nlist)))).astype(np.int64)
+
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    stored = np.memmap(os.path.join(tmp_dir, "vectors.f32"), dtype=np.float32, mode="w+", shape=(n, dim))
+    for start in range(0, n, 65536):
+        stored[start:start + 65536] = vectors[order[start:start + 65536]]
+    stored.flush()
+    del stored
+
+    doc_offsets = np.zeros(n + 1, dtype=np.int64)
+    categories = sorted({row.get("category") for row in rows if row.get("category")})
+    category_ids = {category: i for i, category in enumerate(categories)}
+    masks = np.zeros((len(categories), n), dtype=bool)
+    with open(os.path.join(tmp_dir, "documents.bin"), "wb") as f:
+        for position, row_id in enumerate(order):
+            row = rows[row_id]
+            encoded = json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            f.write(encoded)
+            doc_offsets[position + 1] = doc_offsets[position] + len(encoded)
+            if row.get("category") in category_ids:
+                masks[category_ids[row["category"]], position] = True
+
+    np.save(os.path.join(tmp_dir, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_dir, "list_offsets.npy"), list_offsets)
+    np.save(os.path.join(tmp_dir, "doc_offsets.npy"), doc_offsets)
+    np.save(os.path.join(tmp_dir, "category_bitmaps.npy"), np.packbits(masks, axis=1))
+    if synonyms:
+        with open(os.path.join(tmp_dir, "synonyms.json"), "w", encoding="utf-8") as f:
+            json.dump(synonyms, f, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "rows": n, "dim": dim, "nlist": nlist, "embedder": embedder_name,
+                   "categories": categories, "built_at": time.time()}, f)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+
+
+def build_index(rows: Iterable[Dict[str, Any]], out_dir: str = DEFAULT_INDEX_PATH, embedder=None,
+                nlist: Optional[int] = None, batch_size: int = 256,
+                synonyms: Optional[Dict[str, List[str]]] = None) -> int:
+    """Embed the chunk rows and write an index for them; returns the number of rows indexed."""
+    embedder = embedder or make_embedder(DEFAULT_EMBEDDING_MODEL)
+    rows = [row for row in rows if row.get("chunk")]
+    vectors = np.empty((len(rows), embedder.dim), dtype=np.float32)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        vectors[start:start + len(batch)] = embedder.encode([row["chunk"] for row in batch])
+    write_index(out_dir, vectors, rows, embedder.name, nlist, synonyms=synonyms)
+    print(f"Indexed {len(rows)} chunks ({embedder.dim}-d) into {out_dir}.")
+    return len(rows)
+
+
+class LocalRetriever(Retriever):
+    """Searches an index written by build_index(), entirely in process."""
+
+    def __init__(self, index_dir: str = DEFAULT_INDEX_PATH, nprobe: int = 16, embedder=None,
+                 exhaustive_below: int = 4096):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        n, dim = self.meta["rows"], self.meta["dim"]
+        self.vectors = np.memmap(os.path.join(index_dir, "vectors.f32"), dtype=np.float32, mode="r", shape=(n, dim))
+        self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        self.list_offsets = np.load(os.path.join(index_dir, "list_offsets.npy"))
+        self.doc_offsets = np.load(os.path.join(index_dir, "doc_offsets.npy"), mmap_mode="r")
+        self.documents = np.memmap(os.path.join(index_dir, "documents.bin"), dtype=np.uint8, mode="r")
+        self.category_bitmaps = np.load(os.path.join(index_dir, "category_bitmaps.npy"), mmap_mode="r")
+        self.category_ids = {category: i for i, category in enumerate(self.meta["categories"])}
+        self.nprobe = min(nprobe, len(self.centroids))
+        self.exhaustive_below = exhaustive_below
+        self._category_rows: Dict[int, np.ndarray] = {}
+        self._title_rows: Optional[Dict[str, List[int]]] = None
+        self.index_dir = index_dir
+        self.embedder = embedder or make_embedder(self.meta["embedder"], dim)
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    def _rows_of(self, category_id: int) -> np.ndarray:
+        rows = self._category_rows.get(category_id)
+        if rows is None:
+            rows = np.flatnonzero(np.unpackbits(self.category_bitmaps[category_id])[:len(self)])
+            self._category_rows[category_id] = rows
+        return rows
+
+    def _score_lists(self, vector: np.ndarray, lists: np.ndarray,
+                     bitmap: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        rows, scores = [], []
+        for list_id in lists:
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == end:
+                continue
+            list_rows = np.arange(start, end)
+            list_scores = self.vectors[start:end] @ vector
+            if bitmap is not None:
+                keep = (bitmap[list_rows >> 3] >> (7 - (list_rows & 7))) & 1
+                list_rows, list_scores = list_rows[keep == 1], list_scores[keep == 1]
+            rows.append(list_rows)
+            scores.append(list_scores)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(rows), np.concatenate(scores)
+
+    def search_vector(self, vector: np.ndarray, limit: int, category: Optional[str] = None) -> List[Tuple[int, float]]:
+        """(row, cosine score) of the best matches, best first."""
+        bitmap = None
+        if category is not None:
+            category_id = self.category_ids.get(category)
+            if category_id is None:
+                return []
+            category_rows = self._rows_of(category_id)
+            if len(category_rows) <= self.exhaustive_below:
+                rows, scores = category_rows, self.vectors[category_rows] @ vector
+                return self._top(rows, scores, limit)
+            bitmap = self.category_bitmaps[category_id]
+
+        centroid_scores = self.centroids @ vector
+        if self.nprobe < len(centroid_scores):
+            lists = np.argpartition(-centroid_scores, self.nprobe - 1)[:self.nprobe]
+        else:
+            lists = np.arange(len(centroid_scores))
+        rows, scores = self._score_lists(vector, lists, bitmap)
+        if len(rows) < limit and len(lists) < len(centroid_scores):
+            # A filtered search came up short in the probed lists; fall back to all of them
+            rows, scores = self._score_lists(vector, np.arange(len(centroid_scores)), bitmap)
+        return self._top(rows, scores, limit)
+
+    @staticmethod
+    def _top(rows: np.ndarray, scores: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        if len(rows) > limit:
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores)
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def document(self, row: int) -> Dict[str, Any]:
+        return json.loads(bytes(self.documents[self.doc_offsets[row]:self.doc_offsets[row + 1]]))
+
+    def title_rows(self) -> Dict[str, List[int]]:
+        """Rows of each record title, from one pass over the documents on first use."""
+        if self._title_rows is None:
+            title_rows: Dict[str, List[int]] = {}
+            for row in range(len(self)):
+                title_rows.setdefault(self.document(row).get("record_title"), []).append(row)
+            self._title_rows = title_rows
+        return self._title_rows
+
+    def chunks_for_title(self, record_title: str) -> List[Dict[str, Any]]:
+        return [self.document(row) for row in self.title_rows().get(record_title, [])]
+
+    def drug_names(self) -> List[Tuple[str, str]]:
+        """(record_title, name) pairs: every title, plus the synonyms exported with the index."""
+        names = [(title, title) for title in self.title_rows() if title]
+        path = os.path.join(self.index_dir, "synonyms.json")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                synonyms = json.load(f)
+            names.extend((title, synonym) for title, synonyms_of in synonyms.items() if title in self.title_rows()
+                         for synonym in synonyms_of)
+        return names
+
+    def search(self, query: str, columns: List[str], limit: int, category: Optional[str] = None) -> str:
+        vector = self.embedder.encode([query])[0]
+        results = []
+        for row, _ in self.search_vector(vector, limit, category):
+            document = self.document(row)
+            results.append({column: document.get(column) for column in columns})
+        return json.dumps({"results": results})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="export drug_data and build the local index")
+    build_parser.add_argument("--source", default="snowflake", help="'snowflake' or a Parquet export of drug_data")
+    build_parser.add_argument("--embedder", default=DEFAULT_EMBEDDING_MODEL,
+                              help="sentence-transformers model name, or 'hashing' for a model-free index")
+    build_parser.add_argument("--nlist", type=int, help="number of IVF lists (default 4 * sqrt(rows))")
+
+    search_parser = subparsers.add_parser("search", help="query the local index")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--category")
+    search_parser.add_argument("--limit", type=int, default=3)
+    search_parser.add_argument("--nprobe", type=int, default=16)
+
+    for sub in subparsers.choices.values():
+        sub.add_argument("--index", default=DEFAULT_INDEX_PATH, help="index directory")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.source == "snowflake":
+            from snowflake_pool import get_connection_pool
+
+            with get_connection_pool().acquire() as connection:
+                rows = list(export_drug_data(connection))
+                try:
+                    synonyms = export_drug_synonyms(connection)
+                except Exception as e:
+                    print(f"Drug synonyms not exported, names will be record titles only: {e}")
+                    synonyms = None
+        else:
+            import pandas as pd
+
+            rows = pd.read_parquet(args.source, columns=EXPORT_COLUMNS).to_dict("records")
+            synonyms = None
+        build_index(rows, args.index, make_embedder(args.embedder), args.nlist, synonyms=synonyms)
+    else:
+        retriever = LocalRetriever(args.index, nprobe=args.nprobe)
+        started = time.perf_counter()
+        response = retriever.search(args.query, EXPORT_COLUMNS, args.limit, args.category)
+        print(json.dumps(json.loads(response), indent=2))
+        print(f"{(time.perf_counter() - started) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
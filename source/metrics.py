@@ -0,0 +1,233 @@
+"""Spans, histograms and counters for ingestion and chat, exportable as Prometheus text or JSON lines.
+
+Everything is recorded in the process-wide REGISTRY. A span times a block of
+code into the span_seconds histogram; when a Trace is active in the current
+context (one chat turn, say) the span is also added to it, which gives the
+per-step breakdown of that one turn. Contexts are copied into worker threads
+by the callers that fan out, so spans on those threads land in the same trace.
+
+    with Trace("chat") as trace:
+        with span("search"):
+            ...
+    trace.breakdown()  # [{"span": "search", "start_ms": 0.1, "duration_ms": 210.4}, ...]
+"""
+import bisect
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; from sub-millisecond local lookups to minute-long LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus exposes it; quantiles are interpolated within a bucket."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float, count: int = 1) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += count
+        self.count += count
+        self.sum += value * count
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Thread-safe store of named, labelled counters and histograms."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, count: int = 1, **labels: Any) -> None:
+        """Add value to a histogram; count > 1 records it as the average of that many observations."""
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value, count)
+
+    def histogram(self, name: str, **labels: Any) -> Optional[Histogram]:
+        """A copy of the histogram taken under the lock, safe to read while others keep observing."""
+        with self._lock:
+            histogram = self._histograms.get(name, {}).get(_labels(labels))
+            if histogram is None:
+                return None
+            snapshot = Histogram(histogram.buckets)
+            snapshot.counts = list(histogram.counts)
+            snapshot.count = histogram.count
+            snapshot.sum = histogram.sum
+            return snapshot
+
+    def quantile(self, name: str, q: float, **labels: Any) -> float:
+        """Quantile q of a histogram, 0.0 if nothing was observed under those labels."""
+        with self._lock:
+            histogram = self._histograms.get(name, {}).get(_labels(labels))
+            return histogram.quantile(q) if histogram is not None else 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def prometheus_text(self) -> str:
+        """Text exposition format, for a textfile collector or a scrape endpoint."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def json_lines(self) -> str:
+        """One JSON object per series, with p50/p90/p99 for histograms."""
+        timestamp = time.time()
+        records = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                for labels, value in series.items():
+                    records.append({"ts": timestamp, "type": "counter", "name": name, "labels": dict(labels),
+                                    "value": value})
+            for name, series in sorted(self._histograms.items()):
+                for labels, histogram in series.items():
+                    records.append({
+                        "ts": timestamp, "type": "histogram", "name": name, "labels": dict(labels),
+                        "count": histogram.count, "sum": round(histogram.sum, 6),
+                        "p50": round(histogram.quantile(0.5), 6), "p90": round(histogram.quantile(0.9), 6),
+                        "p99": round(histogram.quantile(0.99), 6),
+                    })
+        return "".join(json.dumps(record) + "\n" for record in records)
+
+    def dump(self, path: str) -> None:
+        """Append JSON lines to a .jsonl path; write Prometheus text to any other path."""
+        if path.endswith(".jsonl"):
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(self.json_lines())
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+
+
+REGISTRY = MetricsRegistry()
+
+_current_trace: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """The spans of one unit of work, e.g. a chat turn; active in the current context inside `with`."""
+
+    def __init__(self, kind: str, registry: MetricsRegistry = REGISTRY):
+        self.kind = kind
+        self.registry = registry
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self) -> "Trace":
+        self.started = time.perf_counter()
+        self._token = _current_trace.set(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _current_trace.reset(self._token)
+        self.registry.observe("trace_seconds", time.perf_counter() - self.started, kind=self.kind)
+
+    def record(self, name: str, seconds: float, started: Optional[float] = None, error: bool = False) -> None:
+        """Add a span measured elsewhere; started is its perf_counter() start, if known."""
+        started = started if started is not None else time.perf_counter() - seconds
+        with self._lock:
+            self.spans.append({
+                "span": name,
+                "start_ms": round((started - self.started) * 1000, 1),
+                "duration_ms": round(seconds * 1000, 1),
+                "error": error,
+            })
+        self.registry.observe("span_seconds", seconds, kind=self.kind, span=name)
+
+    def breakdown(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return sorted(self.spans, key=lambda s: s["start_ms"])
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the block into span_seconds, and into the active trace if there is one.
+
+    Within a trace everything goes to the trace's registry, otherwise to REGISTRY.
+    """
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        trace = _current_trace.get()
+        registry = trace.registry if trace is not None else REGISTRY
+        if trace is not None:
+            trace.record(name, seconds, started, error)
+        else:
+            registry.observe("span_seconds", seconds, kind="none", span=name)
+        if error:
+            registry.inc("span_errors_total", span=name)
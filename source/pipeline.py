@@ -0,0 +1,187 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Callable, Iterable, List, Optional, Union
+
+from metrics import REGISTRY
+
+# Marks the end of a stage's input stream.
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    name: str
+    concurrency: int
+    items_in: int = 0
+    items_out: int = 0
+    errors: int = 0
+    busy_seconds: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Items consumed per second of wall-clock time the stage has been running."""
+        return self.items_in / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """Fraction of the stage's worker capacity spent working rather than waiting on its queues."""
+        capacity = self.elapsed * self.concurrency
+        return self.busy_seconds / capacity if capacity else 0.0
+
+
+@dataclass
+class Stage:
+    """One step of a Pipeline.
+
+    `func` receives one item (or a list of items when batch_size > 1) and returns the
+    value handed to the next stage; returning None drops the item. A partial batch is
+    flushed once batch_timeout seconds pass without filling it. With flatten=True the
+    returned iterable is passed on one element at a time. Coroutine functions are
+    awaited on the event loop, plain functions run in worker threads.
+    """
+    name: str
+    func: Callable[[Any], Any]
+    concurrency: int = 1
+    batch_size: int = 1
+    batch_timeout: Optional[float] = None
+    flatten: bool = False
+    stats: StageStats = field(init=False)
+
+    def __post_init__(self):
+        self.stats = StageStats(self.name, self.concurrency)
+
+    async def call(self, item: Any) -> Any:
+        if asyncio.iscoroutinefunction(self.func):
+            return await self.func(item)
+        return await asyncio.to_thread(self.func, item)
+
+
+class Pipeline:
+    """Run stages concurrently, connected by bounded queues for back-pressure."""
+
+    def __init__(self, stages: List[Stage], queue_size: int = 100, report_interval: Optional[float] = 30):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+
+    async def run(self, source: Union[Iterable[Any], AsyncIterable[Any]]) -> List[StageStats]:
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        tasks = [asyncio.create_task(self._feed(source, queues[0]))]
+        for index, stage in enumerate(self.stages):
+            out_queue = queues[index + 1] if index + 1 < len(queues) else None
+            next_concurrency = self.stages[index + 1].concurrency if out_queue else 0
+            tasks.append(asyncio.create_task(self._run_stage(stage, queues[index], out_queue, next_concurrency)))
+
+        reporter = asyncio.create_task(self._report_periodically()) if self.report_interval else None
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if reporter:
+                reporter.cancel()
+        return [stage.stats for stage in self.stages]
+
+    async def _feed(self, source: Union[Iterable[Any], AsyncIterable[Any]], queue: asyncio.Queue) -> None:
+        if hasattr(source, "__aiter__"):
+            async for item in source:
+                await queue.put(item)
+        else:
+            for item in source:
+                await queue.put(item)
+        for _ in range(self.stages[0].concurrency):
+            await queue.put(_DONE)
+
+    async def _run_stage(self, stage: Stage, in_queue: asyncio.Queue, out_queue: Optional[asyncio.Queue],
+                         next_concurrency: int) -> None:
+        stage.stats.started_at = time.perf_counter()
+        await asyncio.gather(*(self._worker(stage, in_queue, out_queue) for _ in range(stage.concurrency)))
+        stage.stats.finished_at = time.perf_counter()
+        if out_queue is not None:
+            for _ in range(next_concurrency):
+                await out_queue.put(_DONE)
+
+    async def _worker(self, stage: Stage, in_queue: asyncio.Queue, out_queue: Optional[asyncio.Queue]) -> None:
+        batch = []
+        batch_started = None
+        while True:
+            if batch and stage.batch_timeout is not None:
+                remaining = stage.batch_timeout - (time.perf_counter() - batch_started)
+                try:
+                    item = await asyncio.wait_for(in_queue.get(), timeout=max(remaining, 0))
+                except asyncio.TimeoutError:
+                    await self._process(stage, batch, out_queue)
+                    batch = []
+                    continue
+            else:
+                item = await in_queue.get()
+            if item is _DONE:
+                break
+            if stage.batch_size > 1:
+                if not batch:
+                    batch_started = time.perf_counter()
+                batch.append(item)
+                if len(batch) >= stage.batch_size:
+                    await self._process(stage, batch, out_queue)
+                    batch = []
+            else:
+                await self._process(stage, item, out_queue)
+        if batch:
+            await self._process(stage, batch, out_queue)
+
+    async def _process(self, stage: Stage, item: Any, out_queue: Optional[asyncio.Queue]) -> None:
+        items = len(item) if stage.batch_size > 1 else 1
+        stage.stats.items_in += items
+        started = time.perf_counter()
+        try:
+            result = await stage.call(item)
+        except Exception as e:
+            stage.stats.errors += 1
+            REGISTRY.inc("pipeline_stage_errors_total", stage=stage.name)
+            print(f"Stage '{stage.name}' failed: {e}")
+            return
+        finally:
+            elapsed = time.perf_counter() - started
+            stage.stats.busy_seconds += elapsed
+            # Per item: a batch call counts as that many items taking an equal share of it
+            if items:
+                REGISTRY.observe("pipeline_stage_seconds", elapsed / items, count=items, stage=stage.name)
+
+        if result is None:
+            return
+        for output in (result if stage.flatten else [result]):
+            stage.stats.items_out += 1
+            if out_queue is not None:
+                await out_queue.put(output)
+
+    async def _report_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(format_stats([stage.stats for stage in self.stages]))
+
+
+def format_stats(stats: List[StageStats]) -> str:
+    """Render per-stage throughput and per-item latency as a table; the busiest stage is the one limiting the run."""
+    lines = [f"{'stage':<12}{'workers':>8}{'in':>8}{'out':>8}{'errors':>8}{'items/s':>10}{'busy':>8}"
+             f"{'p50 ms':>9}{'p99 ms':>9}"]
+    for s in stats:
+        p50 = REGISTRY.quantile("pipeline_stage_seconds", 0.5, stage=s.name)
+        p99 = REGISTRY.quantile("pipeline_stage_seconds", 0.99, stage=s.name)
+        lines.append(
+            f"{s.name:<12}{s.concurrency:>8}{s.items_in:>8}{s.items_out:>8}{s.errors:>8}"
+            f"{s.throughput:>10.2f}{s.utilization:>8.0%}{p50 * 1000:>9.1f}{p99 * 1000:>9.1f}"
+        )
+    active = [s for s in stats if s.items_in]
+    if active:
+        bottleneck = max(active, key=lambda s: s.utilization)
+        lines.append(f"Bottleneck: {bottleneck.name} ({bottleneck.utilization:.0%} busy)")
+    return "\n".join(lines)
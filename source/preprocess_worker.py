@@ -0,0 +1,44 @@
+"""Parse and chunk PubChem records in worker processes.
+
+JSON decoding, section extraction and tokenization are CPU-bound and hold the
+GIL, so a thread per stage cannot use more than one core. Each worker of a
+ProcessPoolExecutor loads the tokenizer once in init_worker(), receives the raw
+response body and returns the parsed record with its chunks attached; only
+bytes go in and small DrugDetails objects come back across the process boundary.
+"""
+import json
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from chunker import TokenChunker
+from pubchem_parser import TOC_HEADINGS, DrugDetails, chunk_drug, parse_drug
+
+_chunker: Optional[TokenChunker] = None
+_toc_headings = TOC_HEADINGS
+
+
+def init_worker(tokenizer_name: str = "gpt2", chunk_size: int = 500, chunk_overlap: int = 50,
+                toc_headings: Iterable[str] = TOC_HEADINGS) -> None:
+    """ProcessPoolExecutor initializer: build the per-process tokenizer and chunker."""
+    global _chunker, _toc_headings
+    from transformers import GPT2TokenizerFast
+
+    tokenizer = GPT2TokenizerFast.from_pretrained(tokenizer_name)
+    _chunker = TokenChunker(tokenizer, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    _toc_headings = list(toc_headings)
+
+
+def preprocess_record(item: Tuple[int, Union[bytes, Dict[str, Any]]]) -> Tuple[int, Optional[DrugDetails]]:
+    """Decode, parse and chunk one record; returns (drug_id, None) when it has no drug section."""
+    if _chunker is None:
+        init_worker()
+
+    drug_id, payload = item
+    if isinstance(payload, (bytes, str)):
+        # A ValueError here propagates to the caller, which marks the compound as failed
+        payload = json.loads(payload)
+
+    drug = parse_drug(payload, _toc_headings)
+    if drug is None:
+        return drug_id, None
+    drug.drug_id = drug_id
+    return drug_id, chunk_drug(drug, _chunker.split_text)
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+import ijson
+
+from pubchem_parser import TOC_HEADINGS, DrugDetails
+from raw_store import RawResponseStore
+from streaming_parser import CHUNK_SIZE, SectionStreamParser, parse_file
+
+PUBCHEM_BASE_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound"
+
+# PubChem asks clients to stay at or below 5 requests per second.
+PUBCHEM_REQUESTS_PER_SECOND = 5
+
+# Client errors that may go away on their own; every other 4xx is an answer about the record itself
+RETRYABLE_CLIENT_STATUSES = {408, 429}
+
+
+class RecordNotFound(Exception):
+    """PubChem answered with a permanent client error, e.g. 404 for a CID that is not live; retrying will not help."""
+
+    def __init__(self, drug_id: int, status: int):
+        super().__init__(f"PubChem returned {status} for drug ID {drug_id}")
+        self.drug_id = drug_id
+        self.status = status
+
+
+def _check_permanent(drug_id: int, status: int) -> None:
+    if 400 <= status < 500 and status not in RETRYABLE_CLIENT_STATUSES:
+        raise RecordNotFound(drug_id, status)
+
+
+class TokenBucket:
+    """Async token bucket that limits how many requests may start per second."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _loop_lock(self) -> asyncio.Lock:
+        # An asyncio.Lock belongs to the loop it is first used in, and each shard runs its own asyncio.run()
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it. The token count carries over from one event loop to the next."""
+        async with self._loop_lock():
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PubChemDownloader:
+    """Download PUG-View compound records concurrently over one pooled HTTP client.
+
+    Use as an async context manager so the underlying connection pool is opened
+    and closed inside the running event loop. With a RawResponseStore attached,
+    every response is kept on disk and re-requested conditionally (ETag /
+    Last-Modified); entries younger than max_age are served without a request,
+    and offline=True replays the store without touching the network.
+    """
+
+    def __init__(
+        self,
+        base_url: str = PUBCHEM_BASE_URL,
+        requests_per_second: float = PUBCHEM_REQUESTS_PER_SECOND,
+        max_in_flight: int = 20,
+        max_retries: int = 3,
+        base_delay: float = 2,
+        timeout: float = 10,
+        store: Optional[RawResponseStore] = None,
+        offline: bool = False,
+        max_age: Optional[float] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.timeout = timeout
+        self.store = store
+        self.offline = offline
+        self.max_age = max_age
+        if offline and store is None:
+            raise ValueError("Offline replay needs a RawResponseStore.")
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "PubChemDownloader":
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def compound_url(self, drug_id: int) -> str:
+        return f"{self.base_url}/{drug_id}/JSON/"
+
+    async def fetch(self, drug_id: int) -> Optional[Dict[str, Any]]:
+        """Fetch one compound record with the same retry/backoff as the old blocking client.
+
+        Returns None when the record could not be retrieved; raises RecordNotFound,
+        without retrying, when PubChem says it does not exist.
+        """
+        body = await self.fetch_bytes(drug_id)
+        if body is None:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            print(f"Invalid JSON response for drug ID {drug_id}: {e}")
+            return None
+
+    def _serve_from_store(self, entry) -> bool:
+        return entry is not None and (
+            self.offline or (self.max_age is not None and time.time() - entry.fetched_at < self.max_age))
+
+    def _conditional_headers(self, entry) -> Dict[str, str]:
+        if self._session is None:
+            raise RuntimeError("PubChemDownloader must be used inside 'async with'.")
+        # Revalidate a stored response instead of downloading it again
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    async def fetch_bytes(self, drug_id: int) -> Optional[bytes]:
+        """Fetch the raw response body, leaving JSON decoding to the caller (e.g. a worker process)."""
+        # The store is SQLite and gzip files; keep its I/O off the event loop
+        entry = await asyncio.to_thread(self.store.lookup, drug_id) if self.store is not None else None
+        if self._serve_from_store(entry):
+            return await asyncio.to_thread(self.store.load_bytes, drug_id)
+        if self.offline:
+            return None
+        headers = self._conditional_headers(entry)
+
+        url = self.compound_url(drug_id)
+        for attempt in range(self.max_retries):
+            await self.rate_limiter.acquire()
+            try:
+                async with self._session.get(url, headers=headers) as response:
+                    if response.status == 304 and entry is not None:
+                        await asyncio.to_thread(self.store.touch, drug_id)
+                        return await asyncio.to_thread(self.store.load_bytes, drug_id)
+                    _check_permanent(drug_id, response.status)
+                    response.raise_for_status()
+                    body = await response.read()
+                if self.store is not None:
+                    await asyncio.to_thread(
+                        self.store.save, drug_id, body,
+                        response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                    )
+                return body
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                delay = self.base_delay * (attempt + 1)
+                if attempt < self.max_retries - 1:
+                    print(f"Attempt {attempt + 1} failed for drug ID {drug_id}: {e}. Retrying in {delay} seconds...")
+                    await asyncio.sleep(delay)
+                else:
+                    print(f"Failed to fetch drug ID {drug_id} after {self.max_retries} attempts: {e}")
+                    return None
+
+    def _parse_stored(self, drug_id: int, toc_headings: Iterable[str]) -> Tuple[bool, Optional[DrugDetails]]:
+        f = self.store.open_stream(drug_id)
+        if f is None:
+            return False, None
+        with f:
+            return True, parse_file(f, toc_headings)
+
+    async def fetch_streamed(self, drug_id: int,
+                             toc_headings: Iterable[str] = TOC_HEADINGS) -> Tuple[bool, Optional[DrugDetails]]:
+        """Parse the record while it downloads, keeping only the toc_headings sections.
+
+        Returns (fetched, drug): fetched is False when the record could not be
+        retrieved or was not valid JSON, drug is None when it has no drug section.
+        Raises RecordNotFound like fetch().
+        """
+        # The store is SQLite and gzip files; keep its I/O off the event loop
+        entry = await asyncio.to_thread(self.store.lookup, drug_id) if self.store is not None else None
+        try:
+            if self._serve_from_store(entry):
+                return await asyncio.to_thread(self._parse_stored, drug_id, toc_headings)
+            if self.offline:
+                return False, None
+            headers = self._conditional_headers(entry)
+
+            url = self.compound_url(drug_id)
+            for attempt in range(self.max_retries):
+                await self.rate_limiter.acquire()
+                parser = SectionStreamParser(toc_headings)
+                # The raw store still needs the whole body, but as one compact bytes object, not a dict tree
+                chunks: Optional[List[bytes]] = [] if self.store is not None else None
+                try:
+                    async with self._session.get(url, headers=headers) as response:
+                        if response.status == 304 and entry is not None:
+                            await asyncio.to_thread(self.store.touch, drug_id)
+                            return await asyncio.to_thread(self._parse_stored, drug_id, toc_headings)
+                        _check_permanent(drug_id, response.status)
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            parser.feed(chunk)
+                            if chunks is not None:
+                                chunks.append(chunk)
+                    drug = parser.drug()
+                    if chunks is not None:
+                        await asyncio.to_thread(
+                            self.store.save, drug_id, b"".join(chunks),
+                            response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                        )
+                    return True, drug
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    delay = self.base_delay * (attempt + 1)
+                    if attempt < self.max_retries - 1:
+                        print(f"Attempt {attempt + 1} failed for drug ID {drug_id}: {e}. Retrying in {delay} seconds...")
+                        await asyncio.sleep(delay)
+                    else:
+                        print(f"Failed to fetch drug ID {drug_id} after {self.max_retries} attempts: {e}")
+                        return False, None
+        except ijson.JSONError as e:
+            print(f"Invalid JSON response for drug ID {drug_id}: {e}")
+            return False, None
+
+    async def fetch_many(self, drug_ids: Iterable[int]) -> AsyncIterator[Tuple[int, Optional[Dict[str, Any]]]]:
+        """Yield (drug_id, data) pairs as downloads complete, keeping up to max_in_flight requests open."""
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def bounded_fetch(drug_id: int) -> Tuple[int, Optional[Dict[str, Any]]]:
+            async with semaphore:
+                try:
+                    return drug_id, await self.fetch(drug_id)
+                except RecordNotFound:
+                    return drug_id, None
+
+        tasks = [asyncio.create_task(bounded_fetch(drug_id)) for drug_id in drug_ids]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,125 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+DRUG_SECTION = "Drug and Medication Information"
+NAMES_SECTION = "Names and Identifiers"
+TOC_HEADINGS = [NAMES_SECTION, DRUG_SECTION]
+SYNONYMS_SECTION = "Synonyms"
+# MeSH terms are curated; depositor synonyms run to hundreds of registry codes, so only the first few are kept
+SYNONYM_HEADINGS = {"MeSH Entry Terms": 50, "Depositor-Supplied Synonyms": 25}
+# CAS numbers, upper-case catalogue codes (R16CO5Y76E, D09BG06) and prefixed identifiers (UNII-..., NSC 27223)
+_REGISTRY_CODE = re.compile(r"^(\d+-\d+-\d+|[A-Z0-9-]*\d[A-Z0-9-]*|[A-Z]{2,}[\s:-]*[A-Z0-9]*\d.*)$")
+
+
+@dataclass
+class DrugDetails:
+    record_title: str
+    details: Dict[str, str]
+    drug_id: Optional[int] = None
+    chunks: List[Dict[str, Any]] = field(default_factory=list)
+    category: Optional[str] = None
+    synonyms: List[str] = field(default_factory=list)
+
+
+def extract_information(section: Dict[str, Any]) -> str:
+    """Extract and clean information from section."""
+    details_list = []
+    for sub_section in section.get('Section', []):
+        for info in sub_section.get('Information', []):
+            if "Value" in info and "StringWithMarkup" in info["Value"]:
+                for detail in info["Value"]["StringWithMarkup"]:
+                    text = detail.get('String', '').strip()
+                    if text:
+                        details_list.append(text)
+    return " ".join(details_list)
+
+
+def extract_sections(data: Dict[str, Any], toc_headings: Iterable[str] = TOC_HEADINGS) -> Optional[Tuple[str, Dict[str, str]]]:
+    """Return (record_title, {heading: text}) for the wanted top-level sections of a PUG-View record."""
+    if 'Record' not in data:
+        return None
+
+    record = data['Record']
+    record_title = record.get('RecordTitle', "Unknown Title")
+    if record_title == "Unknown Title":
+        return None
+
+    details = {}
+    for section in record.get('Section', []):
+        heading = section.get("TOCHeading")
+        if heading in toc_headings:
+            extracted_info = extract_information(section)
+            if extracted_info:
+                details[heading] = extracted_info
+    return record_title, details
+
+
+def clean_synonyms(record_title: str, names: Iterable[str], limit: Optional[int] = None) -> List[str]:
+    """Names a user could type for the drug: no registry codes, no repeats of the title or of each other."""
+    seen = {record_title.casefold()}
+    cleaned = []
+    for name in names:
+        name = name.strip()
+        key = name.casefold()
+        if key in seen or len(name) > 60 or not re.search(r"[^\W\d_]{3}", name) or _REGISTRY_CODE.match(name):
+            continue
+        seen.add(key)
+        cleaned.append(name)
+        if limit is not None and len(cleaned) >= limit:
+            break
+    return cleaned
+
+
+def select_synonyms(record_title: str, lists: Dict[str, List[str]]) -> List[str]:
+    """Combine the raw synonym lists by SYNONYM_HEADINGS, each capped at its limit, MeSH entry terms first."""
+    synonyms = []
+    for heading, limit in SYNONYM_HEADINGS.items():
+        synonyms.extend(clean_synonyms(record_title, lists.get(heading, []), limit))
+    return clean_synonyms(record_title, synonyms)
+
+
+def extract_synonyms(data: Dict[str, Any]) -> List[str]:
+    """Synonyms of the record from Names and Identifiers > Synonyms."""
+    record = data.get('Record', {})
+    lists: Dict[str, List[str]] = {}
+    for section in record.get('Section', []):
+        if section.get("TOCHeading") != NAMES_SECTION:
+            continue
+        for sub_section in section.get('Section', []):
+            if sub_section.get("TOCHeading") != SYNONYMS_SECTION:
+                continue
+            for synonym_list in sub_section.get('Section', []):
+                names = lists.setdefault(synonym_list.get("TOCHeading"), [])
+                for info in synonym_list.get('Information', []):
+                    for detail in info.get("Value", {}).get("StringWithMarkup", []):
+                        names.append(detail.get('String', ''))
+    return select_synonyms(record.get('RecordTitle', ''), lists)
+
+
+def parse_drug(data: Dict[str, Any], toc_headings: Iterable[str] = TOC_HEADINGS) -> Optional[DrugDetails]:
+    """Build DrugDetails for records that carry drug and medication information."""
+    extracted = extract_sections(data, toc_headings)
+    if extracted is None:
+        return None
+    return drug_from_sections(extracted, data['Record'].get('RecordNumber'), extract_synonyms(data))
+
+
+def drug_from_sections(extracted: Tuple[str, Dict[str, str]], drug_id: Optional[int] = None,
+                       synonyms: Optional[List[str]] = None) -> Optional[DrugDetails]:
+    record_title, details = extracted
+    if DRUG_SECTION in details:
+        return DrugDetails(record_title=record_title, details=details, drug_id=drug_id, synonyms=synonyms or [])
+    return None
+
+
+def chunk_drug(drug: DrugDetails, split_text: Callable[[str], List[str]]) -> DrugDetails:
+    """Apply chunking to the extracted details."""
+    for heading, text in drug.details.items():
+        for chunk in split_text(text):
+            drug.chunks.append({
+                "title": drug.record_title,
+                "heading": heading,
+                "chunk": chunk,
+            })
+    return drug
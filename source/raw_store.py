@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, List, Optional
+
+DEFAULT_STORE_PATH = os.getenv("PUBCHEM_STORE_PATH", os.path.join(".cache", "pubchem"))
+
+
+@dataclass
+class StoredResponse:
+    drug_id: int
+    sha256: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class RawResponseStore:
+    """Content-addressed on-disk store of raw PUG-View responses.
+
+    Response bodies are gzip-compressed under objects/<sha256[:2]>/<sha256>.json.gz,
+    so identical payloads are stored once. A small SQLite index maps each compound ID
+    to its current blob plus the ETag/Last-Modified headers needed to revalidate it.
+    """
+
+    def __init__(self, root: str = DEFAULT_STORE_PATH):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                drug_id INTEGER PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "objects", sha256[:2], f"{sha256}.json.gz")
+
+    def lookup(self, drug_id: int) -> Optional[StoredResponse]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT drug_id, sha256, etag, last_modified, fetched_at FROM responses WHERE drug_id = ?",
+                (drug_id,),
+            ).fetchone()
+        return StoredResponse(*row) if row else None
+
+    def drug_ids(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT drug_id FROM responses ORDER BY drug_id")]
+
+    def load_bytes(self, drug_id: int) -> Optional[bytes]:
+        entry = self.lookup(drug_id)
+        if entry is None:
+            return None
+        try:
+            with gzip.open(self._blob_path(entry.sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def open_stream(self, drug_id: int) -> Optional[BinaryIO]:
+        """Open the stored body for incremental reading (decompressed on the fly); the caller closes it."""
+        entry = self.lookup(drug_id)
+        if entry is None:
+            return None
+        try:
+            return gzip.open(self._blob_path(entry.sha256), "rb")
+        except FileNotFoundError:
+            return None
+
+    def load(self, drug_id: int) -> Optional[Dict[str, Any]]:
+        body = self.load_bytes(drug_id)
+        return json.loads(body) if body is not None else None
+
+    def save(self, drug_id: int, body: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None) -> str:
+        sha256 = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (drug_id, sha256, etag, last_modified, time.time()),
+            )
+            self._db.commit()
+        return sha256
+
+    def touch(self, drug_id: int) -> None:
+        """Record a successful revalidation (HTTP 304) of the stored response."""
+        with self._lock:
+            self._db.execute("UPDATE responses SET fetched_at = ? WHERE drug_id = ?", (time.time(), drug_id))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
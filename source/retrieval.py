@@ -0,0 +1,130 @@
+"""Concurrent retrieval for a chat turn.
+
+With chat history on, a turn used to wait for the history-summary COMPLETE and
+only then search with the summary. Here the search on the raw question starts
+at the same moment as the summary call, the summary search follows as soon as
+the summary is ready, and whatever came back within each stage's time budget
+is merged. A slow or failing summary no longer holds up the answer: the raw
+question's results are used on their own.
+
+Streamlit state is only readable from the script thread, so callers pass in
+plain values and callables; nothing here touches st.*.
+"""
+import asyncio
+import contextvars
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import span
+from text_utils import normalize_query
+
+NO_RESULTS = "Sorry, I don't have data for that category."
+
+# Shared by all sessions. A timed-out call keeps its thread until it returns; it is not waited for.
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="retrieval")
+
+
+@dataclass
+class StageTimeouts:
+    summary: float = 10.0
+    search: float = 5.0
+
+
+@dataclass
+class RetrievalResult:
+    context: str  # same JSON shape as svc.search(...).json(), or NO_RESULTS
+    summary: Optional[str] = None
+    sources: List[str] = field(default_factory=list)  # which searches contributed: "summary", "question"
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def merge_search_results(responses: List[str], max_results: int) -> List[Dict[str, Any]]:
+    """Concatenate the result lists of several search responses, dropping repeated chunks."""
+    merged, seen = [], set()
+    for response in responses:
+        try:
+            results = json.loads(response).get("results", [])
+        except (TypeError, ValueError, AttributeError):
+            continue
+        for result in results:
+            key = (result.get("record_title"), result.get("chunk"))
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(result)
+            if len(merged) >= max_results:
+                return merged
+    return merged
+
+
+async def _within(future: "asyncio.Future", deadline: float, stage: str, errors: List[BaseException]) -> Any:
+    try:
+        return await asyncio.wait_for(future, max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        print(f"Retrieval stage '{stage}' ran out of time.")
+        errors.append(TimeoutError(f"Retrieval stage '{stage}' ran out of time."))
+    except Exception as e:
+        print(f"Retrieval stage '{stage}' failed: {e}")
+        errors.append(e)
+    return None
+
+
+async def retrieve(question: str, search: Callable[[str], str], summarize: Optional[Callable[[], str]] = None,
+                   timeouts: StageTimeouts = StageTimeouts(), max_results: int = 6) -> RetrievalResult:
+    loop = asyncio.get_running_loop()
+    timings: Dict[str, float] = {}
+    errors: List[BaseException] = []
+
+    def timed(stage: str, func: Callable, *args) -> Any:
+        started = time.perf_counter()
+        try:
+            with span(stage):
+                return func(*args)
+        finally:
+            timings[stage] = time.perf_counter() - started
+
+    def submit(stage: str, func: Callable, *args) -> "asyncio.Future":
+        # A copy of the caller's context, so spans on the worker thread join the caller's trace
+        return loop.run_in_executor(_executor, contextvars.copy_context().run, timed, stage, func, *args)
+
+    started = time.monotonic()
+    # Speculative: the raw question is searched right away, whatever the summary turns out to be
+    question_search = submit("search_question", search, question)
+
+    responses: Dict[str, str] = {}
+    summary = None
+    if summarize is not None:
+        summary = await _within(submit("summary", summarize),
+                                started + timeouts.summary, "summary", errors)
+        if summary and normalize_query(summary) != normalize_query(question):
+            response = await _within(submit("search_summary", search, summary),
+                                     time.monotonic() + timeouts.search, "search_summary", errors)
+            if response:
+                responses["summary"] = response
+
+    # Its budget runs from the start of the turn; if it already finished while the summary ran, no wait at all
+    response = await _within(question_search, started + timeouts.search, "search_question", errors)
+    if response:
+        responses["question"] = response
+
+    if not responses and errors:
+        raise errors[-1]
+    # Summary results first: they carry the context of the conversation
+    merged = merge_search_results([responses[source] for source in ("summary", "question") if source in responses],
+                                  max_results)
+    timings["total"] = time.monotonic() - started
+    return RetrievalResult(
+        context=json.dumps({"results": merged}) if merged else NO_RESULTS,
+        summary=summary,
+        sources=[source for source in ("summary", "question") if source in responses],
+        timings=timings,
+    )
+
+
+def run_retrieval(question: str, search: Callable[[str], str], summarize: Optional[Callable[[], str]] = None,
+                  timeouts: StageTimeouts = StageTimeouts(), max_results: int = 6) -> RetrievalResult:
+    """Blocking entry point for the Streamlit script thread."""
+    return asyncio.run(retrieve(question, search, summarize, timeouts, max_results))
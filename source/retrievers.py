@@ -0,0 +1,36 @@
+from typing import List, Optional
+
+from metrics import span
+
+
+class Retriever:
+    """Chunk search backend for the chatbot.
+
+    search() returns the same JSON text as svc.search(...).json(): an object
+    whose "results" list holds one {column: value} dict per chunk, best first.
+    category None means no filter.
+    """
+
+    def search(self, query: str, columns: List[str], limit: int, category: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+
+class CortexSearchRetriever(Retriever):
+    """drug_data_search_service, called on a session from the chat resource pool."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def search(self, query: str, columns: List[str], limit: int, category: Optional[str] = None) -> str:
+        with span("cortex_search"):
+            return self._search(query, columns, limit, category)
+
+    def _search(self, query: str, columns: List[str], limit: int, category: Optional[str] = None) -> str:
+        if category is None:
+            response = self.pool.call(lambda resources: resources.svc.search(query, columns, limit=limit))
+        else:
+            filter_obj = {"@eq": {"category": category}}
+            response = self.pool.call(
+                lambda resources: resources.svc.search(query, columns, filter=filter_obj, limit=limit)
+            )
+        return response.json()
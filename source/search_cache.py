@@ -0,0 +1,83 @@
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, Optional
+
+from initiate_cortex import CORTEX_SEARCH_SERVICE, SEARCH_TARGET_LAG_SECONDS
+from text_utils import normalize_query
+from ttl_cache import TTLCache
+
+
+def search_data_timestamp(session) -> Optional[str]:
+    """data_timestamp of the search service, which moves forward each time its index is refreshed."""
+    rows = session.sql(f"DESCRIBE CORTEX SEARCH SERVICE {CORTEX_SEARCH_SERVICE}").collect()
+    if not rows:
+        return None
+    for name, value in rows[0].as_dict().items():
+        if name.lower() == "data_timestamp":
+            return str(value)
+    return None
+
+
+class SearchCache:
+    """LRU + TTL cache of Cortex Search responses, shared by every chat session.
+
+    An entry never outlives the service's TARGET_LAG, after which the index may
+    have been rebuilt from new drug_data rows. When a generation callable is
+    given (see search_data_timestamp), it is polled at most every
+    generation_check_interval seconds and the whole cache is dropped as soon as
+    the index reports a new refresh.
+    """
+
+    def __init__(self, ttl_seconds: float = SEARCH_TARGET_LAG_SECONDS, max_entries: int = 2048,
+                 generation: Optional[Callable[[], Optional[str]]] = None,
+                 generation_check_interval: float = 300):
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._generation = generation
+        self.generation_check_interval = generation_check_interval
+        self._current_generation: Optional[str] = None
+        self._checked_at = 0.0
+        self._check_lock = threading.Lock()
+        self.invalidations = 0
+
+    @staticmethod
+    def cache_key(query: str, category: Optional[str], limit: int, columns: Iterable[str]) -> Hashable:
+        return normalize_query(query), category, limit, tuple(columns)
+
+    def _check_generation(self) -> None:
+        if self._generation is None or time.monotonic() - self._checked_at < self.generation_check_interval:
+            return
+        # One caller polls; the others carry on with the cache as it is
+        if not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            generation = self._generation()
+            if generation != self._current_generation:
+                if self._current_generation is not None:
+                    self._cache.clear()
+                    self.invalidations += 1
+                self._current_generation = generation
+        except Exception as e:
+            print(f"Could not check the search index refresh time: {e}")
+        finally:
+            self._check_lock.release()
+
+    def get_or_search(self, query: str, category: Optional[str], limit: int, columns: Iterable[str],
+                      search: Callable[[], str]) -> str:
+        """Return the cached response for this search, or run search() and cache what it returns."""
+        self._check_generation()
+        key = self.cache_key(query, category, limit, columns)
+        result = self._cache.get(key)
+        if result is None:
+            result = search()
+            self._cache.set(key, result)
+        return result
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, object]:
+        stats = self._cache.stats()
+        stats["invalidations"] = self.invalidations
+        stats["index_refreshed_at"] = self._current_generation
+        return stats
@@ -0,0 +1,304 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional
+
+SHARD_TABLE = "crawl_shards"
+
+# Shard states
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+
+
+@dataclass
+class Shard:
+    shard_id: int
+    start_id: int
+    end_id: int  # inclusive
+    version: int
+    attempts: int = 0
+
+    def drug_ids(self) -> range:
+        return range(self.start_id, self.end_id + 1)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SnowflakeLeaseStore:
+    """Keeps the lease table in the warehouse, next to drug_data, via the shared connection pool."""
+
+    placeholder = "%s"
+    number_type = "NUMBER"
+    # Shards registered per statement; every row is five bound values
+    shard_batch = 1000
+
+    def __init__(self, pool=None):
+        if pool is None:
+            from snowflake_pool import get_connection_pool
+
+            pool = get_connection_pool()
+        self.pool = pool
+
+    @contextmanager
+    def connection(self) -> Iterator:
+        with self.pool.acquire() as connection:
+            yield connection
+
+    def close(self) -> None:
+        pass
+
+    def insert_shards_sql(self, values: str) -> str:
+        """One MERGE for the whole batch.
+
+        Snowflake does not enforce the primary key, and concurrent INSERT ... WHERE NOT
+        EXISTS statements can both pass the check; MERGE statements on one table are
+        serialized, so workers registering the same range never duplicate a shard.
+        executemany() is not an option either: the connector rewrites every INSERT it
+        is given into a multi-row VALUES insert and fails on INSERT ... SELECT.
+        """
+        return f"""
+            MERGE INTO {SHARD_TABLE} t
+            USING (
+                SELECT column1 AS shard_id, column2 AS start_id, column3 AS end_id,
+                       column4 AS status, column5 AS updated_at
+                FROM VALUES {values}
+            ) s
+            ON t.shard_id = s.shard_id
+            WHEN NOT MATCHED THEN INSERT (shard_id, start_id, end_id, status, version, attempts, updated_at)
+                VALUES (s.shard_id, s.start_id, s.end_id, s.status, 0, 0, s.updated_at)
+        """
+
+
+class SQLiteLeaseStore:
+    """Local stand-in for the warehouse lease table, for tests and single-host runs.
+
+    Several processes may share one file; SQLite serializes the writers.
+    """
+
+    placeholder = "?"
+    number_type = "INTEGER"
+    # Stays under SQLite's default limit of 999 bound values per statement
+    shard_batch = 150
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+    @contextmanager
+    def connection(self) -> Iterator:
+        with self._lock:
+            yield self._db
+
+    def close(self) -> None:
+        self._db.close()
+
+    def insert_shards_sql(self, values: str) -> str:
+        # SQLite enforces the primary key, so existing shards are simply skipped
+        return f"""
+            INSERT OR IGNORE INTO {SHARD_TABLE} (shard_id, start_id, end_id, status, version, attempts, updated_at)
+            SELECT column1, column2, column3, column4, 0, 0, column5 FROM (VALUES {values})
+        """
+
+
+class ShardCoordinator:
+    """Splits the compound ID space into shards and leases them to crawl workers.
+
+    Every shard row carries a version that is bumped on each state change. A
+    worker claims a shard with an UPDATE conditioned on the version it read, so
+    when two workers race for the same row exactly one update matches and the
+    loser simply tries the next candidate; no locks are held between statements.
+    A claimed shard carries a lease deadline (epoch seconds) that the owner
+    pushes forward from a heartbeat thread. Shards whose deadline has passed,
+    because their worker crashed or lost its connection, are claimable again.
+    """
+
+    def __init__(self, store, worker_id: Optional[str] = None, lease_seconds: float = 300,
+                 heartbeat_interval: Optional[float] = None, max_attempts: int = 5):
+        self.store = store
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval or lease_seconds / 3
+        self.max_attempts = max_attempts
+        self.create_table()
+
+    def _sql(self, sql: str) -> str:
+        return sql.replace("?", self.store.placeholder)
+
+    def _execute(self, sql: str, params=()) -> int:
+        """Run one statement in its own transaction and return the affected row count."""
+        with self.store.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(self._sql(sql), params)
+                rowcount = cursor.rowcount
+                connection.commit()
+                return rowcount
+            finally:
+                cursor.close()
+
+    def _query(self, sql: str, params=()) -> List[tuple]:
+        with self.store.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(self._sql(sql), params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def create_table(self) -> None:
+        number = self.store.number_type
+        self._execute(f"""
+            CREATE TABLE IF NOT EXISTS {SHARD_TABLE} (
+                shard_id {number} PRIMARY KEY,
+                start_id {number} NOT NULL,
+                end_id {number} NOT NULL,
+                status VARCHAR(16) NOT NULL,
+                owner VARCHAR(200),
+                lease_expires {number},
+                version {number} NOT NULL,
+                attempts {number} NOT NULL,
+                updated_at {number} NOT NULL
+            )
+        """)
+
+    def create_shards(self, drug_id_start: int, drug_id_limit: int, shard_size: int = 1000) -> int:
+        """Register the shards covering [drug_id_start, drug_id_limit]; existing shards are kept as they are.
+
+        Shard boundaries are aligned to multiples of shard_size, so workers started
+        with overlapping ranges agree on them.
+        """
+        now = int(time.time())
+        rows = []
+        first = drug_id_start - drug_id_start % shard_size
+        for shard_start in range(first, drug_id_limit + 1, shard_size):
+            start_id = max(shard_start, drug_id_start)
+            end_id = min(shard_start + shard_size - 1, drug_id_limit)
+            rows.append((shard_start, start_id, end_id, PENDING, now))
+        batch = self.store.shard_batch
+        for i in range(0, len(rows), batch):
+            chunk = rows[i:i + batch]
+            values = ", ".join(["(?, ?, ?, ?, ?)"] * len(chunk))
+            self._execute(self.store.insert_shards_sql(values), [value for row in chunk for value in row])
+        return len(rows)
+
+    def claim(self, candidates: int = 10, rounds: int = 20) -> Optional[Shard]:
+        """Lease the next free (or expired) shard to this worker, or return None when none is left.
+
+        Gives up (and returns None) after rounds lookups in which every candidate was lost to another worker.
+        """
+        for _ in range(rounds):
+            now = int(time.time())
+            rows = self._query(f"""
+                SELECT shard_id, start_id, end_id, version, attempts FROM {SHARD_TABLE}
+                WHERE attempts < ?
+                  AND (status = ? OR (status = ? AND lease_expires < ?))
+                ORDER BY shard_id
+                LIMIT {int(candidates)}
+            """, (self.max_attempts, PENDING, CLAIMED, now))
+            if not rows:
+                return None
+            for shard_id, start_id, end_id, version, attempts in rows:
+                claimed = self._execute(f"""
+                    UPDATE {SHARD_TABLE}
+                    SET status = ?, owner = ?, lease_expires = ?, version = version + 1,
+                        attempts = attempts + 1, updated_at = ?
+                    WHERE shard_id = ? AND version = ?
+                """, (CLAIMED, self.worker_id, now + int(self.lease_seconds), now, shard_id, version))
+                if claimed == 1:
+                    return Shard(int(shard_id), int(start_id), int(end_id), int(version) + 1, int(attempts) + 1)
+                if claimed > 1:
+                    # Duplicate rows for one shard; the lease cannot be held, so skip it until the rows expire
+                    print(f"Shard {shard_id} has {claimed} rows in {SHARD_TABLE}; skipping it.")
+            # Every candidate was taken by another worker in the meantime; look again
+        print(f"Worker {self.worker_id} lost every claim race for {rounds} rounds; giving up.")
+        return None
+
+    def heartbeat(self, shard: Shard) -> bool:
+        """Extend the lease; False means it expired and the shard now belongs to someone else."""
+        now = int(time.time())
+        extended = self._execute(f"""
+            UPDATE {SHARD_TABLE} SET lease_expires = ?, updated_at = ?
+            WHERE shard_id = ? AND owner = ? AND version = ? AND status = ?
+        """, (now + int(self.lease_seconds), now, shard.shard_id, self.worker_id, shard.version, CLAIMED))
+        return extended == 1
+
+    def _finish(self, shard: Shard, status: str) -> bool:
+        updated = self._execute(f"""
+            UPDATE {SHARD_TABLE}
+            SET status = ?, owner = NULL, lease_expires = NULL, version = version + 1, updated_at = ?
+            WHERE shard_id = ? AND owner = ? AND version = ?
+        """, (status, int(time.time()), shard.shard_id, self.worker_id, shard.version))
+        return updated == 1
+
+    def complete(self, shard: Shard) -> bool:
+        return self._finish(shard, DONE)
+
+    def release(self, shard: Shard) -> bool:
+        """Hand the shard back right away instead of waiting for its lease to expire."""
+        return self._finish(shard, PENDING)
+
+    def expire(self) -> int:
+        """Return every shard with a lapsed lease to the pending pool; claim() also picks them up directly."""
+        now = int(time.time())
+        return self._execute(f"""
+            UPDATE {SHARD_TABLE}
+            SET status = ?, owner = NULL, lease_expires = NULL, version = version + 1, updated_at = ?
+            WHERE status = ? AND lease_expires < ?
+        """, (PENDING, now, CLAIMED, now))
+
+    def counts(self) -> dict:
+        return {status: int(count) for status, count in
+                self._query(f"SELECT status, COUNT(*) FROM {SHARD_TABLE} GROUP BY status")}
+
+    @contextmanager
+    def hold(self, shard: Shard, finished: Optional[Callable[[], bool]] = None) -> Iterator[threading.Event]:
+        """Keep the lease alive while the block runs, then complete the shard or release it on error.
+
+        Yields an event that is set if a heartbeat finds the lease lost. Work done
+        after that point is not wasted: inserts are idempotent upserts, so a
+        shard processed twice produces no duplicate rows. When finished() returns
+        False after the block (some IDs failed or never got through), the shard is
+        released rather than completed, so it is claimed again until max_attempts.
+        """
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def beat() -> None:
+            while not stop.wait(self.heartbeat_interval):
+                try:
+                    if not self.heartbeat(shard):
+                        print(f"Lost the lease on shard {shard.shard_id}.")
+                        lost.set()
+                        return
+                except Exception as e:
+                    print(f"Heartbeat for shard {shard.shard_id} failed: {e}")
+
+        thread = threading.Thread(target=beat, name=f"lease-{shard.shard_id}", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        except BaseException:
+            stop.set()
+            thread.join()
+            self.release(shard)
+            raise
+        stop.set()
+        thread.join()
+        if lost.is_set():
+            return
+        if finished is not None and not finished():
+            print(f"Shard {shard.shard_id} has unfinished IDs; releasing it for another attempt.")
+            self.release(shard)
+        elif not self.complete(shard):
+            print(f"Shard {shard.shard_id} was taken over before it could be completed.")
+
+    def close(self) -> None:
+        self.store.close()
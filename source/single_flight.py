@@ -0,0 +1,122 @@
+"""Process-wide coalescing of identical completions, plus a cache of history-free answers.
+
+When several sessions ask the same question at once, each used to pay for its
+own COMPLETE. SingleFlight keys every completion on model + normalized prompt:
+the first caller starts the one backend call, every identical caller that
+arrives while it runs follows the same stream from the first piece, and
+nobody else reaches the backend. The backend is drained on a background
+thread, so a session that goes away mid-answer does not cut the others off.
+Answers to prompts without chat history are also kept for ttl_seconds.
+"""
+import threading
+from typing import Callable, Dict, Hashable, Iterator, List, Optional
+
+from text_utils import normalize_query
+from ttl_cache import TTLCache
+
+
+class _Flight:
+    """One backend call: the pieces so far, readable by any number of followers while it runs."""
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+
+    def publish(self, piece: str) -> None:
+        with self._condition:
+            self.pieces.append(piece)
+            self._condition.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+
+    def follow(self) -> Iterator[str]:
+        position = 0
+        while True:
+            with self._condition:
+                while position == len(self.pieces) and not self.done:
+                    self._condition.wait()
+                pieces = self.pieces[position:]
+                done, error = self.done, self.error
+            for piece in pieces:
+                yield piece
+            position += len(pieces)
+            if done and position == len(self.pieces):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """Coalesces identical in-flight completions and caches history-free answers; shared by all sessions."""
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 512):
+        self._answers = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.backend_calls = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(model: str, prompt: str) -> Hashable:
+        return model, normalize_query(prompt)
+
+    def stream(self, model: str, prompt: str, start: Callable[[str, str], Iterator[str]],
+               cacheable: bool = False) -> Iterator[str]:
+        """Pieces of the answer; start(model, prompt) is only called if no identical call is running or cached.
+
+        cacheable marks a prompt whose answer does not depend on the session, i.e. one without chat history.
+        """
+        key = self.key(model, prompt)
+        if cacheable:
+            answer = self._answers.get(key)
+            if answer is not None:
+                return iter([answer])
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.backend_calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if leader:
+            threading.Thread(target=self._run, args=(key, flight, start, model, prompt, cacheable),
+                             name="single-flight", daemon=True).start()
+        return flight.follow()
+
+    def _run(self, key: Hashable, flight: _Flight, start: Callable[[str, str], Iterator[str]], model: str,
+             prompt: str, cacheable: bool) -> None:
+        error = None
+        try:
+            for piece in start(model, prompt):
+                flight.publish(piece)
+        except Exception as e:
+            error = e
+        finally:
+            # Cached before the flight is dropped, so no caller in between goes to the backend again
+            if error is None and cacheable and flight.pieces:
+                self._answers.set(key, "".join(flight.pieces))
+            # Later callers start a new call (or hit the cache) instead of joining a finished one
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.finish(error)
+
+    def clear(self) -> None:
+        self._answers.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            in_flight = len(self._flights)
+        return {
+            "backend_calls": self.backend_calls,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+            "answer_cache": self._answers.stats(),
+        }
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import snowflake.connector
+from dotenv import load_dotenv
+from snowflake.snowpark import Session
+
+from metrics import span
+
+load_dotenv()
+
+
+def snowflake_config() -> Dict[str, Optional[str]]:
+    return {
+        "user": os.getenv("SNOWFLAKE_USER"),
+        "password": os.getenv("SNOWFLAKE_PASSWORD"),
+        "account": os.getenv("SNOWFLAKE_ACCOUNT"),
+        "warehouse": os.getenv("SNOWFLAKE_WAREHOUSE"),
+        "database": os.getenv("SNOWFLAKE_DATABASE"),
+        "schema": os.getenv("SNOWFLAKE_SCHEMA"),
+    }
+
+
+def create_connection(max_retries: int = 3, retry_delay: float = 5):
+    """Establish a connection to Snowflake with retry logic."""
+    for attempt in range(max_retries):
+        try:
+            conn = snowflake.connector.connect(**snowflake_config())
+            print("Connected to Snowflake successfully.")
+            return conn
+        except Exception as e:
+            if attempt < max_retries - 1:
+                print(f"Connection attempt {attempt + 1} failed: {e}. Retrying in {retry_delay} seconds...")
+                time.sleep(retry_delay)
+            else:
+                raise Exception(f"Failed to connect to Snowflake after {max_retries} attempts: {e}")
+
+
+def create_session() -> Session:
+    return Session.builder.configs(snowflake_config()).create()
+
+
+def connection_is_healthy(conn) -> bool:
+    if conn.is_closed():
+        return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        return True
+    except Exception:
+        return False
+    finally:
+        cursor.close()
+
+
+def session_is_healthy(session: Session) -> bool:
+    try:
+        session.sql("SELECT 1").collect()
+        return True
+    except Exception:
+        return False
+
+
+class ResourcePool:
+    """Thread-safe pool of reusable connections or sessions.
+
+    Idle resources that have not been used for health_check_interval seconds are
+    checked before being handed out, and a resource whose user raised is only put
+    back if it still passes the health check; otherwise it is closed and the next
+    acquire() reconnects.
+    """
+
+    def __init__(
+        self,
+        create: Callable[[], Any],
+        health_check: Callable[[Any], bool] = lambda resource: True,
+        close: Callable[[Any], None] = lambda resource: resource.close(),
+        max_size: int = 4,
+        acquire_timeout: float = 60,
+        health_check_interval: float = 60,
+    ):
+        self._create = create
+        self._health_check = health_check
+        self._close = close
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._idle: List[tuple] = []  # (resource, last_used)
+        self._size = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def acquire(self) -> Iterator[Any]:
+        with span("session_acquire"):
+            resource = self._checkout()
+        try:
+            yield resource
+        except Exception:
+            self._checkin(resource, healthy=self._is_healthy(resource))
+            raise
+        else:
+            self._checkin(resource, healthy=True)
+
+    def call(self, func: Callable[[Any], Any], retries: int = 1) -> Any:
+        """Run func(resource) on a pooled resource, retrying on a fresh one if the failure broke it.
+
+        An expired session or dropped connection fails the health check and is
+        replaced transparently; an error on a healthy resource (a bad query) is
+        raised straight away.
+        """
+        for attempt in range(retries + 1):
+            with span("session_acquire"):
+                resource = self._checkout()
+            try:
+                result = func(resource)
+            except Exception:
+                healthy = self._is_healthy(resource)
+                self._checkin(resource, healthy=healthy)
+                if healthy or attempt == retries:
+                    raise
+                print(f"Pooled resource failed its health check; retrying with a new one (attempt {attempt + 1}).")
+                continue
+            self._checkin(resource, healthy=True)
+            return result
+
+    def _checkout(self) -> Any:
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            while True:
+                if self._idle:
+                    resource, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    resource, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    raise TimeoutError(f"No pooled resource became available within {self.acquire_timeout} seconds.")
+
+        if resource is not None and time.monotonic() - last_used > self.health_check_interval:
+            if not self._is_healthy(resource):
+                self._discard(resource, release_slot=False)
+                resource = None
+        if resource is None:
+            try:
+                resource = self._create()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+        return resource
+
+    def _checkin(self, resource: Any, healthy: bool) -> None:
+        if not healthy:
+            self._discard(resource)
+            return
+        with self._condition:
+            self._idle.append((resource, time.monotonic()))
+            self._condition.notify()
+
+    def _is_healthy(self, resource: Any) -> bool:
+        try:
+            return self._health_check(resource)
+        except Exception:
+            return False
+
+    def _discard(self, resource: Any, release_slot: bool = True) -> None:
+        try:
+            self._close(resource)
+        except Exception:
+            pass
+        if release_slot:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+
+    def close(self) -> None:
+        """Close idle resources; the pool stays usable and reconnects on the next acquire()."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for resource, _ in idle:
+            try:
+                self._close(resource)
+            except Exception:
+                pass
+
+
+_connection_pool: Optional[ResourcePool] = None
+_session_pool: Optional[ResourcePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> ResourcePool:
+    """Process-wide pool of snowflake.connector connections."""
+    global _connection_pool
+    with _pool_lock:
+        if _connection_pool is None:
+            _connection_pool = ResourcePool(create_connection, connection_is_healthy)
+        return _connection_pool
+
+
+def get_session_pool() -> ResourcePool:
+    """Process-wide pool of Snowpark sessions."""
+    global _session_pool
+    with _pool_lock:
+        if _session_pool is None:
+            _session_pool = ResourcePool(create_session, session_is_healthy)
+        return _session_pool
+
+
+def set_connection_pool(pool: Optional[ResourcePool]) -> None:
+    """Swap the process-wide connection pool, e.g. for a local fake."""
+    global _connection_pool
+    with _pool_lock:
+        _connection_pool = pool
+
+
+def set_session_pool(pool: Optional[ResourcePool]) -> None:
+    """Swap the process-wide session pool, e.g. for a local fake."""
+    global _session_pool
+    with _pool_lock:
+        _session_pool = pool
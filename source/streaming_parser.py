@@ -0,0 +1,130 @@
+"""Incremental PUG-View parsing that keeps only the wanted top-level sections.
+
+json.loads() materialises the whole compound record as Python objects, often
+several MB of dicts per record, although only the StringWithMarkup strings of
+two sections are kept. SectionStreamParser consumes the raw body in chunks as
+they arrive and holds on to nothing but the record title, the strings of the
+sections in toc_headings and the synonym lists, producing exactly what
+extract_sections() and extract_synonyms() do.
+"""
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+import ijson
+
+from pubchem_parser import (
+    NAMES_SECTION, SYNONYM_HEADINGS, SYNONYMS_SECTION, TOC_HEADINGS, DrugDetails, drug_from_sections, select_synonyms,
+)
+
+CHUNK_SIZE = 64 * 1024
+
+_TITLE = "Record.RecordTitle"
+_NUMBER = "Record.RecordNumber"
+_SECTION = "Record.Section.item"
+_HEADING = "Record.Section.item.TOCHeading"
+# Same depth extract_information() reads: strings of the direct subsections only
+_STRING = "Record.Section.item.Section.item.Information.item.Value.StringWithMarkup.item.String"
+# Names and Identifiers > Synonyms > MeSH Entry Terms / Depositor-Supplied Synonyms
+_SUB = "Record.Section.item.Section.item"
+_SUB_HEADING = "Record.Section.item.Section.item.TOCHeading"
+_LIST = "Record.Section.item.Section.item.Section.item"
+_LIST_HEADING = "Record.Section.item.Section.item.Section.item.TOCHeading"
+_SYNONYM = "Record.Section.item.Section.item.Section.item.Information.item.Value.StringWithMarkup.item.String"
+_WANTED = {_TITLE, _NUMBER, _SECTION, _HEADING, _STRING, _SUB, _SUB_HEADING, _LIST, _LIST_HEADING, _SYNONYM, "Record"}
+
+
+class SectionStreamParser:
+    """Push parser: feed() body chunks in order, then close() for the extracted sections.
+
+    Strings of a section are buffered only until its TOCHeading is known, and
+    dropped as soon as the heading turns out not to be wanted.
+    """
+
+    def __init__(self, toc_headings: Iterable[str] = TOC_HEADINGS):
+        self.toc_headings = set(toc_headings)
+        self._events = ijson.sendable_list()
+        self._coro = ijson.parse_coro(self._events)
+        self._has_record = False
+        self.record_title: Optional[str] = None
+        self.record_number: Optional[int] = None
+        self.details: Dict[str, str] = {}
+        self._heading: Optional[str] = None
+        self._strings: List[str] = []
+        self._sub_heading: Optional[str] = None
+        self._list_heading: Optional[str] = None
+        self.synonym_lists: Dict[str, List[str]] = {}
+
+    def feed(self, chunk: bytes) -> None:
+        self._coro.send(chunk)
+        self._consume()
+
+    def _consume(self) -> None:
+        for prefix, event, value in self._events:
+            if prefix not in _WANTED:
+                continue
+            if prefix == _STRING:
+                if self._heading is None or self._heading in self.toc_headings:
+                    text = value.strip()
+                    if text:
+                        self._strings.append(text)
+            elif prefix == _HEADING:
+                self._heading = value
+                if value not in self.toc_headings:
+                    self._strings = []
+            elif prefix == _SYNONYM:
+                if (self._heading == NAMES_SECTION and self._sub_heading == SYNONYMS_SECTION
+                        and self._list_heading in SYNONYM_HEADINGS):
+                    self.synonym_lists.setdefault(self._list_heading, []).append(value)
+            elif prefix == _SUB_HEADING:
+                self._sub_heading = value
+            elif prefix == _LIST_HEADING:
+                self._list_heading = value
+            elif prefix == _LIST:
+                if event == "end_map":
+                    self._list_heading = None
+            elif prefix == _SUB:
+                if event == "end_map":
+                    self._sub_heading = None
+            elif prefix == _SECTION:
+                if event == "end_map":
+                    if self._heading in self.toc_headings and self._strings:
+                        self.details[self._heading] = " ".join(self._strings)
+                    self._heading = None
+                    self._sub_heading = None
+                    self._strings = []
+            elif prefix == _TITLE:
+                self.record_title = value
+            elif prefix == _NUMBER:
+                self.record_number = int(value)
+            elif prefix == "Record" and event == "start_map":
+                self._has_record = True
+        del self._events[:]
+
+    def close(self) -> Optional[Tuple[str, Dict[str, str]]]:
+        """Finish parsing; same result as extract_sections() on the decoded body. Raises on invalid JSON."""
+        self._coro.close()
+        self._consume()
+        if not self._has_record:
+            return None
+        record_title = self.record_title or "Unknown Title"
+        if record_title == "Unknown Title":
+            return None
+        return record_title, self.details
+
+    def drug(self) -> Optional[DrugDetails]:
+        """close() and build DrugDetails like parse_drug(), or None if there is no drug section."""
+        extracted = self.close()
+        if extracted is None:
+            return None
+        return drug_from_sections(extracted, self.record_number, select_synonyms(extracted[0], self.synonym_lists))
+
+
+def parse_file(f: BinaryIO, toc_headings: Iterable[str] = TOC_HEADINGS,
+               chunk_size: int = CHUNK_SIZE) -> Optional[DrugDetails]:
+    """Stream-parse a (possibly gzip) file object of one PUG-View record."""
+    parser = SectionStreamParser(toc_headings)
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    return parser.drug()
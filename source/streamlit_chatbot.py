@@ -1,54 +1,34 @@
-import snowflake.snowpark as snowpark
 import streamlit as st
 import os
+import time
 import pandas as pd
 import pdb
 from dotenv import load_dotenv
-from snowflake.core import Root
+
+from category_catalog import CategoryCatalog, load_categories
+from context_packer import pack_context, token_budget
+from conversation_memory import ConversationMemory
+from chat_resources import get_chat_pool, with_chat_resources
+from metrics import REGISTRY, Trace, span
+from drug_name_index import DrugNameIndex, NameMatchRetriever, chunks_by_title, load_drug_names
+from cortex_stream import CompletionClient, CortexRestClient, FallbackCompletionClient, SqlCompletionClient
+from retrievers import CortexSearchRetriever
+from retrieval import StageTimeouts, run_retrieval
+from search_cache import SearchCache, search_data_timestamp
+from single_flight import SingleFlight
+from token_counter import count_tokens
 
 load_dotenv()
 pd.set_option("max_colwidth", None)
 
 NUM_CHUNKS = 3  
-slide_window = 7
-
-# SNOWFLAKE_USER = os.getenv('SNOWFLAKE_USER')
-# SNOWFLAKE_PASSWORD = os.getenv('SNOWFLAKE_PASSWORD')
-# SNOWFLAKE_ACCOUNT = os.getenv('SNOWFLAKE_ACCOUNT')
-# SNOWFLAKE_DATABASE = os.getenv('SNOWFLAKE_DATABASE')
-# SNOWFLAKE_SCHEMA = os.getenv('SNOWFLAKE_SCHEMA')
-# SNOWFLAKE_WAREHOUSE = os.getenv("SNOWFLAKE_WAREHOUSE")
-
-SNOWFLAKE_USER = st.secrets["SNOWFLAKE_USER"]
-SNOWFLAKE_PASSWORD = st.secrets["SNOWFLAKE_PASSWORD"]
-SNOWFLAKE_ACCOUNT = st.secrets["SNOWFLAKE_ACCOUNT"]
-SNOWFLAKE_DATABASE = st.secrets["SNOWFLAKE_DATABASE"]
-SNOWFLAKE_SCHEMA = st.secrets["SNOWFLAKE_SCHEMA"]
-SNOWFLAKE_WAREHOUSE = st.secrets["SNOWFLAKE_WAREHOUSE"]
-
-def create_snowpark_session():
-    try:
-        session = snowpark.Session.builder.configs({
-            "user": SNOWFLAKE_USER,
-            "password": SNOWFLAKE_PASSWORD,
-            "account": SNOWFLAKE_ACCOUNT,
-            "warehouse": SNOWFLAKE_WAREHOUSE,
-            "database": SNOWFLAKE_DATABASE,
-            "schema": SNOWFLAKE_SCHEMA
-        }).create()
-        return session
-    except Exception as e:
-        st.error(f"Failed to create Snowpark session: {e}")
-        raise
-
-session = create_snowpark_session()
-root = Root(session)
-
-CORTEX_SEARCH_DATABASE = SNOWFLAKE_DATABASE
-CORTEX_SEARCH_SCHEMA = SNOWFLAKE_SCHEMA
-CORTEX_SEARCH_SERVICE = "drug_data_search_service" 
-svc = root.databases[CORTEX_SEARCH_DATABASE].schemas[CORTEX_SEARCH_SCHEMA].cortex_search_services[CORTEX_SEARCH_SERVICE]
-
+CATEGORY_TTL_SECONDS = 600
+RETRIEVAL_TIMEOUTS = StageTimeouts(summary=10.0, search=5.0)
+# "cortex" (Cortex Search) or "local" (in-process index built with local_retriever.py)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "cortex")
+# The drug-name index is rebuilt this often, to pick up newly ingested drugs
+NAME_INDEX_TTL_SECONDS = 3600
+ANSWER_CACHE_TTL_SECONDS = 3600
 
 COLUMNS = [
     "chunk",
@@ -56,90 +36,140 @@ COLUMNS = [
     "record_title"
 ]
 
+@st.cache_resource
+def get_category_catalog() -> CategoryCatalog:
+    # Background refreshes run outside the script thread, so they use the pool object directly
+    pool = get_chat_pool()
+    return CategoryCatalog(
+        lambda: pool.call(lambda resources: load_categories(resources.session)),
+        ttl_seconds=CATEGORY_TTL_SECONDS,
+    )
+
+@st.cache_resource
+def get_search_cache() -> SearchCache:
+    pool = get_chat_pool()
+    return SearchCache(generation=lambda: pool.call(lambda resources: search_data_timestamp(resources.session)))
+
+@st.cache_resource
+def get_search_backend():
+    """The configured chunk search; the local one holds the embedding model, so it is built once."""
+    if RETRIEVER_BACKEND == "local":
+        from local_retriever import LocalRetriever
+
+        return LocalRetriever()
+    return CortexSearchRetriever(get_chat_pool())
+
+@st.cache_resource(ttl=NAME_INDEX_TTL_SECONDS)
+def get_name_index() -> DrugNameIndex:
+    if RETRIEVER_BACKEND == "local":
+        return DrugNameIndex(get_search_backend().drug_names())
+    pool = get_chat_pool()
+    return DrugNameIndex(pool.call(lambda resources: load_drug_names(resources.session)))
+
+@st.cache_resource
+def get_name_match_retriever() -> NameMatchRetriever:
+    backend = get_search_backend()
+    if RETRIEVER_BACKEND == "local":
+        chunks_for = backend.chunks_for_title
+    else:
+        pool = get_chat_pool()
+        chunks_for = lambda record_title: pool.call(lambda resources: chunks_by_title(resources.session, record_title))
+    return NameMatchRetriever(get_name_index(), chunks_for, backend)
+
+def get_retriever() -> NameMatchRetriever:
+    """Questions that name a known drug get its chunks by key; the others go to the configured backend."""
+    retriever = get_name_match_retriever()
+    # Only the name index expires, to pick up newly ingested drugs; the backend and chunk cache stay
+    retriever.index = get_name_index()
+    return retriever
+
+@st.cache_resource
+def get_single_flight() -> SingleFlight:
+    return SingleFlight(ttl_seconds=ANSWER_CACHE_TTL_SECONDS)
+
 def init_messages():
     if st.session_state.clear_conversation or "messages" not in st.session_state:
         st.session_state.messages = []
+        st.session_state.memory = ConversationMemory()
 
 def config_options():
     st.sidebar.selectbox('Select your model:', ('mixtral-8x7b', 'snowflake-arctic', 'mistral-large2', 'mistral-7b', 'mistral-large'), key="model_name")
 
-    categories = session.sql("SELECT DISTINCT category FROM drug_data").collect()
-    cat_list = ['ALL'] + [cat.CATEGORY for cat in categories]
+    cat_list = ['ALL'] + get_category_catalog().get()
 
     st.sidebar.selectbox('Select the drug category:', cat_list, key="category_value")
     st.sidebar.checkbox('Do you want that I remember the chat history?', key="use_chat_history", value = True)
     st.sidebar.checkbox('Debug: Click to see summary generated of previous conversation', key="debug", value=True)
     st.sidebar.button("Start Over", key="clear_conversation", on_click=init_messages)
     st.sidebar.expander("Session State").write(st.session_state)
-
-def get_similar_chunks_search_service(query):
-    if st.session_state.category_value == "ALL":
-        response = svc.search(query, COLUMNS, limit=NUM_CHUNKS)
-    else: 
-        filter_obj = {"@eq": {"category": st.session_state.category_value}}
-        response = svc.search(query, COLUMNS, filter=filter_obj, limit=NUM_CHUNKS)
-
-    if not response.json():
-            return "Sorry, I don't have data for that category."
-
-    return response.json()
-
-def get_chat_history():
-    chat_history = []
-    
-    start_index = max(0, len(st.session_state.messages) - slide_window)
-    for i in range (start_index , len(st.session_state.messages) -1):
-         chat_history.append(st.session_state.messages[i])
-
-    return chat_history
-
-def summarize_question_with_history(chat_history, question):
-# To get the right context, use the LLM to first summarize the previous conversation
-# This will be used to get embeddings and find similar chunks in the docs for context
-
-    prompt = f"""
-        Based on the chat history below and the question, generate a query that extend the question
-        with the chat history provided. The query should be in natual language. 
-        Answer with only the query. Do not add any explanation.
-        
-        <chat_history>
-        {chat_history}
-        </chat_history>
-        <question>
-        {question}
-        </question>
-        """
-    
-    query = session.sql(f"""
-        SELECT TRIM(SNOWFLAKE.CORTEX.COMPLETE(
-            $${st.session_state.model_name}$$,
-            $${prompt}$$
-        ), '\\n') AS summary
-    """)
-    result = query.collect()
-
-    if result:
-        summary = result[0]["SUMMARY"]
-        if st.session_state.debug:
-            st.sidebar.text("Summary to be used to find similar chunks in the docs:")
-            st.sidebar.caption(summary)
-        return summary
-    else:
-        return "Unable to generate summary"
+    st.sidebar.expander("Search cache").write(get_search_cache().stats())
+    st.sidebar.expander("Drug name lookup").write(get_retriever().stats())
+    st.sidebar.expander("Completions").write(get_single_flight().stats())
+    if "memory" in st.session_state:
+        st.sidebar.expander("Conversation memory").write(st.session_state.memory.stats())
+
+def search_chunks(retriever, search_cache, query, category):
+    """Chunk search through the shared result cache; safe to call off the script thread."""
+    def search():
+        return retriever.search(query, COLUMNS, NUM_CHUNKS, None if category == "ALL" else category)
+
+    if RETRIEVER_BACKEND == "local":
+        # In-process search is cheaper than a cache lookup's bookkeeping
+        return search()
+    return search_cache.get_or_search(query, category, NUM_CHUNKS, COLUMNS, search)
+
+def complete_text(pool, model_name, prompt):
+    sql = "SELECT TRIM(SNOWFLAKE.CORTEX.COMPLETE(?, ?), '\\n') AS completion"
+    result = pool.call(lambda resources: resources.session.sql(sql, params=[model_name, prompt]).collect())
+    return result[0]["COMPLETION"] if result else ""
+
+def show_summary(summary):
+    if st.session_state.debug:
+        st.sidebar.text("Query used to find similar chunks in the docs:")
+        st.sidebar.caption(summary)
+
+def show_token_report(report):
+    if st.session_state.debug:
+        st.sidebar.text("Prompt tokens for this turn:")
+        st.sidebar.json(report, expanded=False)
+
+def retrieve_context(question, memory):
+    """Search for the raw question while the history summary is generated, and merge what comes back."""
+    # Session state and cached resources are read here, in the script thread, before fanning out
+    pool = get_chat_pool()
+    retriever = get_retriever()
+    search_cache = get_search_cache()
+    category = st.session_state.category_value
+    model_name = st.session_state.model_name
+
+    # Only follow-up questions pay for an LLM rewrite; the memory folds new exchanges into it
+    summarize = None
+    if memory is not None and memory.needs_rewrite(question):
+        summarize = lambda: memory.rewrite(question, lambda prompt: complete_text(pool, model_name, prompt))
+    result = run_retrieval(
+        question,
+        lambda query: search_chunks(retriever, search_cache, query, category),
+        summarize,
+        RETRIEVAL_TIMEOUTS,
+        max_results=2 * NUM_CHUNKS,
+    )
+    if result.summary:
+        show_summary(result.summary)
+    return result.context
 
 
 def create_prompt(myquestion):
     if st.session_state.use_chat_history:
-        chat_history = get_chat_history()
-
-        if chat_history != []: 
-                question_summary = summarize_question_with_history(chat_history, myquestion)
-                prompt_context =  get_similar_chunks_search_service(question_summary)
-        else:
-            prompt_context = get_similar_chunks_search_service(myquestion) 
+        memory = st.session_state.memory
+        chat_history = memory.history()
     else:
-        prompt_context = get_similar_chunks_search_service(myquestion)
+        memory = None
         chat_history = ""
+    with span("retrieve"):
+        prompt_context = retrieve_context(myquestion, memory)
+    # Deduplicated, grouped by drug and cut to what the selected model gets for context + history
+    with span("pack_context"):
+        packed = pack_context(prompt_context, chat_history, token_budget(st.session_state.model_name))
         
     prompt = f"""
            You are an expert chat assistance that extracs information from the CONTEXT provided
@@ -156,26 +186,54 @@ def create_prompt(myquestion):
            Only anwer the question if you can extract it from the CONTEXT provideed.
            
            <chat_history>
-           {chat_history}
+           {packed.history}
            </chat_history>
            <context>          
-           {prompt_context}
+           {packed.context}
            </context>
            <question>  
            {myquestion}
            </question>
            Answer: 
            """
-    return prompt
-
+    report = packed.stats()
+    report["prompt_tokens"] = count_tokens(prompt)
+    st.session_state.token_report = report
+    show_token_report(report)
+    return prompt, packed
+
+
+def get_completion_client() -> CompletionClient:
+    # Completions run on a SingleFlight thread, so the pool is looked up here, in the script thread
+    pool = get_chat_pool()
+    sql_client = SqlCompletionClient(
+        lambda cmd, params: pool.call(lambda resources: resources.session.sql(cmd, params=params).collect())
+    )
+    try:
+        rest_client = with_chat_resources(lambda resources: CortexRestClient.from_session(resources.session))
+    except Exception as e:
+        print(f"Cortex REST client unavailable, using SQL completions: {e}")
+        return sql_client
+    return FallbackCompletionClient(rest_client, sql_client)
 
 def complete(myquestion):
-    prompt = create_prompt(myquestion)
-    cmd = """
-        SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?) AS response
-    """
-    df_response = session.sql(cmd, params=[st.session_state.model_name, prompt]).collect()
-    return df_response[0].RESPONSE
+    """Yield the answer in pieces as the model generates it."""
+    prompt, packed = create_prompt(myquestion)
+    # Identical prompts share one COMPLETE; without chat history the answer is the same for every session
+    return get_single_flight().stream(
+        st.session_state.model_name, prompt, get_completion_client().stream, cacheable=not packed.history
+    )
+
+def show_metrics():
+    """Debug panel: where the last turn's time went, and the process-wide metrics for download."""
+    if not st.session_state.debug:
+        return
+    with st.sidebar.expander("Last turn timings", expanded="last_turn" in st.session_state):
+        if "last_turn" in st.session_state:
+            st.caption(f"Total: {st.session_state.last_turn['total_ms']:.0f} ms")
+            st.dataframe(pd.DataFrame(st.session_state.last_turn["spans"]), hide_index=True)
+        st.download_button("Metrics (Prometheus)", REGISTRY.prometheus_text(), "metrics.prom")
+        st.download_button("Metrics (JSON lines)", REGISTRY.json_lines(), "metrics.jsonl")
 
 def main():
     st.title(":speech_balloon: MediScope Chatbot")
@@ -196,12 +254,33 @@ def main():
     
             question = question.replace("'","")
     
-            with st.spinner(f"{st.session_state.model_name} thinking..."):
-                response= complete(question)            
+            with Trace("chat") as trace:
+                with st.spinner(f"{st.session_state.model_name} thinking..."):
+                    pieces = complete(question)
+                    # The spinner only covers the wait for the first piece; the rest renders as it arrives
+                    started = time.perf_counter()
+                    response = next(pieces, "")
+                    trace.record("complete_first_token", time.perf_counter() - started, started)
+                render_seconds = 0.0
+                for piece in pieces:
+                    render_started = time.perf_counter()
+                    message_placeholder.markdown(response.replace("'", "") + "▌")
+                    render_seconds += time.perf_counter() - render_started
+                    response += piece
+                trace.record("complete", time.perf_counter() - started, started)
+                render_started = time.perf_counter()
                 response = response.replace("'", "")
                 message_placeholder.markdown(response)
+                trace.record("render", render_seconds + time.perf_counter() - render_started)
+            st.session_state.last_turn = {
+                "total_ms": round((time.perf_counter() - trace.started) * 1000, 1),
+                "spans": trace.breakdown(),
+            }
 
         st.session_state.messages.append({"role": "assistant", "content": response})
+        st.session_state.memory.add_exchange(question, response)
+
+    show_metrics()
 
 
 if __name__ == "__main__":
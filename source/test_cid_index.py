@@ -0,0 +1,88 @@
+"""CID index built from recorded annotation pages. Run with: python -m unittest test_cid_index"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from cid_index import CidIndex, FixtureFetcher, check_against_store, index_headings
+from pubchem_parser import DRUG_SECTION, NAMES_SECTION
+from raw_store import RawResponseStore
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "annotations")
+
+
+class NoNetworkFetcher:
+    async def __aenter__(self):
+        raise AssertionError("the index was built although it had to be loaded")
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+def record(title, subheadings):
+    sections = [{"TOCHeading": NAMES_SECTION, "Section": []}]
+    if subheadings:
+        sections.append({"TOCHeading": DRUG_SECTION,
+                         "Section": [{"TOCHeading": heading, "Information": []} for heading in subheadings]})
+    return json.dumps({"Record": {"RecordTitle": title, "Section": sections}}).encode()
+
+
+class CidIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cid_index.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_build_walks_every_page_of_every_heading(self):
+        headings = ["Drug Indication", "Therapeutic Uses", "Drug Classes"]
+        index = asyncio.run(CidIndex.build(FixtureFetcher(FIXTURES), headings))
+
+        # Drug Classes has no recorded pages and reads as a 404
+        self.assertEqual(index.cids, [2244, 2519, 3672, 4091, 161613])
+        self.assertEqual(index.headings, headings)
+
+    def test_load_or_build_saves_and_reuses_the_index(self):
+        built = CidIndex.load_or_build(self.path, fetcher=FixtureFetcher(FIXTURES))
+        self.assertEqual(built.headings, index_headings())
+        self.assertEqual(len(built), 5)
+
+        loaded = CidIndex.load_or_build(self.path, fetcher=NoNetworkFetcher())
+        self.assertEqual(loaded.cids, built.cids)
+
+    def test_offline_uses_a_stale_index_and_never_builds(self):
+        self.assertIsNone(CidIndex.load_or_build(self.path, fetcher=NoNetworkFetcher(), offline=True))
+
+        CidIndex([2244, 3672], index_headings(), built_at=time.time() - 365 * 24 * 3600).save(self.path)
+        index = CidIndex.load_or_build(self.path, fetcher=NoNetworkFetcher(), offline=True)
+        self.assertEqual(index.cids, [2244, 3672])
+
+    def test_filter_and_count_between(self):
+        index = CidIndex([2244, 2519, 3672, 4091], index_headings())
+
+        self.assertEqual(list(index.filter(range(2000, 4000))), [2244, 2519, 3672])
+        self.assertEqual(index.count_between(2000, 3999), 3)
+        self.assertEqual(index.count_between(2244, 2244), 1)
+        self.assertEqual(index.count_between(5000, 6000), 0)
+
+    def test_check_reports_records_the_subheadings_miss(self):
+        index = asyncio.run(CidIndex.build(FixtureFetcher(FIXTURES), ["Drug Indication"]))
+        store = RawResponseStore(os.path.join(self.directory.name, "store"))
+        try:
+            store.save(2244, record("Aspirin", ["Drug Indication", "Pharmacology"]))
+            store.save(5793, record("Glucose", []))
+            store.save(9999, record("Unindexed drug", ["Pharmacology", "Mechanism of Action"]))
+            report = check_against_store(index, store)
+        finally:
+            store.close()
+
+        self.assertEqual(report["with_section"], 2)
+        self.assertEqual(report["missed"], [9999])
+        self.assertEqual(report["unlisted_subheadings"], {"Pharmacology": 1, "Mechanism of Action": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
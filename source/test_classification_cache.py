@@ -0,0 +1,112 @@
+"""ClassificationCache with a stubbed classifier. Run with: python -m unittest test_classification_cache"""
+import os
+import tempfile
+import time
+import unittest
+
+from classification_cache import ClassificationCache
+
+MODEL = "mistral-large2"
+
+
+class StubClassifier:
+    """classify_many stand-in: a fixed answer per normalized name, recording every batch it is sent."""
+
+    def __init__(self, answers=None):
+        self.answers = answers or {"aspirin": "Analgesic", "ibuprofen": "Anti-inflammatory", "caffeine": "Other"}
+        self.batches = []
+
+    def __call__(self, names):
+        self.batches.append(list(names))
+        return {name: self.answers[name.strip().lower()] for name in names if name.strip().lower() in self.answers}
+
+    @property
+    def sent(self):
+        return [name for batch in self.batches for name in batch]
+
+
+def offline(names):
+    raise AssertionError(f"classifier called for {names}")
+
+
+class ClassificationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "classifications.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def cache(self, **kwargs):
+        cache = ClassificationCache(MODEL, kwargs.pop("prompt_version", "v1"), path=self.path, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_misses_are_classified_once_then_hit(self):
+        cache = self.cache()
+        classify = StubClassifier()
+
+        first = cache.get_or_classify_many(["Aspirin", "Ibuprofen"], classify)
+        second = cache.get_or_classify_many(["Aspirin", "Ibuprofen", "Caffeine"], classify)
+
+        self.assertEqual(first, {"Aspirin": "Analgesic", "Ibuprofen": "Anti-inflammatory"})
+        self.assertEqual(second["Caffeine"], "Other")
+        self.assertEqual(classify.batches, [["Aspirin", "Ibuprofen"], ["Caffeine"]])
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 3)
+
+    def test_spellings_of_one_name_are_classified_once(self):
+        cache = self.cache()
+        classify = StubClassifier()
+
+        categories = cache.get_or_classify_many(["Aspirin", "aspirin ", "ASPIRIN", "Caffeine"], classify)
+
+        self.assertEqual(classify.sent, ["Aspirin", "Caffeine"])
+        self.assertEqual(categories, {"Aspirin": "Analgesic", "aspirin ": "Analgesic", "ASPIRIN": "Analgesic",
+                                      "Caffeine": "Other"})
+
+    def test_skipped_names_are_not_cached(self):
+        cache = self.cache()
+        classify = StubClassifier()
+
+        self.assertEqual(cache.get_or_classify_many(["Unlisted"], classify), {"Unlisted": "Unknown"})
+        cache.get_or_classify_many(["Unlisted"], classify)
+        self.assertEqual(classify.batches, [["Unlisted"], ["Unlisted"]])
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = self.cache(ttl_seconds=0.2)
+        cache.put("Aspirin", "Analgesic")
+        self.assertEqual(cache.get("Aspirin"), "Analgesic")
+
+        time.sleep(0.3)
+        self.assertIsNone(cache.get("Aspirin"))
+        # Expired rows are deleted, so a fresh process does not see them either
+        self.assertIsNone(self.cache(ttl_seconds=None).get("Aspirin"))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        # A one-entry memory tier sends lookups to SQLite, where access times are kept
+        cache = self.cache(max_entries=50, memory_entries=1)
+        for i in range(99):
+            cache.put(f"drug {i}", "Other")
+        self.assertEqual(cache.get("drug 0"), "Other")
+        cache.put("drug 99", "Other")  # the 100th put trims the table to max_entries
+
+        reopened = self.cache(max_entries=50)
+        self.assertEqual(reopened.get("drug 0"), "Other")
+        self.assertIsNone(reopened.get("drug 1"))
+        self.assertIsNone(reopened.get("drug 50"))
+        self.assertEqual(reopened.get("drug 51"), "Other")
+        self.assertEqual(reopened.get("drug 99"), "Other")
+
+    def test_sqlite_cache_is_reused_offline(self):
+        self.cache().get_or_classify_many(["Aspirin", "Caffeine"], StubClassifier())
+
+        reopened = self.cache()
+        self.assertEqual(reopened.get_or_classify_many(["aspirin", "Caffeine"], offline),
+                         {"aspirin": "Analgesic", "Caffeine": "Other"})
+        # A new prompt version does not reuse answers given to the old prompt
+        self.assertIsNone(self.cache(prompt_version="v2").get("Aspirin"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""PubChemDownloader against a local stub PubChem server. Run with: python -m unittest test_pubchem_downloader"""
+import json
+import os
+import tempfile
+import time
+import unittest
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from pubchem_downloader import PubChemDownloader, RecordNotFound, TokenBucket
+from pubchem_parser import DRUG_SECTION, NAMES_SECTION
+from raw_store import RawResponseStore
+
+
+def record_body(drug_id: int) -> bytes:
+    return json.dumps({"Record": {"RecordNumber": drug_id, "RecordTitle": f"Compound {drug_id}", "Section": [
+        {"TOCHeading": NAMES_SECTION, "Section": []},
+        {"TOCHeading": DRUG_SECTION, "Section": [{"TOCHeading": "Drug Indication", "Information": [
+            {"Value": {"StringWithMarkup": [{"String": f"Indication of compound {drug_id}."}]}}]}]},
+    ]}}).encode()
+
+
+class StubPubChem:
+    """Serves /{cid}/JSON/; a scripted list of statuses per CID is played in order, then records are served."""
+
+    def __init__(self):
+        self.scripts: Dict[int, List[int]] = {}
+        self.etags: Dict[int, str] = {}
+        self.requests: List[Tuple[int, float, Dict[str, str]]] = []
+        self.app = web.Application()
+        self.app.router.add_get("/{cid}/JSON/", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        drug_id = int(request.match_info["cid"])
+        self.requests.append((drug_id, time.monotonic(), dict(request.headers)))
+        script = self.scripts.get(drug_id)
+        if script:
+            return web.Response(status=script.pop(0))
+        etag = self.etags.get(drug_id)
+        if etag is not None and request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        headers = {"ETag": etag} if etag is not None else {}
+        return web.Response(body=record_body(drug_id), content_type="application/json", headers=headers)
+
+    def count(self, drug_id: int) -> int:
+        return sum(1 for requested, _, _ in self.requests if requested == drug_id)
+
+
+class DownloaderTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pubchem = StubPubChem()
+        self.server = TestServer(self.pubchem.app)
+        await self.server.start_server()
+        self.directory = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        self.directory.cleanup()
+
+    def downloader(self, **kwargs) -> PubChemDownloader:
+        kwargs.setdefault("requests_per_second", 1000)
+        kwargs.setdefault("base_delay", 0.05)
+        return PubChemDownloader(base_url=str(self.server.make_url("")), **kwargs)
+
+    async def test_requests_are_rate_limited(self):
+        async with self.downloader(requests_per_second=40) as downloader:
+            started = time.monotonic()
+            results = [data async for _, data in downloader.fetch_many(range(1, 81))]
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(len(results), 80)
+        self.assertEqual(len(self.pubchem.requests), 80)
+        # A full bucket lets the first 40 through; the other 40 need a second at 40 per second
+        self.assertGreaterEqual(elapsed, 0.95)
+
+    async def test_token_bucket_paces_after_the_burst(self):
+        bucket = TokenBucket(rate=20, capacity=1)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+    async def test_429_and_5xx_are_retried_with_backoff(self):
+        self.pubchem.scripts[2244] = [503, 429]
+        async with self.downloader(max_retries=3) as downloader:
+            started = time.monotonic()
+            data = await downloader.fetch(2244)
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(data["Record"]["RecordTitle"], "Compound 2244")
+        self.assertEqual(self.pubchem.count(2244), 3)
+        # base_delay after the first attempt, twice that after the second
+        self.assertGreaterEqual(elapsed, 0.15)
+
+    async def test_gives_up_after_max_retries(self):
+        self.pubchem.scripts[2244] = [500, 502, 503, 500]
+        async with self.downloader(max_retries=3) as downloader:
+            self.assertIsNone(await downloader.fetch_bytes(2244))
+        self.assertEqual(self.pubchem.count(2244), 3)
+
+    async def test_404_is_not_retried(self):
+        self.pubchem.scripts[1] = [404]
+        self.pubchem.scripts[2] = [404]
+        async with self.downloader(max_retries=3) as downloader:
+            with self.assertRaises(RecordNotFound) as raised:
+                await downloader.fetch(1)
+            with self.assertRaises(RecordNotFound):
+                await downloader.fetch_streamed(2)
+        self.assertEqual(raised.exception.status, 404)
+        self.assertEqual((self.pubchem.count(1), self.pubchem.count(2)), (1, 1))
+
+    async def test_stored_responses_are_revalidated_with_their_etag(self):
+        self.pubchem.etags[2244] = '"v1"'
+        store = RawResponseStore(os.path.join(self.directory.name, "store"))
+        self.addCleanup(store.close)
+        async with self.downloader(store=store) as downloader:
+            first = await downloader.fetch_bytes(2244)
+            second = await downloader.fetch_bytes(2244)
+            fetched, drug = await downloader.fetch_streamed(2244)
+
+        self.assertEqual(first, record_body(2244))
+        self.assertEqual(second, first)
+        self.assertTrue(fetched)
+        self.assertEqual(drug.record_title, "Compound 2244")
+        headers = [headers for _, _, headers in self.pubchem.requests]
+        self.assertNotIn("If-None-Match", headers[0])
+        self.assertEqual(headers[1].get("If-None-Match"), '"v1"')
+        self.assertEqual(headers[2].get("If-None-Match"), '"v1"')
+        self.assertEqual(store.lookup(2244).etag, '"v1"')
+
+    async def test_offline_replay_never_reaches_the_server(self):
+        store = RawResponseStore(os.path.join(self.directory.name, "store"))
+        self.addCleanup(store.close)
+        store.save(2244, record_body(2244))
+        async with self.downloader(store=store, offline=True) as downloader:
+            self.assertEqual(await downloader.fetch_bytes(2244), record_body(2244))
+            self.assertIsNone(await downloader.fetch_bytes(3672))
+        self.assertEqual(self.pubchem.requests, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
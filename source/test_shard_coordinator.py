@@ -0,0 +1,162 @@
+"""Shard leases on the SQLite store, and the statements sent to Snowflake. Run with: python -m unittest test_shard_coordinator"""
+import os
+import re
+import tempfile
+import threading
+import unittest
+from contextlib import contextmanager
+
+from shard_coordinator import CLAIMED, DONE, PENDING, SHARD_TABLE, ShardCoordinator, SnowflakeLeaseStore, SQLiteLeaseStore
+
+
+class FakeSnowflakeCursor:
+    """Records statements; executemany() rejects what snowflake-connector cannot rewrite into multi-row VALUES."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        if "?" in sql:
+            raise AssertionError(f"qmark placeholder sent to a pyformat connection: {sql}")
+        if sql.count("%s") != len(params):
+            raise AssertionError(f"{sql.count('%s')} placeholders for {len(params)} values")
+        self.connection.statements.append((sql, list(params)))
+        self.rowcount = self.connection.rowcount
+        self._rows = self.connection.rows if sql.lstrip().upper().startswith("SELECT") else []
+
+    def executemany(self, sql, seq_of_params):
+        if re.match(r"\s*INSERT\s+INTO", sql, re.IGNORECASE) and not re.search(r"\bVALUES\b", sql, re.IGNORECASE):
+            raise RuntimeError("Failed to rewrite multi-row insert")
+        for params in seq_of_params:
+            self.execute(sql, params)
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeSnowflakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.rows = []
+        self.rowcount = 0
+
+    def cursor(self):
+        return FakeSnowflakeCursor(self)
+
+    def commit(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, connection):
+        self.connection = connection
+
+    @contextmanager
+    def acquire(self):
+        yield self.connection
+
+
+class SnowflakeStatementTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = FakeSnowflakeConnection()
+        self.coordinator = ShardCoordinator(SnowflakeLeaseStore(FakePool(self.connection)), worker_id="w1")
+        self.connection.statements.clear()
+
+    def test_shards_are_created_with_one_merge_per_batch(self):
+        created = self.coordinator.create_shards(0, 1_499_999, shard_size=1000)
+
+        self.assertEqual(created, 1500)
+        self.assertEqual(len(self.connection.statements), 2)
+        for sql, params in self.connection.statements:
+            self.assertIn(f"MERGE INTO {SHARD_TABLE}", sql)
+            self.assertIn("WHEN NOT MATCHED THEN INSERT", sql)
+            self.assertNotIn("NOT EXISTS", sql)
+        first_params = self.connection.statements[0][1]
+        self.assertEqual(len(first_params), 1000 * 5)
+        self.assertEqual(first_params[:5], [0, 0, 999, PENDING, first_params[4]])
+
+    def test_claim_skips_duplicate_rows_and_gives_up(self):
+        # Two rows for shard 0: the version-guarded UPDATE matches both
+        self.connection.rows = [(0, 0, 999, 0, 0)]
+        self.connection.rowcount = 2
+
+        self.assertIsNone(self.coordinator.claim(rounds=3))
+        updates = [sql for sql, _ in self.connection.statements if sql.lstrip().startswith("UPDATE")]
+        self.assertEqual(len(updates), 3)
+
+
+class SQLiteLeaseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "leases.sqlite")
+        self.coordinator = self.worker("w1")
+
+    def tearDown(self):
+        self.coordinator.close()
+        self.directory.cleanup()
+
+    def worker(self, worker_id, **kwargs):
+        return ShardCoordinator(SQLiteLeaseStore(self.path), worker_id=worker_id, **kwargs)
+
+    def test_create_shards_is_idempotent_and_aligned(self):
+        self.assertEqual(self.coordinator.create_shards(501, 2500, shard_size=1000), 3)
+        self.assertEqual(self.coordinator.create_shards(0, 3999, shard_size=1000), 4)
+
+        self.assertEqual(self.coordinator.counts(), {PENDING: 4})
+        shard = self.coordinator.claim()
+        self.assertEqual((shard.shard_id, shard.start_id, shard.end_id), (0, 501, 999))
+
+    def test_concurrent_claims_never_share_a_shard(self):
+        self.coordinator.create_shards(0, 49_999, shard_size=1000)
+        claimed = []
+        lock = threading.Lock()
+
+        def run(worker_id):
+            coordinator = self.worker(worker_id)
+            while True:
+                shard = coordinator.claim()
+                if shard is None:
+                    break
+                with lock:
+                    claimed.append(shard.shard_id)
+                coordinator.complete(shard)
+            coordinator.close()
+
+        threads = [threading.Thread(target=run, args=(f"w{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(claimed), list(range(0, 50_000, 1000)))
+        self.assertEqual(self.coordinator.counts(), {DONE: 50})
+
+    def test_unfinished_shard_is_released_until_max_attempts(self):
+        coordinator = self.worker("w2", max_attempts=2)
+        coordinator.create_shards(0, 999, shard_size=1000)
+
+        for attempt in (1, 2):
+            shard = coordinator.claim()
+            self.assertEqual(shard.attempts, attempt)
+            with coordinator.hold(shard, finished=lambda: False):
+                pass
+            self.assertEqual(coordinator.counts(), {PENDING: 1})
+        self.assertIsNone(coordinator.claim())
+        coordinator.close()
+
+    def test_finished_shard_is_completed(self):
+        self.coordinator.create_shards(0, 999, shard_size=1000)
+        shard = self.coordinator.claim()
+        self.assertEqual(self.coordinator.counts(), {CLAIMED: 1})
+        with self.coordinator.hold(shard, finished=lambda: True):
+            pass
+        self.assertEqual(self.coordinator.counts(), {DONE: 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
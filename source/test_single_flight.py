@@ -0,0 +1,107 @@
+"""SingleFlight under concurrent identical requests. Run with: python -m unittest test_single_flight"""
+import threading
+import unittest
+from typing import Iterator, List
+
+from single_flight import SingleFlight
+
+SESSIONS = 8
+MODEL = "mistral-large2"
+PROMPT = "What is aspirin used for?"
+
+
+class StubBackend:
+    """A start(model, prompt) callable that blocks until released, so every session joins the same call."""
+
+    def __init__(self, pieces: List[str], error: Exception = None):
+        self.pieces = pieces
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, model: str, prompt: str) -> Iterator[str]:
+        with self._lock:
+            self.calls += 1
+        if not self.release.wait(timeout=10):
+            raise TimeoutError("backend was never released")
+        for piece in self.pieces:
+            yield piece
+        if self.error is not None:
+            raise self.error
+
+
+def run_sessions(flight: SingleFlight, backend: StubBackend, cacheable: bool = False) -> List[object]:
+    """Start SESSIONS identical streams together; each result is the joined answer or the exception raised."""
+    start = threading.Barrier(SESSIONS)
+    joined = threading.Barrier(SESSIONS + 1)
+    results: List[object] = [None] * SESSIONS
+
+    def session(i: int) -> None:
+        start.wait()
+        pieces = flight.stream(MODEL, PROMPT, backend, cacheable=cacheable)
+        joined.wait()
+        try:
+            results[i] = "".join(pieces)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(SESSIONS)]
+    for thread in threads:
+        thread.start()
+    # Every session has a stream before the backend produces anything
+    joined.wait(timeout=10)
+    backend.release.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_identical_requests_share_one_backend_call(self):
+        flight = SingleFlight()
+        backend = StubBackend(["Aspirin ", "relieves ", "pain."])
+        results = run_sessions(flight, backend)
+
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(flight.backend_calls, 1)
+        self.assertEqual(flight.coalesced, SESSIONS - 1)
+        self.assertEqual(results, ["Aspirin relieves pain."] * SESSIONS)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_error_reaches_every_follower(self):
+        flight = SingleFlight()
+        backend = StubBackend(["Aspirin "], error=RuntimeError("COMPLETE failed"))
+        results = run_sessions(flight, backend, cacheable=True)
+
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(flight.coalesced, SESSIONS - 1)
+        for result in results:
+            self.assertIsInstance(result, RuntimeError)
+            self.assertEqual(str(result), "COMPLETE failed")
+        # A failed answer is not cached
+        self.assertEqual(flight.stats()["answer_cache"]["entries"], 0)
+
+    def test_second_round_is_a_cache_hit(self):
+        flight = SingleFlight()
+        backend = StubBackend(["Aspirin ", "relieves ", "pain."])
+        first = run_sessions(flight, backend, cacheable=True)
+        second = run_sessions(flight, backend, cacheable=True)
+
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(flight.backend_calls, 1)
+        self.assertEqual(flight.coalesced, SESSIONS - 1)
+        self.assertEqual(first, ["Aspirin relieves pain."] * SESSIONS)
+        self.assertEqual(second, first)
+
+    def test_history_dependent_answers_are_not_cached(self):
+        flight = SingleFlight()
+        backend = StubBackend(["Aspirin relieves pain."])
+        backend.release.set()
+        self.assertEqual("".join(flight.stream(MODEL, PROMPT, backend)), "Aspirin relieves pain.")
+        self.assertEqual("".join(flight.stream(MODEL, PROMPT, backend)), "Aspirin relieves pain.")
+        self.assertEqual(backend.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
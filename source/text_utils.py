@@ -0,0 +1,7 @@
+"""Text helpers with no dependencies, shared by the caches and the chat path."""
+import re
+
+
+def normalize_query(query: str) -> str:
+    """Fold the differences that do not change what Cortex Search returns: case, spacing, end punctuation."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
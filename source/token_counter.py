@@ -0,0 +1,47 @@
+import threading
+from typing import Optional
+
+_tokenizer = None
+_tokenizer_failed = False
+_lock = threading.Lock()
+
+
+def get_tokenizer(name: str = "gpt2"):
+    """The GPT-2 tokenizer the ingestion chunker uses, loaded on first use; None if transformers is missing."""
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is not None or _tokenizer_failed:
+        return _tokenizer
+    with _lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            try:
+                from transformers import GPT2TokenizerFast
+
+                _tokenizer = GPT2TokenizerFast.from_pretrained(name)
+            except Exception as e:
+                print(f"Tokenizer unavailable, estimating token counts from length: {e}")
+                _tokenizer_failed = True
+    return _tokenizer
+
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        # Roughly four characters per token for English text
+        return max(1, len(text) // 4)
+    return len(tokenizer.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """The first (or, with keep_end, the last) max_tokens tokens of text."""
+    if max_tokens <= 0 or not text:
+        return ""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        limit = max_tokens * 4
+        return text[-limit:] if keep_end else text[:limit]
+    ids = tokenizer.encode(text)
+    if len(ids) <= max_tokens:
+        return text
+    return tokenizer.decode(ids[-max_tokens:] if keep_end else ids[:max_tokens])